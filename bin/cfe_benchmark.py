@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+# Times the code feature extractor on generated programs with deeply nested
+# if/else chains inside the draw loop. Each program has twice as many statements
+# as the one before it, so the time per statement should stay roughly flat.
+#
+# Usage: bin/cfe_benchmark.py [max_depth]
+#
+# esprima parses recursively, so depths past about 200 hit Python's recursion
+# limit before the extractor sees the program.
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib.assessment.code_feature_extractor import CodeFeatures
+
+# Returns a program whose draw loop holds `depth` if/else statements, each nested
+# in the else branch of the one before it and each moving a sprite.
+def nested_program(depth):
+    lines = ['var player = createSprite(200, 200);', 'function draw() {']
+    for level in range(depth):
+        lines.append('  ' * (level + 1) + f'if (player.x > {level}) {{')
+        lines.append('  ' * (level + 2) + 'player.x = player.x + 1;')
+        lines.append('  ' * (level + 1) + '} else {')
+    lines.append('  ' * (depth + 1) + 'player.y = randomNumber(0, 400);')
+    for level in reversed(range(depth)):
+        lines.append('  ' * (level + 1) + '}')
+    lines.append('  drawSprites();')
+    lines.append('}')
+    return '\n'.join(lines)
+
+def main():
+    max_depth = int(sys.argv[1]) if len(sys.argv) > 1 else 128
+    print(f"{'depth':>8} {'statements':>12} {'seconds':>10} {'us/statement':>14}")
+    depth = 8
+    while depth <= max_depth:
+        code = nested_program(depth)
+        statements = 2 * depth + 3
+        start = time.perf_counter()
+        CodeFeatures().extract_features(code)
+        elapsed = time.perf_counter() - start
+        print(f"{depth:>8} {statements:>12} {elapsed:>10.4f} {elapsed / statements * 1e6:>14.1f}")
+        depth *= 2
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+# Times removing comments from generated student projects of doubling size with the
+# single-pass stripper in lib/assessment/js_comments.py and with the regular
+# expression Label.remove_js_comments used before it. The last column shows whether
+# both gave the same result; the regular expression mistakes the apostrophe in a
+# template literal and the quote in a regular expression for the start of strings.
+#
+# Usage: bin/comment_strip_benchmark.py [max_lines]
+
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib.assessment.js_comments import strip_js_comments
+
+# The regular expression Label.remove_js_comments used to remove comments with
+def regex_strip_js_comments(code):
+    pattern = r'(".*?[^\\]"|\'.*?[^\\]\'|/\*.*?\*/|//.*?$)'
+
+    def replacer(match):
+        if match.group(0).startswith(("'", '"')):
+            return match.group(0)
+        return ''
+
+    return re.sub(pattern, replacer, code, flags=re.DOTALL | re.MULTILINE)
+
+SNIPPET = '''// Move the player with the arrow keys
+var player = createSprite(200, 200);
+player.setAnimation("player_1");
+var score = 0; /* points so far */
+function draw() {
+  background("white");
+  if (keyDown("left")) {
+    player.x = player.x - 5; // left
+  }
+  text("Score: " + score + ' // not a comment', 10, 20);
+  var message = `Level ${Math.floor(score / 10)} of 5`;
+  var tip = `don't press // here`;
+  var name = player.name.replace(/"/g, "");
+  drawSprites();
+}
+'''
+
+def main():
+    max_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    snippet_lines = SNIPPET.count('\n')
+    print(f"{'lines':>8} {'regex (s)':>10} {'single pass (s)':>16} {'same result':>12}")
+    copies = 1
+    while copies * snippet_lines <= max_lines:
+        code = SNIPPET * copies
+        timings = []
+        results = []
+        for strip in [regex_strip_js_comments, strip_js_comments]:
+            start = time.perf_counter()
+            results.append(strip(code))
+            timings.append(time.perf_counter() - start)
+        print(f"{copies * snippet_lines:>8} {timings[0]:>10.4f} {timings[1]:>16.4f} {str(results[0] == results[1]):>12}")
+        copies *= 4
+
+if __name__ == '__main__':
+    main()
@@ -7,32 +7,17 @@ import json
 import logging
 
 # Import our support classes
-from lib.assessment.config import SUPPORTED_MODELS, DEFAULT_MODEL, VALID_LABELS
+from lib.assessment.config import SUPPORTED_MODELS, DEFAULT_MODEL, VALID_LABELS, BATCH_MAX_WORKERS
 from lib.assessment.label import Label
 
 class KeyConceptError(Exception):
   pass
 
 def validate_and_label(code, prompt, rubric, examples=[], api_key='', llm_model=DEFAULT_MODEL, num_responses=1, temperature=0.2, remove_comments=False, response_type='tsv', code_feature_extractor=None, lesson=None):
-  OPENAI_API_KEY = api_key
+  if not set_api_key(api_key, llm_model):
+    return {}
 
-  # Set the key
-  if "gpt" in llm_model:
-    if OPENAI_API_KEY:
-      os.environ['OPENAI_API_KEY'] = OPENAI_API_KEY
-    elif not 'OPENAI_API_KEY' in os.environ:
-      logging.error("Must set OPENAI_API_KEY!")
-      return {}
-    else:
-      logging.info("Using OPENAI_API_KEY from OS environment")
-
-  # Validate example key concepts against rubric.
-  for i, ex in enumerate(examples):
-    rubric_key_concepts = list(set(row['Key Concept'] for row in csv.DictReader(rubric.splitlines())))
-    example_key_concepts = get_example_key_concepts(ex[1], response_type)
-    if rubric_key_concepts != example_key_concepts:
-      logging.error(f"Mismatch between rubric and example key concepts for example {i}: Rubric: {rubric_key_concepts} | Example: {example_key_concepts}")
-      raise KeyConceptError(f"Mismatch between rubric and example key concepts for example {i}: Rubric: {rubric_key_concepts} | Example: {example_key_concepts}")
+  validate_examples(rubric, examples, response_type)
 
   label = Label()
   return label.label_student_work(
@@ -49,6 +34,111 @@ def validate_and_label(code, prompt, rubric, examples=[], api_key='', llm_model=
       lesson=lesson,
   )
 
+# Asynchronous counterpart of validate_and_label for callers on an event loop
+async def validate_and_label_async(code, prompt, rubric, examples=[], api_key='', llm_model=DEFAULT_MODEL, num_responses=1, temperature=0.2, remove_comments=False, response_type='tsv', code_feature_extractor=None, lesson=None):
+  if not set_api_key(api_key, llm_model):
+    return {}
+
+  validate_examples(rubric, examples, response_type)
+
+  label = Label()
+  return await label.label_student_work_async(
+      prompt, rubric, code, "student",
+      examples=examples,
+      num_responses=num_responses,
+      temperature=temperature,
+      llm_model=llm_model,
+      remove_comments=remove_comments,
+      response_type=response_type,
+      code_feature_extractor=code_feature_extractor,
+      lesson=lesson,
+  )
+
+# Validates the request like validate_and_label, then returns a generator of the
+# (event, data) pairs of a streamed assessment. Returns None when no API key is available.
+def validate_and_label_stream(code, prompt, rubric, examples=[], api_key='', llm_model=DEFAULT_MODEL, num_responses=1, temperature=0.2, remove_comments=False, response_type='tsv', code_feature_extractor=None, lesson=None):
+  if not set_api_key(api_key, llm_model):
+    return None
+
+  validate_examples(rubric, examples, response_type)
+
+  label = Label()
+  return label.label_student_work_stream(
+      prompt, rubric, code, "student",
+      examples=examples,
+      num_responses=num_responses,
+      temperature=temperature,
+      llm_model=llm_model,
+      remove_comments=remove_comments,
+      response_type=response_type,
+      code_feature_extractor=code_feature_extractor,
+      lesson=lesson,
+  )
+
+# Labels many student submissions against the same prompt, rubric and examples.
+# The rubric and examples are validated once, then each submission is labeled on
+# a bounded thread pool. Returns a list of (student_id, labels, error) tuples in
+# the order the submissions were given, where exactly one of labels or error is set.
+def validate_and_label_batch(submissions, prompt, rubric, examples=[], api_key='', llm_model=DEFAULT_MODEL, num_responses=1, temperature=0.2, remove_comments=False, response_type='tsv', code_feature_extractor=None, lesson=None, max_workers=BATCH_MAX_WORKERS):
+  if not set_api_key(api_key, llm_model):
+    return []
+
+  validate_examples(rubric, examples, response_type)
+
+  label = Label()
+
+  def label_submission(submission):
+    student_id, code = submission
+    try:
+      labels = label.label_student_work(
+          prompt, rubric, code, student_id,
+          examples=examples,
+          use_cached=False,
+          write_cached=False,
+          num_responses=num_responses,
+          temperature=temperature,
+          llm_model=llm_model,
+          remove_comments=remove_comments,
+          response_type=response_type,
+          code_feature_extractor=code_feature_extractor,
+          lesson=lesson,
+      )
+    except Exception as e:
+      logging.warning(f"{student_id} batch assessment failed: {type(e).__name__}: {e}")
+      return student_id, None, e
+    return student_id, labels, None
+
+  if len(submissions) == 0:
+    return []
+
+  workers = max(1, min(max_workers, len(submissions)))
+  with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+    return list(executor.map(label_submission, submissions))
+
+# Set the key. Returns False when an OpenAI model is requested and no key is available.
+def set_api_key(api_key, llm_model):
+  OPENAI_API_KEY = api_key
+
+  if "gpt" in llm_model:
+    if OPENAI_API_KEY:
+      os.environ['OPENAI_API_KEY'] = OPENAI_API_KEY
+    elif not 'OPENAI_API_KEY' in os.environ:
+      logging.error("Must set OPENAI_API_KEY!")
+      return False
+    else:
+      logging.info("Using OPENAI_API_KEY from OS environment")
+
+  return True
+
+# Validate example key concepts against rubric.
+def validate_examples(rubric, examples, response_type):
+  for i, ex in enumerate(examples):
+    rubric_key_concepts = list(set(row['Key Concept'] for row in csv.DictReader(rubric.splitlines())))
+    example_key_concepts = get_example_key_concepts(ex[1], response_type)
+    if rubric_key_concepts != example_key_concepts:
+      logging.error(f"Mismatch between rubric and example key concepts for example {i}: Rubric: {rubric_key_concepts} | Example: {example_key_concepts}")
+      raise KeyConceptError(f"Mismatch between rubric and example key concepts for example {i}: Rubric: {rubric_key_concepts} | Example: {example_key_concepts}")
+
 def get_example_key_concepts(example_response, response_type):
     if response_type == 'tsv':
         return list(set(row['Key Concept'] for row in csv.DictReader(example_response.splitlines(), delimiter="\t")))
@@ -0,0 +1,56 @@
+# Asynchronous access to the LLM APIs, so one event loop can wait on many assessments
+# at once with only a few threads. OpenAI chat completions are posted with aiohttp over
+# keep-alive connections. boto3 has no asyncio support, so Bedrock calls (and any other
+# blocking work) run on a bounded pool of threads and are awaited.
+
+import os
+import asyncio
+import functools
+import concurrent.futures
+from threading import Lock
+
+import aiohttp
+
+from lib.assessment.config import OPENAI_API_TIMEOUT, OPENAI_CONNECT_TIMEOUT, ASYNC_OPENAI_CONNECTIONS, ASYNC_BLOCKING_THREADS
+
+# aiohttp sessions belong to the event loop they were created on, so each loop has its own
+_openai_sessions = {}
+_blocking_executor = None
+_lock = Lock()
+
+# Returns the OpenAI session of the running event loop, creating it on first use
+def get_openai_session():
+    loop = asyncio.get_running_loop()
+    with _lock:
+        session = _openai_sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=int(os.getenv('ASYNC_OPENAI_CONNECTIONS', ASYNC_OPENAI_CONNECTIONS)))
+            timeout = aiohttp.ClientTimeout(sock_connect=min(OPENAI_CONNECT_TIMEOUT, OPENAI_API_TIMEOUT), sock_read=OPENAI_API_TIMEOUT)
+            session = _openai_sessions[loop] = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return session
+
+# Closes the OpenAI session of the running event loop, if it has one
+async def close_openai_session():
+    with _lock:
+        session = _openai_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+# Posts a JSON request to the OpenAI API. Returns the status, content type and text of the
+# response. Raises asyncio.TimeoutError when the API does not answer in OPENAI_API_TIMEOUT seconds.
+async def post_openai(api_url, headers, data):
+    async with get_openai_session().post(api_url, headers=headers, json=data) as response:
+        return response.status, response.headers.get('Content-Type'), await response.text()
+
+def get_blocking_executor():
+    global _blocking_executor
+    if _blocking_executor is None:
+        with _lock:
+            if _blocking_executor is None:
+                workers = int(os.getenv('ASYNC_BLOCKING_THREADS', ASYNC_BLOCKING_THREADS))
+                _blocking_executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='blocking')
+    return _blocking_executor
+
+# Runs fn(*args, **kwargs) on the blocking thread pool and returns its result
+async def run_blocking(fn, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(get_blocking_executor(), functools.partial(fn, *args, **kwargs))
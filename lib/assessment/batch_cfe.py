@@ -0,0 +1,66 @@
+# Labels many submissions with the code feature extractor in one pass. Features
+# are still extracted from each submission (in the process pool when CFE_WORKERS
+# is set), but they are then reduced to a row of numbers per submission, and each
+# decision tree's thresholds are checked for every row at once with NumPy array
+# operations.
+
+import csv
+
+import numpy as np
+
+from lib.assessment.cfe_pool import pooled_extract_features_many
+from lib.assessment.decision_trees import FeatureIndex, get_lesson_trees
+
+# Returns a matrix with a row for each feature dictionary and a column for each
+# named feature value (see decision_trees.feature_values), in the order given.
+def feature_matrix(feature_sets, names):
+    matrix = np.zeros((len(feature_sets), len(names)))
+    for row, features in enumerate(feature_sets):
+        index = FeatureIndex(features)
+        matrix[row] = [index.count(name) for name in names]
+    return matrix
+
+# Returns the label of each row of a feature matrix under a compiled decision
+# tree. columns maps the name of each feature value to its column.
+def tree_labels(tree, matrix, columns):
+    if not tree.labels:
+        return [tree.default] * len(matrix)
+
+    conditions = []
+    for label, checks in tree.labels:
+        condition = np.ones(len(matrix), dtype=bool)
+        for name, compare, threshold in checks:
+            condition &= compare(matrix[:, columns[name]], threshold)
+        conditions.append(condition)
+    return np.select(conditions, [label for label, checks in tree.labels], default=tree.default).tolist()
+
+# Labels the rubric's Key Concepts that are listed in code_feature_extractor for
+# every submission, given as (student_id, code) pairs. Returns (student_id, results)
+# pairs in the order given, where results has the same labels and reasons as
+# Label.cfe_label_student_work. Evidence is not collected in a batch.
+def batch_cfe_label_student_work(submissions, rubric, code_feature_extractor, lesson):
+    learning_goals = [row for row in csv.DictReader(rubric.splitlines()) if row["Key Concept"] in code_feature_extractor]
+    trees = get_lesson_trees(lesson)
+
+    names = sorted(set([name for goal in learning_goals if goal["Key Concept"] in trees for name in trees[goal["Key Concept"]].threshold_names()]))
+    columns = {name: column for column, name in enumerate(names)}
+    matrix = feature_matrix(pooled_extract_features_many([code for student_id, code in submissions]), names)
+
+    labels = {}
+    for learning_goal in learning_goals:
+        tree = trees.get(learning_goal["Key Concept"])
+        labels[learning_goal["Key Concept"]] = tree_labels(tree, matrix, columns) if tree else [''] * len(submissions)
+
+    results = []
+    for row, (student_id, code) in enumerate(submissions):
+        data = []
+        for learning_goal in learning_goals:
+            label = labels[learning_goal["Key Concept"]][row]
+            data.append({"Label": label,
+                         "Key Concept": learning_goal["Key Concept"],
+                         "Observations": '',
+                         "Reason": learning_goal[label] if label else '',
+                         "Evidence": [],
+                         })
+        results.append((student_id, {"metadata": {"agent": "code feature extractor", "batch": True}, "data": data}))
+    return results
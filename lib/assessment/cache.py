@@ -0,0 +1,100 @@
+# Key/value caches with least-recently-used eviction and an optional time to
+# live. Values must be JSON serializable. Both caches keep hit and miss counts.
+
+import copy
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from threading import Lock
+
+# Keeps entries in memory. Values are copied on the way in and out so callers
+# can modify what they get back without changing the cached entry.
+class LRUCache:
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.time() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+# Keeps entries in a SQLite database so they can be shared between processes
+# and survive restarts.
+class SqliteCache:
+    def __init__(self, path, max_size, ttl=None, table='cache'):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._table = table
+        self._lock = Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL)")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute(f"SELECT value, created FROM {self._table} WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._connection.execute(f"DELETE FROM {self._table} WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute(f"UPDATE {self._table} SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(f"INSERT OR REPLACE INTO {self._table} (key, value, created, accessed) VALUES (?, ?, ?, ?)", (key, json.dumps(value), now, now))
+            self._connection.execute(f"DELETE FROM {self._table} WHERE key IN (SELECT key FROM {self._table} ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_size,))
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute(f"DELETE FROM {self._table}")
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            size = self._connection.execute(f"SELECT COUNT(*) FROM {self._table}").fetchone()[0]
+            return {'hits': self.hits, 'misses': self.misses, 'size': size}
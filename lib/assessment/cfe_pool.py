@@ -0,0 +1,90 @@
+# Optional process pool for code feature extraction. esprima parsing is CPU bound
+# pure Python, so extracting features in worker processes keeps concurrent
+# requests from serializing on the GIL. The pool is sized with the CFE_WORKERS
+# environment variable; with no workers, features are extracted in the calling
+# thread.
+
+import concurrent.futures
+import hashlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+
+from lib.assessment import code_feature_extractor
+from lib.assessment.code_feature_extractor import CodeFeatures
+from lib.assessment.config import CFE_WORKERS
+
+# Identifies the version of the code feature extractor, so features extracted by an older
+# version are not reused: a hash of its source.
+def _extractor_version():
+    with open(code_feature_extractor.__file__, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+EXTRACTOR_VERSION = _extractor_version()
+
+def extract_features(code):
+    cfe = CodeFeatures()
+    cfe.extract_features(code)
+    return cfe.features
+
+# Runs once in each worker as it starts, so the first request a worker handles
+# does not pay for importing and warming up the parser.
+def _warm_worker():
+    extract_features("function draw() {}")
+
+_pool = None
+_pool_lock = Lock()
+
+def cfe_workers():
+    return int(os.getenv('CFE_WORKERS', CFE_WORKERS))
+
+# Returns the process-wide pool, creating it on first use, or None when
+# CFE_WORKERS is 0. Workers are spawned rather than forked, since the service
+# forks from a process that is already running threads.
+def get_cfe_pool():
+    global _pool
+    workers = cfe_workers()
+    if workers <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                logging.info(f"creating code feature extractor pool with {workers} workers")
+                _pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=_warm_worker)
+    return _pool
+
+# Drops a broken pool so the next call creates a new one
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+# Extracts the features of one submission, in the pool when there is one. A
+# broken pool (for instance a worker that was killed) is replaced, and the
+# features are extracted in the calling thread instead.
+def pooled_extract_features(code):
+    pool = get_cfe_pool()
+    if pool is None:
+        return extract_features(code)
+    try:
+        return pool.submit(extract_features, code).result()
+    except BrokenProcessPool as e:
+        logging.warning(f"code feature extractor pool failed, extracting in thread: {e}")
+        _discard_pool(pool)
+        return extract_features(code)
+
+# Extracts the features of many submissions, spread over the pool when there is one
+def pooled_extract_features_many(codes):
+    pool = get_cfe_pool()
+    if pool is None:
+        return [extract_features(code) for code in codes]
+    try:
+        return list(pool.map(extract_features, codes, chunksize=max(1, len(codes) // (4 * cfe_workers()))))
+    except BrokenProcessPool as e:
+        logging.warning(f"code feature extractor pool failed, extracting in thread: {e}")
+        _discard_pool(pool)
+        return [extract_features(code) for code in codes]
@@ -31,6 +31,9 @@ sprite_functions = ['setAnimation']
 # List of object properties that are used for movement
 obj_movement_props = ['x', 'y', 'velocityX', 'velocityY', 'rotation']
 
+# Most syntax errors to skip over in a program before the rest of it is ignored
+max_parse_recoveries = 20
+
 # List of functions that allow user interaction
 user_interaction_functions = ['keyDown', 
                               'keyWentDown', 
@@ -44,7 +47,8 @@ user_interaction_functions = ['keyDown',
 
 # This class contains delegate and helper functions to extract relevant features
 # from code for assessment. New features should be added to the features dictionary.
-# Add delegate function definitions to the extract_features function.
+# Add calls to extractor functions to the delegate in the extract_features function,
+# under the type of node they apply to.
 class CodeFeatures:
 
   def __init__(self):
@@ -65,6 +69,19 @@ class CodeFeatures:
     # info about the extracted features
     self.nodes = []
 
+    # Summaries of the statements parsed so far, keyed by node id
+    self.summaries = {}
+
+    # Regions of lines skipped because of syntax errors, with the error message
+    self.skipped_regions = []
+
+    # Indexes over the features dictionary, kept up to date as features are
+    # added so extractors can look them up without scanning the feature lists
+    self.objects_by_identifier = {}
+    self.variable_identifiers = set()
+    self.user_functions_by_name = {}
+    self.function_call_counts = {}
+
   # Helper function for parsing binary expressions.
   # Outputs a dictionary containing both sides of the expression and the operator
   def binary_expression_helper(self, expression):
@@ -124,67 +141,63 @@ class CodeFeatures:
         args = arg_values
     return {"function": called_func, "args": args, 'user_interaction': user_interaction, "start": expression.loc.start.line, "end": expression.loc.end.line}
       
-  # Helper function to analyze all statements in the draw loop. Sends statements
-  # to their respective helper functions for parsing based on statement type.
-  # Returns a list of all statement outputs.
+  # Helper function to summarize a single statement in a block. Sends the statement
+  # to its respective helper function for parsing based on statement type, and
+  # returns a list of its outputs (a variable declaration may declare several).
+  # The parser visits children before their parents, so summaries are kept and
+  # each statement is only parsed once, however deeply it is nested.
+  def statement_helper(self, statement, context="statement"):
+    summary = self.summaries.get(id(statement))
+    if summary is not None and summary[0] is statement:
+      return summary[1]
+
+    outputs = []
+    match statement.type:
+      case "ExpressionStatement":
+        match statement.expression.type:
+          case "CallExpression":
+            outputs.append(self.call_expression_helper(statement.expression))
+          case "AssignmentExpression":
+            outputs.append(self.variable_assignment_helper(statement))
+          case "UpdateExpression":
+            outputs.append(self.update_expression_helper(statement.expression))
+          case _:
+            logging.info(f"{context} outlier expression: {statement.expression.type}")
+            logging.debug(f"{context} outlier expression: {statement.expression}")
+      case "VariableDeclaration":
+        outputs.extend(self.variable_declaration_helper(statement))
+      case "IfStatement":
+        outputs.append(self.if_statement_helper(statement))
+      case "FunctionDeclaration":
+        outputs.append(self.function_def_helper(statement))
+      case _:
+        logging.info(f"{context} outlier statement: {statement.type}")
+        logging.debug(f"{context} outlier statement: {statement}")
+
+    # Keep the node alongside its summary so its id cannot be reused while cached
+    self.summaries[id(statement)] = (statement, outputs)
+    return outputs
+
+  # Helper function to summarize every statement in a block
+  def block_helper(self, statements, context):
+    block = []
+    for statement in statements:
+      block.extend(self.statement_helper(statement, context))
+    return block
+
+  # Helper function to analyze all statements in the draw loop. Returns a list of
+  # all statement outputs.
   def draw_loop_helper(self, node):
     if node.type == "FunctionDeclaration" and node.id.name == "draw":
       self.features['draw_loop']['start'] = node.loc.start.line
       self.features['draw_loop']['end'] = node.loc.end.line
-      draw_loop_body = []
-      for statement in node.body.body:
-        match statement.type:
-          case "ExpressionStatement":
-            match statement.expression.type:
-              case "CallExpression":
-                draw_loop_body.append(self.call_expression_helper(statement.expression))
-              case "AssignmentExpression":
-                draw_loop_body.append(self.variable_assignment_helper(statement))
-              case "UpdateExpression":
-                draw_loop_body.append(self.update_expression_helper(statement.expression))
-              case _:
-                logging.info(f"draw loop outlier expression: {statement.expression.type}")
-                logging.debug(f"draw loop outlier expression: {statement.expression}")
-          case "VariableDeclaration":
-            for declaration in self.variable_declaration_helper(statement):
-              draw_loop_body.append(declaration)
-          case "IfStatement":
-            draw_loop_body.append(self.if_statement_helper(statement))
-          case "FunctionDeclaration":
-            draw_loop_body.append(self.function_def_helper(statement))
-          case _:
-            logging.info(f"draw loop outlier statement: {statement.type}")
-            logging.debug(f"draw loop outlier statement: {statement}")
-      return draw_loop_body
+      return self.block_helper(node.body.body, "draw loop")
 
   def function_def_helper(self, node):
     if node.type == "FunctionDeclaration" and node.id.name != "draw":
       start = node.loc.start.line
       end = node.loc.end.line
-      function_body = []
-      for statement in node.body.body:
-        match statement.type:
-          case "ExpressionStatement":
-            match statement.expression.type:
-              case "CallExpression":
-                function_body.append(self.call_expression_helper(statement.expression))
-              case "AssignmentExpression":
-                function_body.append(self.variable_assignment_helper(statement))
-              case "UpdateExpression":
-                function_body.append(self.update_expression_helper(statement.expression))
-              case _:
-                logging.info(f"draw loop outlier expression: {statement.expression.type}")
-                logging.debug(f"draw loop outlier expression: {statement.expression}")
-          case "VariableDeclaration":
-            for declaration in self.variable_declaration_helper(statement):
-              function_body.append(declaration)
-          case "IfStatement":
-            function_body.append(self.if_statement_helper(statement))
-          case "FunctionDeclaration":
-            function_body.append(self.function_def_helper(statement))
-          case _:
-            logging.info(f"draw loop outlier statement: {statement.type}")
-            logging.debug(f"draw loop outlier statement: {statement}")
+      function_body = self.block_helper(node.body.body, "function")
       return {"function": node.id.name, "body": function_body, "start": start, "end": end, "calls": 0}
 
   # Helper function to parse all statements in an if block
@@ -207,69 +220,34 @@ class CodeFeatures:
         case _:
           logging.info(f"conditional test outlier: {node.test.type}")
           logging.debug(f"conditional test outlier: {node.test}")
-      consequent = []
-      for statement in node.consequent.body:
-        match statement.type:
-          case "ExpressionStatement":
-            match statement.expression.type:
-              case "CallExpression":
-                consequent.append(self.call_expression_helper(statement.expression))
-              case "AssignmentExpression":
-                consequent.append(self.variable_assignment_helper(statement))
-              case "UpdateExpression":
-                consequent.append(self.update_expression_helper(statement.expression))
-              case _:
-                logging.info(f"conditional consequent outlier expression: {statement.expression.type}")
-                logging.debug(f"conditional consequent outlier expression: {statement.expression}")
-          case "VariableDeclaration":
-            for declaration in self.variable_declaration_helper(statement):
-              consequent.append(declaration)
-          case "IfStatement":
-            consequent.append(self.if_statement_helper(statement))
-          case "FunctionDeclaration":
-            consequent.append(self.function_def_helper(statement))
-          case _:
-            logging.info(f"conditional consequent outlier statement: {statement.type}")
-            logging.debug(f"conditional consequent outlier statement: {statement}")
+      consequent = self.block_helper(node.consequent.body, "conditional consequent")
       alternate = []
       if node.alternate and node.alternate.body:
-        for statement in node.alternate.body:
-          match statement.type:
-            case "ExpressionStatement":
-              match statement.expression.type:
-                case "CallExpression":
-                  alternate.append(self.call_expression_helper(statement.expression))
-                case "AssignmentExpression":
-                  alternate.append(self.variable_assignment_helper(statement))
-                case "UpdateExpression":
-                  alternate.append(self.update_expression_helper(statement.expression))
-                case _:
-                  logging.info(f"conditional alternate outlier expression: {statement.expression.type}")
-                  logging.debug(f"conditional alternate outlier expression: {statement.expression}")
-            case "VariableDeclaration":
-              for declaration in self.variable_declaration_helper(statement):
-                alternate.append(declaration)
-            case "IfStatement":
-              alternate.append(self.if_statement_helper(statement))
-            case "FunctionDeclaration":
-              alternate.append(self.function_def_helper(statement))
-            case _:
-              logging.info(f"conditional alternate outlier statement: {statement.type}")
-              logging.debug(f"conditional alternate outlier statement: {statement}")
+        alternate = self.block_helper(node.alternate.body, "conditional alternate")
       return {"test": test, "consequent": consequent, "alternate": alternate, "start": node.loc.start.line, "end": node.loc.end.line}
 
   # This function is used to extract statements from all conditional paths,
   # including nested conditionals, for analysis
   def flatten_conditional_paths(self, conditional):
-    statements = conditional["consequent"]
-    if "alternate" in conditional:
-      statements.extend(conditional["alternate"])
-    nested_conditionals = [statement for statement in statements if "test" in statement]
-    if nested_conditionals:
-      for cond in nested_conditionals:
-       statements.extend(self.flatten_conditional_paths(cond))
-    statements = [statement for statement in statements if "test" not in statement]
-    return statements    
+    return list(self.conditional_statements(conditional))
+
+  # Generates the statements on every path through a conditional, without the
+  # nested conditionals themselves. Each conditional's own statements come first,
+  # followed by the statements of the conditionals nested in it, in order. The
+  # traversal uses a stack instead of recursion, so it takes time linear in the
+  # number of statements however deeply the conditionals are nested.
+  def conditional_statements(self, conditional):
+    stack = [conditional]
+    while stack:
+      conditional = stack.pop()
+      nested_conditionals = []
+      for statements in [conditional["consequent"], conditional.get("alternate", [])]:
+        for statement in statements:
+          if "test" in statement:
+            nested_conditionals.append(statement)
+          else:
+            yield statement
+      stack.extend(reversed(nested_conditionals))
 
   # Helper function to parse member expressions (i.e., an object and its property).
   # Returns a dict containing the object and the property being operated on.
@@ -338,21 +316,28 @@ class CodeFeatures:
           logging.debug(f"variable assignment outlier: {exp}")
     return {"assignee": output[0], "value": output[1], "start": node.loc.start.line, "end": node.loc.end.line}
   
-  # Extractor functions: These functions utilize helper functions to return
-  # information from nodes, then store the relevant code features in the
-  # features dictionary.
-
-  # Extract and store data about conditional test statements
-  def extract_conditionals(self, node):
-    # If node is the draw loop, make sure that all conditionals within the draw loop are flagged
-    draw_loop = self.draw_loop_helper(node)
-    if draw_loop:
-      for i, statement in enumerate(self.features['conditionals']):
-        if 'start' in statement and statement['start'] >= self.features['draw_loop']['start'] and statement['end'] <= self.features['draw_loop']['end']:
-          self.features['conditionals'][i]['draw_loop'] = True
-
-    # If node is a conditional, parse position and trigger information and save the test to features
-    conditional = self.if_statement_helper(node)
+  # Functions to store objects and variables in the features dictionary and its indexes
+  def add_object(self, obj):
+    self.features["objects"].append(obj)
+    self.objects_by_identifier.setdefault(obj["identifier"], obj)
+
+  def add_variable(self, variable):
+    self.features["variables"].append(variable)
+    self.variable_identifiers.add(variable["identifier"])
+
+  # Extractor functions: These functions store the relevant code features in the
+  # features dictionary, given a node and the summary the helper functions
+  # returned for it.
+
+  # Make sure that all conditionals within the draw loop are flagged
+  def extract_draw_loop_conditionals(self):
+    for i, statement in enumerate(self.features['conditionals']):
+      if 'start' in statement and statement['start'] >= self.features['draw_loop']['start'] and statement['end'] <= self.features['draw_loop']['end']:
+        self.features['conditionals'][i]['draw_loop'] = True
+
+  # Extract and store data about conditional test statements. Parses position and
+  # trigger information and saves the test to features.
+  def extract_conditionals(self, node, conditional):
     if conditional:
       if 'start' in self.features['draw_loop'].keys() and conditional['start'] >= self.features['draw_loop']['start'] and conditional['end'] <= self.features['draw_loop']['end']:
         conditional_info = {**conditional, 'draw_loop': True}
@@ -379,35 +364,36 @@ class CodeFeatures:
       self.nodes.append(node)
 
   # Extract and store information about user defined functions 
-  def extract_function_definitions(self, node):
-    func_def = self.function_def_helper(node)
+  def extract_function_definitions(self, node, func_def):
     if func_def:
-      if func_def['function'] in [call['function'] for call in self.features['function_calls']]:
-        func_def['calls'] += len([call for call in self.features['function_calls'] if call['function'] == func_def['function']])
+      # Copy the summary, since the stored definition counts its calls
+      func_def = dict(func_def)
+      func_def['calls'] += self.function_call_counts.get(func_def['function'], 0)
       if "start" in self.features["draw_loop"] and (func_def["start"] >= self.features["draw_loop"]["start"] and func_def["start"] <= self.features["draw_loop"]["end"]):
         func_def['draw_loop'] = True
       self.features['user_functions'].append(func_def)
+      self.user_functions_by_name.setdefault(func_def['function'], func_def)
       self.nodes.append(node)
 
-  def extract_function_calls(self, node):
-    if node.type == "ExpressionStatement" and node.expression.type == "CallExpression":
-      call = self.call_expression_helper(node.expression)
+  def extract_function_calls(self, node, call):
+    if call:
       self.features['function_calls'].append(call)
       self.nodes.append(node)
 
-      if len(self.features['user_functions']) > 0 and call['function'] in [func['function'] for func in self.features['user_functions']]:
-        i = [index for (index, func) in enumerate(self.features['user_functions']) if func['function'] == call['function']][0]
-        self.features['user_functions'][i]['calls'] += 1
-        self.nodes.append(node)
+      # Method calls are identified by a dict and can never call a user function
+      if isinstance(call['function'], str):
+        self.function_call_counts[call['function']] = self.function_call_counts.get(call['function'], 0) + 1
+        if call['function'] in self.user_functions_by_name:
+          self.user_functions_by_name[call['function']]['calls'] += 1
+          self.nodes.append(node)
 
   # Extract and store counter and random movement instances in features dictionary
-  def extract_movement_types(self, node):
-    draw_loop_info = self.draw_loop_helper(node)
+  def extract_movement_types(self, node, draw_loop_info):
     if draw_loop_info:
       for statement in draw_loop_info:
         if "assignee" in statement:
           if "object" in statement["assignee"] and "property" in statement["assignee"] and statement["assignee"]["property"] in obj_movement_props:
-            obj = [obj for obj in self.features["objects"] if obj["identifier"] == statement["assignee"]["object"]]
+            obj = self.objects_by_identifier.get(statement["assignee"]["object"])
             if obj:
               if isinstance(statement["value"], dict):
                 if "left" in statement["value"]:
@@ -425,24 +411,23 @@ class CodeFeatures:
                     self.nodes.append(node)
         if "operator" in statement and statement["operator"] in ["++", "--"]:
           if "object" in statement["argument"] and "property" in statement["argument"] and statement["argument"]["property"] in obj_movement_props:
-            obj = [obj for obj in self.features["objects"] if obj["identifier"] == statement["argument"]["object"]]
+            obj = self.objects_by_identifier.get(statement["argument"]["object"])
             if obj:
               self.features["movement"]["counter"]["count"] += 1
               self.features["movement"]["counter"]["lines"].append({'start': statement["start"], 'end': statement["end"]})
               self.nodes.append(node)
         if "test" in statement:
-          conditional_body = self.flatten_conditional_paths(statement)
-          for conditional_statement in conditional_body:
+          for conditional_statement in self.conditional_statements(statement):
             if "operator" in conditional_statement and conditional_statement["operator"] in ["++", "--"]:
               if "object" in conditional_statement["argument"] and "property" in conditional_statement["argument"] and conditional_statement["argument"]["property"] in obj_movement_props:
-                obj = [obj for obj in self.features["objects"] if obj["identifier"] == conditional_statement["argument"]["object"]]
+                obj = self.objects_by_identifier.get(conditional_statement["argument"]["object"])
                 if obj:
                   self.features["movement"]["counter"]["count"] += 1
                   self.features["movement"]["counter"]["lines"].append({'start': statement["start"], 'end': statement["end"]})
                   self.nodes.append(node)
             if "assignee" in conditional_statement:
               if "object" in conditional_statement["assignee"] and "property" in conditional_statement["assignee"] and conditional_statement["assignee"]["property"] in obj_movement_props:
-                obj = [obj for obj in self.features["objects"] if obj["identifier"] == conditional_statement["assignee"]["object"]]
+                obj = self.objects_by_identifier.get(conditional_statement["assignee"]["object"])
                 if obj:
                   if isinstance(conditional_statement["value"], dict):
                     if "left" in conditional_statement["value"]:
@@ -461,67 +446,67 @@ class CodeFeatures:
                         self.nodes.append(node)
 
   # Extract and store all object and variable data, including object types
-  def extract_object_and_variable_data(self, node):
+  def extract_object_and_variable_data(self, node, summary):
     if node.type == "VariableDeclaration":
-      for node_info in self.variable_declaration_helper(node):
-        if node_info["identifier"] not in [obj["identifier"] for obj in self.features["objects"]] and node_info["identifier"] not in [var["identifier"] for var in self.features["variables"]]:
+      for node_info in summary:
+        if node_info["identifier"] not in self.objects_by_identifier and node_info["identifier"] not in self.variable_identifiers:
           if isinstance(node_info["value"], dict) and "function" in node_info["value"]:
             if node_info["value"]["function"] == "createSprite":
-              self.features["objects"].append({"identifier": node_info["identifier"], "properties": node_info["value"]["args"], "type": "sprite", "start": node_info["start"], "end": node_info["end"]})
+              self.add_object({"identifier": node_info["identifier"], "properties": node_info["value"]["args"], "type": "sprite", "start": node_info["start"], "end": node_info["end"]})
               self.features["object_types"]["sprites"] += 1
               self.nodes.append(node)
             elif node_info["value"]["function"] == "text":
-              self.features["objects"].append({"identifier": node_info["identifier"], "properties": node_info["value"]["args"], "type": "text", "start": node_info["start"], "end": node_info["end"]})
+              self.add_object({"identifier": node_info["identifier"], "properties": node_info["value"]["args"], "type": "text", "start": node_info["start"], "end": node_info["end"]})
               self.features["object_types"]["text"] += 1
               self.nodes.append(node)
             elif node_info["value"]["function"] in shape_functions:
-              self.features["objects"].append({"identifier": node_info["identifier"], "properties": node_info["value"]["args"], "type": "shape", "start": node_info["start"], "end": node_info["end"]})
+              self.add_object({"identifier": node_info["identifier"], "properties": node_info["value"]["args"], "type": "shape", "start": node_info["start"], "end": node_info["end"]})
               self.features["object_types"]["shapes"] += 1
               self.nodes.append(node)
             else:
-              self.features["variables"].append({"identifier": node_info["identifier"], "properties": node_info["value"]["args"], "type": "none", "start": node_info["start"], "end": node_info["end"]})
+              self.add_variable({"identifier": node_info["identifier"], "properties": node_info["value"]["args"], "type": "none", "start": node_info["start"], "end": node_info["end"]})
               self.nodes.append(node)
           else:
-            self.features["variables"].append({"identifier": node_info["identifier"], "value": node_info["value"], "start": node_info["start"], "end": node_info["end"]})
+            self.add_variable({"identifier": node_info["identifier"], "value": node_info["value"], "start": node_info["start"], "end": node_info["end"]})
             self.nodes.append(node)
     elif node.type == "ExpressionStatement" and node.expression.type == "CallExpression":
-      node_info = self.call_expression_helper(node.expression)
+      node_info = summary[0]
       if node_info["function"] == "background":
-        self.features["objects"].append({"identifier": '', "properties": node_info["args"], "type": "background", "start": node_info["start"], "end": node_info["end"]})
+        self.add_object({"identifier": '', "properties": node_info["args"], "type": "background", "start": node_info["start"], "end": node_info["end"]})
         self.nodes.append(node)
       elif node_info["function"] == "text":
-        self.features["objects"].append({"identifier": '', "properties": node_info["args"], "type": "text", "start": node_info["start"], "end": node_info["end"]})
+        self.add_object({"identifier": '', "properties": node_info["args"], "type": "text", "start": node_info["start"], "end": node_info["end"]})
         self.features["object_types"]["text"] += 1
         self.nodes.append(node)
       elif node_info["function"] in shape_functions:
-        self.features["objects"].append({"identifier": '', "properties": node_info["args"], "type": "shape", "start": node_info["start"], "end": node_info["end"]})
+        self.add_object({"identifier": '', "properties": node_info["args"], "type": "shape", "start": node_info["start"], "end": node_info["end"]})
         self.features["object_types"]["shapes"] += 1
         self.nodes.append(node)
 
+  # For any properties that change in the drawloop, change "draw_loop" to true
+  def extract_draw_loop_properties(self, node):
+    new_properties = []
+    for property in self.features["property_change"]:
+      if property["start"] >= self.features['draw_loop']['start'] and property["end"] <= self.features['draw_loop']['end']:
+        property["draw_loop"] = True
+      new_properties.append(property)
+    self.features["property_change"] = new_properties
+    self.nodes.append(node)
+
   #Extract and store all object properties that are updated
-  def extract_property_assignment(self, node):
-    draw_loop = self.draw_loop_helper(node)
-    if draw_loop:
-      # For any properties that change in the drawloop, change "draw_loop" to true
-      new_properties = []
-      for property in self.features["property_change"]:
-        if property["start"] >= self.features['draw_loop']['start'] and property["end"] <= self.features['draw_loop']['end']:
-          property["draw_loop"] = True
-        new_properties.append(property)
-      self.features["property_change"] = new_properties
-      self.nodes.append(node)
-    elif node.type == "ExpressionStatement" and node.expression.type == "CallExpression":
-      node_info = self.call_expression_helper(node.expression)
+  def extract_property_assignment(self, node, summary):
+    if node.expression.type == "CallExpression":
+      node_info = summary[0]
       if type(node_info["function"]) is dict and all([k in node_info["function"].keys() for k in ["object", "method"]]) and node_info["function"]["method"] in sprite_functions:
         self.features["property_change"].append({**node_info["function"], "draw_loop":False})
         self.nodes.append(node)
-    elif node.type == "ExpressionStatement" and node.expression.type == "AssignmentExpression":
-      node_info = self.variable_assignment_helper(node)
+    elif node.expression.type == "AssignmentExpression":
+      node_info = summary[0]
       if type(node_info["assignee"]) is dict and all([k in node_info["assignee"].keys() for k in ["object", "property"]]):
         self.features["property_change"].append({**node_info["assignee"], "draw_loop":False})
         self.nodes.append(node)
-    elif node.type == "ExpressionStatement" and node.expression.type == "UpdateExpression":
-      node_info = self.update_expression_helper(node.expression)
+    elif node.expression.type == "UpdateExpression":
+      node_info = summary[0]
       if type(node_info["argument"]) is dict and node_info["operator"] in ["++", "--", "~"] and all([k in node_info["argument"].keys() for k in ["object", "property"]]):
         self.features["property_change"].append({**node_info["argument"], "draw_loop":False})
         self.nodes.append(node)
@@ -530,30 +515,74 @@ class CodeFeatures:
   # to be used with the parser. Does not return any values, but should populate
   # the features dictionary with values based on parse results
   def extract_features(self, program):
+    lines = program.split('\n')
+
+    # Position of the first character of each line, so the program can be parsed
+    # from any line without splitting it again
+    line_starts = [0]
+    for line in lines[:-1]:
+      line_starts.append(line_starts[-1] + len(line) + 1)
+
+    # Number of lines before the part of the program being parsed. Node lines are
+    # shifted by it, so they are line numbers in the whole program.
+    line_offset = 0
 
     # Function to parse code using esprima. If the code reaches an error state that
     # esprima cannot handle, it will be logged, and parsing will continue from
-    # the next line of code.
-    def parse_code(program):
-      try:
-        parsed = esprima.parseScript(program, {'tolerant': True, 'comment': True, 'loc': True}, delegate)
-      except Exception as e:
-        err = str(e)
-        if "Line" in err:
-          logging.error(err)
-          line_num = int(err.replace("Line ", "").split(":")[0])
-          program_slice = '\n'.join(program.split('\n')[line_num:])
-          parse_code(program_slice)
-        else:
-          logging.error(f"Parsing error: {err}")
+    # the line after the error, at most max_parse_recoveries times. Lines that
+    # could not be parsed are recorded in skipped_regions.
+    def parse_code():
+      nonlocal line_offset
+      recoveries = 0
+      while line_offset < len(lines):
+        try:
+          esprima.parseScript(program[line_starts[line_offset]:], {'tolerant': True, 'comment': True, 'loc': True}, delegate)
+          return
+        except Exception as e:
+          err = str(e)
+          if not err.startswith("Line"):
+            logging.error(f"Parsing error: {err}")
+            self.skipped_regions.append({'start': line_offset + 1, 'end': len(lines), 'error': err})
+            return
 
-    # Delegate function to run feature extractors during code parsing
+          logging.error(err)
+          error_line = line_offset + int(err.replace("Line ", "").split(":")[0])
+          if recoveries == max_parse_recoveries:
+            logging.error(f"Stopped parsing after {recoveries} syntax errors")
+            self.skipped_regions.append({'start': error_line, 'end': len(lines), 'error': err})
+            return
+          self.skipped_regions.append({'start': error_line, 'end': error_line, 'error': err})
+          recoveries += 1
+          line_offset = error_line
+
+    # Delegate function to run feature extractors during code parsing. Each node
+    # is summarized once, and the summary is shared by the extractors for its type.
     def delegate(node, metadata):
-      self.extract_object_and_variable_data(node)
-      self.extract_movement_types(node)
-      self.extract_property_assignment(node)
-      self.extract_conditionals(node)
-      self.extract_function_definitions(node)
-      self.extract_function_calls(node)
-
-    parse_code(program)
+      # Children are visited before their parents, so every node is shifted once
+      # before any helper reads its lines
+      if line_offset:
+        node.loc.start.line += line_offset
+        node.loc.end.line += line_offset
+
+      match node.type:
+        case "VariableDeclaration":
+          self.extract_object_and_variable_data(node, self.statement_helper(node))
+        case "ExpressionStatement":
+          summary = self.statement_helper(node)
+          self.extract_object_and_variable_data(node, summary)
+          self.extract_property_assignment(node, summary)
+          if node.expression.type == "CallExpression":
+            self.extract_function_calls(node, summary[0])
+        case "IfStatement":
+          self.extract_conditionals(node, self.statement_helper(node)[0])
+        case "FunctionDeclaration" if node.id.name == "draw":
+          draw_loop = self.draw_loop_helper(node)
+          if draw_loop:
+            self.extract_movement_types(node, draw_loop)
+            self.extract_draw_loop_properties(node)
+            self.extract_draw_loop_conditionals()
+        case "FunctionDeclaration":
+          self.extract_function_definitions(node, self.statement_helper(node)[0])
+
+    parse_code()
+    self.summaries = {}
@@ -24,3 +24,101 @@ LESSONS = ['csd3-2023-L7','csd3-2023-L11','csd3-2023-L14','csd3-2023-L18','csd3-
 DEFAULT_DATASET_NAME = 'contractor-grades-batch-1-fall-2023'
 
 OPENAI_API_TIMEOUT = 150
+
+# Connections to the OpenAI API are kept alive and shared by all requests, so most assessments
+# skip the TCP and TLS handshakes. The pool keeps as many connections as waitress has threads
+# (see the Dockerfile); busier moments open extra connections that are closed after use.
+# Override with the OPENAI_POOL_SIZE environment variable. Connecting waits at most
+# OPENAI_CONNECT_TIMEOUT seconds (or OPENAI_API_TIMEOUT, when shorter), and the response at most
+# OPENAI_API_TIMEOUT seconds.
+OPENAI_POOL_SIZE = 8
+OPENAI_CONNECT_TIMEOUT = 10
+
+# The asynchronous assessment path (src/asgi.py) keeps at most ASYNC_OPENAI_CONNECTIONS connections
+# to the OpenAI API open at once, and runs blocking work (Bedrock calls, code feature extraction and
+# the routes served by Flask) on ASYNC_BLOCKING_THREADS threads. Override with the environment
+# variables of the same names.
+ASYNC_OPENAI_CONNECTIONS = 200
+ASYNC_BLOCKING_THREADS = 32
+
+# When true, models starting with 'local.' are served by a stand-in that labels every Key Concept
+# No Evidence without calling any API (see providers.py), for exercising the service end to end
+# without credentials. Never enable it in production. Override with the LOCAL_PROVIDER environment
+# variable ('1' enables), which is read once at startup.
+LOCAL_PROVIDER = False
+
+# Failover across models. When the requested model is in LLM_FALLBACK_CHAIN, an assessment that
+# fails with a server error or a timeout is retried with the models after it in the chain, for
+# example ['bedrock.us.anthropic.claude-sonnet-4-5-20250929-v1:0',
+# 'bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0', 'gpt-4-turbo-2024-04-09']. With
+# LLM_HEDGE_PERCENTILE set (for example 95), a request that is still running after that percentile
+# of the recent latencies of its model is hedged: the next model in the chain is asked as well, and
+# the first response is used. Hedging starts once LLM_HEDGE_MIN_SAMPLES of the last
+# LLM_LATENCY_SAMPLES calls to the model have been timed, and hedged requests run on
+# LLM_HEDGE_THREADS threads. Override with the environment variables of the same names (the chain
+# comma separated).
+LLM_FALLBACK_CHAIN = []
+LLM_HEDGE_PERCENTILE = None
+LLM_HEDGE_MIN_SAMPLES = 20
+LLM_LATENCY_SAMPLES = 200
+LLM_HEDGE_THREADS = 32
+
+# Client-side rate limits per model, so bursts of assessments are queued instead of being throttled
+# by Bedrock or refused by OpenAI. Maps model names to any of 'requests_per_minute',
+# 'tokens_per_minute' (estimated from the size of the prompt) and 'max_concurrent' (requests in
+# flight at once), for example
+# {'gpt-4-turbo-2024-04-09': {'requests_per_minute': 500, 'tokens_per_minute': 300000}}.
+# Models without limits are not queued. Override with the LLM_RATE_LIMITS environment variable,
+# holding the same mapping as JSON.
+LLM_RATE_LIMITS = {}
+
+# Upper bound on the number of submissions labeled concurrently by a single batch request,
+# and on the number of submissions a single batch request may contain.
+BATCH_MAX_WORKERS = 8
+BATCH_MAX_SUBMISSIONS = 100
+
+# Asynchronous assessment jobs. The store is 'memory' or 'sqlite', and can be
+# overridden with the ASSESSMENT_JOB_STORE and ASSESSMENT_JOB_STORE_PATH environment variables.
+JOB_WORKERS = 32
+JOB_MAX_PENDING = 1000
+JOB_RESULT_TTL = 60 * 60
+JOB_STORE = 'memory'
+JOB_STORE_PATH = 'assessment_jobs.sqlite'
+
+# Cache of assessment responses keyed on everything that affects the result. The backend is
+# 'memory', 'sqlite' or 'none', and can be overridden with the RESPONSE_CACHE, RESPONSE_CACHE_SIZE,
+# RESPONSE_CACHE_TTL and RESPONSE_CACHE_PATH environment variables.
+RESPONSE_CACHE = 'memory'
+RESPONSE_CACHE_SIZE = 1024
+RESPONSE_CACHE_TTL = 24 * 60 * 60
+RESPONSE_CACHE_PATH = 'response_cache.sqlite'
+
+# When true, the response cache is keyed on a canonical form of the student code (comments,
+# whitespace and line endings removed), so edits that only touch formatting reuse the previous
+# assessment. Override with the RESPONSE_CACHE_NORMALIZE_CODE environment variable ('0' disables).
+RESPONSE_CACHE_NORMALIZE_CODE = True
+
+# Most Bedrock calls made at once for a single assessment when more than one response is
+# requested. Override with the BEDROCK_MAX_CONCURRENT_SAMPLES environment variable.
+BEDROCK_MAX_CONCURRENT_SAMPLES = 4
+
+# When true, multiple responses are requested in waves and no more are requested once the
+# majority label of every Key Concept can no longer change. Override with the ADAPTIVE_CONSENSUS
+# environment variable ('1' enables).
+ADAPTIVE_CONSENSUS = False
+
+# Threads shared by all requests for running the code feature extractor alongside the LLM request.
+# Override with the CFE_THREADS environment variable.
+CFE_THREADS = 8
+
+# Cache of the features extracted from student code, keyed on a hash of the code. The backend is
+# 'memory', 'sqlite' or 'none', and can be overridden with the FEATURE_CACHE, FEATURE_CACHE_SIZE
+# and FEATURE_CACHE_PATH environment variables.
+FEATURE_CACHE = 'memory'
+FEATURE_CACHE_SIZE = 4096
+FEATURE_CACHE_PATH = 'feature_cache.sqlite'
+
+# Worker processes for code feature extraction. esprima parsing is pure Python, so with 0 (the
+# default) it runs in the calling thread and concurrent requests share the GIL. Override with
+# the CFE_WORKERS environment variable.
+CFE_WORKERS = 0
@@ -1,3 +1,164 @@
+# Static assessment of learning goals from the features extracted by the code
+# feature extractor. Each lesson's decision trees are described by rules in
+# decision_tree_rules.json: every tree lists the evidence functions to run and
+# the thresholds on named feature values for each label, checked in order.
+
+import json
+import operator
+import os
+from threading import Lock
+
+from lib.assessment.config import VALID_LABELS
+
+# Rule file used when the DECISION_TREE_RULES_PATH environment variable is not set
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(__file__), 'decision_tree_rules.json')
+
+# Shape functions counted by the U3L7 'Position - Shapes' tree
+l7_shape_functions = ["rect", "ellipse", "line", "arc", "point", "regularPolygon", "shape"]
+
+# Comparisons allowed in rule thresholds
+comparisons = {">=": operator.ge, ">": operator.gt, "==": operator.eq, "<=": operator.le, "<": operator.lt}
+
+class DecisionTreeRuleError(Exception):
+  pass
+
+# Lookups derived from a code feature dictionary that are shared by several
+# decision trees. Build one per feature dictionary and pass it to every
+# DecisionTrees.assess call for those features, so it is only computed once.
+class FeatureIndex:
+  def __init__(self, features):
+    self.features = features
+
+    # Identifiers of all sprite objects
+    self.sprites = set([obj["identifier"] for obj in features["objects"] if obj["type"] == "sprite"])
+
+    # Property changes on sprites in code order, keyed by whether they are in the draw loop
+    self.sprite_property_changes = {True: [], False: []}
+    for prop in features["property_change"]:
+      if prop["object"] in self.sprites:
+        self.sprite_property_changes[prop["draw_loop"] == True].append(prop)
+
+    # Sprites that have a property set inside the draw loop (including calling setAnimation)
+    self.sprites_updated_in_draw = set([prop["object"] for prop in self.sprite_property_changes[True]])
+
+    # Sprite animations and velocities set outside the draw loop
+    self.sprite_animations = [prop for prop in self.sprite_property_changes[False] if "method" in prop.keys() and prop["method"] == "setAnimation"]
+    self.sprite_velocities = [prop for prop in self.sprite_property_changes[False] if "property" in prop.keys() and "velocity" in prop["property"]]
+
+    # Named feature values that have been computed so far
+    self.values = {}
+
+  # Returns the named feature value, computing it on first use
+  def value(self, name):
+    if name not in self.values:
+      self.values[name] = feature_values[name](self.features, self)
+    return self.values[name]
+
+  # Returns the named feature value as a number. Lists and sets count their items.
+  def count(self, name):
+    value = self.value(name)
+    return len(value) if isinstance(value, (list, set, dict)) else value
+
+# Named feature values that rules may use as evidence arguments and in thresholds.
+# Each is computed from the features and the FeatureIndex at most once per submission.
+feature_values = {
+  'data': lambda features, index: features,
+  'shapes': lambda features, index: features["object_types"]["shapes"],
+  'sprites': lambda features, index: features["object_types"]["sprites"],
+  'text': lambda features, index: features["object_types"]["text"],
+  'total_elements': lambda features, index: index.value('shapes') + index.value('sprites') + index.value('text'),
+  'other_elements': lambda features, index: index.value('shapes') + index.value('text'),
+  'random_movement': lambda features, index: features["movement"]["random"]["count"],
+  'counter_movement': lambda features, index: features["movement"]["counter"]["count"],
+  'movement': lambda features, index: index.value('random_movement') + index.value('counter_movement'),
+  'l7_shapes': lambda features, index: [shape for shape in features["function_calls"] if shape["function"] in l7_shape_functions],
+  'l7_different_shapes': lambda features, index: set([shape["function"] for shape in index.value('l7_shapes')]),
+  'sprites_updated_in_draw': lambda features, index: index.sprites_updated_in_draw,
+  'sprites_with_animation': lambda features, index: set([prop["object"] for prop in index.sprite_animations]),
+  'sprites_with_velocity': lambda features, index: set([prop["object"] for prop in index.sprite_velocities]),
+  'conditionals_in_draw_loop': lambda features, index: [statement for statement in features["conditionals"] if statement['draw_loop']],
+  'user_triggered_conditionals': lambda features, index: [statement for statement in index.value('conditionals_in_draw_loop') if statement['trigger'] == 'user'],
+  'variable_triggered_conditionals': lambda features, index: [statement for statement in index.value('conditionals_in_draw_loop') if statement['trigger'] == 'variable'],
+  'object_triggered_conditionals': lambda features, index: [statement for statement in index.value('conditionals_in_draw_loop') if statement['trigger'] == 'object'],
+  'state_triggered_conditionals': lambda features, index: index.value('variable_triggered_conditionals') + index.value('object_triggered_conditionals'),
+  'triggered_conditionals': lambda features, index: index.value('user_triggered_conditionals') + index.value('state_triggered_conditionals'),
+  'user_functions': lambda features, index: [func for func in features["user_functions"] if "draw_loop" not in func],
+  'user_function_calls': lambda features, index: [call for call in features["function_calls"] if isinstance(call["function"], str) and call["function"] in set([func["function"] for func in index.value('user_functions')])],
+  'functions_called': lambda features, index: len([func for func in features["user_functions"] if func['calls'] > 0]),
+  'functions_called_more_than_once': lambda features, index: len([func for func in features["user_functions"] if func['calls'] > 1]),
+}
+
+# A decision tree compiled from its rule. Each label has a list of threshold
+# checks (feature value name, comparison, threshold), tried in order until
+# every check of a label holds.
+class CompiledTree:
+  def __init__(self, evidence, labels, default):
+    self.evidence = evidence
+    self.labels = labels
+    self.default = default
+
+  # Saves the tree's evidence and assessment on the given DecisionTrees
+  def evaluate(self, decision_trees, index):
+    for function, args in self.evidence:
+      getattr(decision_trees, function)(*[index.value(arg) for arg in args])
+    for label, checks in self.labels:
+      if all(compare(index.count(name), threshold) for name, compare, threshold in checks):
+        decision_trees.assessment = label
+        return
+    decision_trees.assessment = self.default
+
+  # Names of the feature values the label thresholds use
+  def threshold_names(self):
+    return sorted(set([name for label, checks in self.labels for name, compare, threshold in checks]))
+
+# Returns the threshold checks for a rule's 'when'
+def compile_condition(when):
+  checks = []
+  for name, thresholds in when.items():
+    if name not in feature_values:
+      raise DecisionTreeRuleError(f"Unknown feature value: {name}")
+    for comparison, threshold in thresholds.items():
+      if comparison not in comparisons:
+        raise DecisionTreeRuleError(f"Unknown comparison {comparison} for {name}")
+      checks.append((name, comparisons[comparison], threshold))
+  return checks
+
+def compile_tree(rule):
+  evidence = []
+  for item in rule.get("evidence", []):
+    if not item["function"].endswith("_evidence") or not hasattr(DecisionTrees, item["function"]):
+      raise DecisionTreeRuleError(f"Unknown evidence function: {item['function']}")
+    unknown_args = [arg for arg in item.get("args", []) if arg not in feature_values]
+    if unknown_args:
+      raise DecisionTreeRuleError(f"Unknown feature value: {', '.join(unknown_args)}")
+    evidence.append((item["function"], item.get("args", [])))
+
+  for label in [level["label"] for level in rule["labels"]] + [rule["default"]]:
+    if label not in VALID_LABELS:
+      raise DecisionTreeRuleError(f"Invalid label: {label}")
+  labels = [(level["label"], compile_condition(level["when"])) for level in rule["labels"]]
+  return CompiledTree(evidence, labels, rule["default"])
+
+_rules = {}
+_compiled_trees = {}
+_rules_lock = Lock()
+
+# Returns the compiled decision trees for a lesson, keyed by Key Concept. Rules
+# are read from the rule file the first time it is used and each lesson is
+# compiled once, so every later assessment reuses the same trees.
+def get_lesson_trees(lesson, path=None):
+  path = path or os.getenv('DECISION_TREE_RULES_PATH', DEFAULT_RULES_PATH)
+  key = (path, lesson)
+  if key not in _compiled_trees:
+    with _rules_lock:
+      if key not in _compiled_trees:
+        if path not in _rules:
+          with open(path, 'r') as f:
+            _rules[path] = json.load(f)
+        lesson_rules = _rules[path].get(lesson, {})
+        _compiled_trees[key] = {key_concept: compile_tree(rule) for key_concept, rule in lesson_rules.items()}
+  return _compiled_trees[key]
+
 # Container for storing decision trees for static assessment of learning goals
 class DecisionTrees:
   def __init__(self):
@@ -8,30 +169,24 @@ class DecisionTrees:
     # Assessed score
     self.assessment = ''
 
+    # FeatureIndex for the features being assessed
+    self.feature_index = None
+
   # Function to assess a student project using features extracted by code
-  # feature extractor and relevant decision tree.
-  def assess(self, features, learning_goal, lesson):
-    match [learning_goal["Key Concept"], lesson]:
-      case ['Position - Shapes', 'csd3-2023-L7']:
-        self.u3l7_position_shapes_assessment(features)
-      case ['Position - Elements and the Coordinate System', 'csd3-2023-L11']:
-        self.u3l11_position_assessment(features)
-      case ['Modularity - Sprites and Sprite Properties', 'csd3-2023-L14']:
-        self.u3l14_modularity_assessment(features)
-      case ['Position and Movement', 'csd3-2023-L14']:
-        self.u3l14_position_assessment(features)
-      case ['Algorithms and Control - Conditionals', 'csd3-2023-L18']:
-        self.u3l18_algorithms_conditionals_assessment(features)
-      case ['Modularity - Multiple Sprites', 'csd3-2023-L18']:
-        self.u3l18_modularity_assessment(features)
-      case ['Position and Movement', 'csd3-2023-L18']:
-        self.u3l18_position_assessment(features)
-      case ['Modularity - Multiple Sprites', 'csd3-2023-L21']:
-        self.u3l21_modularity_assessment(features)
-      case ['Modularity - Multiple Sprites', 'csd3-2023-L24']:
-        self.u3l24_modularity_assessment(features)
-      case ['Modularity - Use of Functions', 'csd3-2023-L28']:
-        self.u3l28_modularity_functions_assess(features)
+  # feature extractor and the lesson's decision tree for the learning goal.
+  # A FeatureIndex already built for the features may be given to share it
+  # between assessments. Learning goals without a tree are left unassessed.
+  def assess(self, features, learning_goal, lesson, index=None):
+    self.feature_index = index
+    tree = get_lesson_trees(lesson).get(learning_goal["Key Concept"])
+    if tree:
+      tree.evaluate(self, self.get_feature_index(features))
+
+  # Returns the FeatureIndex for a feature dictionary, building it on first use
+  def get_feature_index(self, data):
+    if self.feature_index is None or self.feature_index.features is not data:
+      self.feature_index = FeatureIndex(data)
+    return self.feature_index
 
   # Evidence generation functions
   def save_evidence_string(self, start, end, message):
@@ -82,23 +237,11 @@ class DecisionTrees:
         self.save_evidence_string(prop["start"], prop["end"], f"{prop['object']} object updated by its {prop['method']} method {'in' if prop['draw_loop'] else 'outside of'} the draw loop")
 
   def animation_evidence(self, data):
-    sprite_animations = [prop for prop in data["property_change"] if any([obj["identifier"] == prop["object"] and
-                         obj["type"]=="sprite" for obj in data["objects"]]) and 
-                         prop["draw_loop"] == False and 
-                         "method" in prop.keys() and 
-                         prop["method"] == "setAnimation"
-                        ]
-    for prop in sprite_animations:
+    for prop in self.get_feature_index(data).sprite_animations:
       self.save_evidence_string(prop["start"], prop["end"], f"{prop['object']} sprite's animation is properly set")
 
   def velocity_evidence(self, data):
-    velocity_sprites = [prop for prop in data["property_change"] if any([obj["identifier"] == prop["object"] and
-                        obj["type"]=="sprite" for obj in data["objects"]]) and 
-                        prop["draw_loop"] == False and
-                        "property" in prop.keys() and 
-                        "velocity" in prop["property"]
-                       ]
-    for prop in velocity_sprites:
+    for prop in self.get_feature_index(data).sprite_velocities:
       self.save_evidence_string(prop["start"], prop["end"], f"{prop['object']} object's velocity updated outside of the draw loop")
 
   def user_trigger_conditional_evidence(self, data):
@@ -120,323 +263,3 @@ class DecisionTrees:
   def function_call_evidence(self, data):
     for statement in data:
       self.save_evidence_string(statement['start'], statement['end'], f"call to {statement['function']} function")
-      
-  # All decision tree functions should receive the code feature dictionary from the
-  # CodeFeatureExtractor class when called.
-
-  # Function to statically assess U3L11 'Position - Elements and the Coordinate System'
-  def u3l7_position_shapes_assessment(self, data):
-
-    l7_shape_funcs = ["rect", "ellipse", "line", "arc", "point", "regularPolygon", "shape"]
-
-    shapes_list = [shape for shape in data["function_calls"] if shape["function"] in l7_shape_funcs]
-    diff_shapes = set([shape["function"] for shape in shapes_list])
-    diff_shapes_num = len(diff_shapes)
-    self.different_shapes_evidence(shapes_list, diff_shapes)
-
-    # Extensive Evidence: At least 4 shapes
-    if diff_shapes_num >= 4:
-      self.assessment = "Extensive Evidence"
-
-    # Convincing Evidence: At least 3 shapes
-    elif diff_shapes_num >= 3:
-      self.assessment = "Convincing Evidence"
-
-    # Limited Evidence: At least 1 shape.
-    elif diff_shapes_num >= 1:
-      self.assessment =  "Limited Evidence"
-
-    # No Evidence: No shapes
-    else:
-      self.assessment =  "No Evidence"
-
-  # Function to statically assess U3L11 'Position - Elements and the Coordinate System'
-  def u3l11_position_assessment(self, data):
-
-    shapes = data["object_types"]["shapes"]
-    sprites = data["object_types"]["sprites"]
-    text = data["object_types"]["text"]
-    total_elements = shapes + sprites + text
-    self.object_types_evidence(data, shapes, sprites, text)
-
-    # Extensive Evidence: At least 2 shapes, 2 sprites, and 2 lines of text
-    if shapes >= 2 and sprites >= 2 and text >= 2:
-      self.assessment = "Extensive Evidence"
-
-    # Convincing Evidence: At least 1 shape, 2 sprites, and 1 line of text
-    elif shapes >= 1 and sprites >= 2 and text >= 1:
-      self.assessment = "Convincing Evidence"
-
-    # Limited Evidence: A cumulative total of at least 2 elements (one of which is text) are placed on the screen using the coordinate system (e.g., 1 sprite and 1 line of text or 1 shape and 1 line of text).
-    elif total_elements >= 2 and text >= 1:
-      self.assessment =  "Limited Evidence"
-
-    # No Evidence: Consists solely of sprites or shapes with no inclusion of text, or it lacks any elements (shapes, sprites, or text) positioned on the screen using the coordinate system
-    else:
-      self.assessment =  "No Evidence"
-
-  def u3l14_modularity_assessment(self, data):
-    sprites = data["object_types"]["sprites"]
-
-    sprites_updated_in_draw = set([property["object"] for property in data["property_change"] if
-                                   any([obj["identifier"] == property["object"] and
-                                        obj["type"]=="sprite" for obj in data["objects"]])
-                                  and property["draw_loop"] == True])
-    
-    self.sprites_evidence(data, sprites)
-    self.object_props_updated_evidence(data)
-
-    # Extensive Evidence: At least 2 sprites, at least 2 of them have properties updated in the draw loop
-    if sprites >= 2 and len(sprites_updated_in_draw) >= 2:
-      self.assessment = "Extensive Evidence"
-
-    # Convincing Evidence: At least 1 sprites, at least 1 of them have properties updated in the draw loop
-    elif sprites >= 1 and len(sprites_updated_in_draw) >= 1:
-      self.assessment = "Convincing Evidence"
-
-    # Limited Evidence: At least 1 sprites
-    elif sprites >= 1:
-      self.assessment = "Limited Evidence"
-
-    # No Evidence: No sprites
-    else:
-      self.assessment = "No Evidence"
-
-  # Function to statically assess U3L14 'Position and Movement'
-  def u3l14_position_assessment(self, data):
-    shapes = data["object_types"]["shapes"]
-    sprites = data["object_types"]["sprites"]
-    text = data["object_types"]["text"]
-    total_elements = shapes + sprites + text
-
-    random = data["movement"]["random"]["count"]
-    counter = data["movement"]["counter"]["count"]
-    movement = random + counter
-    self.object_types_evidence(data, shapes, sprites, text)
-    self.movement_types_evidence(data, random, counter)
-
-    # Extensive Evidence: At least 2 shapes, 2 sprites, 2 lines of text, and 2 types of movement
-    if shapes >= 2 and sprites >= 2 and text >= 2 and random > 0 and counter > 0:
-      self.assessment = "Extensive Evidence"
-
-    # Convincing Evidence: At least 1 shape, 2 sprites, 1 line of text, and some movement
-    elif shapes >= 1 and sprites >= 2 and text >= 1 and movement > 0:
-      self.assessment = "Convincing Evidence"
-
-    # Limited Evidence: A cumulative of at least a total of 3 elements
-    elif total_elements >= 3:
-      self.assessment = "Limited Evidence"
-
-    # No Evidence: No elements placed using the coordinate system.
-    else:
-      self.assessment = "No Evidence"
-
-  def u3l18_algorithms_conditionals_assessment(self, data):
-
-    # Retrieve all conditionals executed in the draw loop
-    conditionals_in_draw_loop = [statement for statement in data["conditionals"] if statement['draw_loop']]
-    
-    # Retrieve all conditionals executed in the draw loop that are triggered by user interaction
-    user_triggered_conditionals = [statement for statement in conditionals_in_draw_loop if statement['trigger'] == 'user']
-    self.user_trigger_conditional_evidence(user_triggered_conditionals)
-
-    # Retrieve all conditionals executed in the draw loop that are triggered by a variable value
-    variable_triggered_conditionals = [statement for statement in conditionals_in_draw_loop if statement['trigger'] == 'variable']
-    self.variable_triggered_conditional_evidence(variable_triggered_conditionals)
-
-    # Retrieve all conditionals executed in the draw loop that are triggered by an object property value
-    object_triggered_conditionals = [statement for statement in conditionals_in_draw_loop if statement['trigger'] == 'object']
-    self.object_triggered_conditional_evidence(object_triggered_conditionals)
-
-    # Extensive Evidence: Your program uses at least 3 conditionals inside the draw loop - 
-    # 1 (or more) responds to user input and 1 (or more) is triggered by a variable or sprite property.
-    if len(conditionals_in_draw_loop) >= 3 and user_triggered_conditionals and (variable_triggered_conditionals or object_triggered_conditionals):
-      self.assessment = "Extensive Evidence"
-
-    # Convincing Evidence: Your program uses at least 2 conditionals inside the draw loop - 
-    # 1 that responds to user input and 1 that is triggered by a variable or sprite property.
-    elif len(conditionals_in_draw_loop) >= 2 and user_triggered_conditionals and (variable_triggered_conditionals or object_triggered_conditionals):
-      self.assessment = "Convincing Evidence"
-
-    # Limited Evidence: Your program either has conditionals that all respond to user input 
-    # (or all using sprite properties/variables) or only has 1 conditional inside the draw loop.
-    elif len(conditionals_in_draw_loop) >= 1 and (user_triggered_conditionals or variable_triggered_conditionals or object_triggered_conditionals):
-      self.assessment = "Limited Evidence"
-
-    # No Evidence: Your program does not use any conditionals.
-    else:
-      self.assessment = "No Evidence"
-
-  def u3l18_modularity_assessment(self, data):
-    sprites = data["object_types"]["sprites"]
-
-    # set of sprites that have a property set inside the drawloop (including calling setAnimation)
-    sprites_updated_in_draw = set([property["object"] for property in data["property_change"] if
-                                   any([obj["identifier"] == property["object"] and
-                                        obj["type"]=="sprite" for obj in data["objects"]])
-                                  and property["draw_loop"] == True])
-    
-    self.sprites_evidence(data, sprites)
-    self.object_props_updated_evidence(data)
-    
-    # Extensive Evidence: At least 3 sprites, at least 3 of them have properties updated in the draw loop
-    if sprites >= 3 and len(sprites_updated_in_draw) >= 3:
-      self.assessment = "Extensive Evidence"
-
-    # Convincing Evidence: At least 1 sprites, at least 1 of them have properties updated in the draw loop
-    elif sprites >= 1 and len(sprites_updated_in_draw) >= 1:
-      self.assessment = "Convincing Evidence"
-
-    # Limited Evidence: At least 2 sprites
-    elif sprites >= 1 and len(sprites_updated_in_draw) == 0:
-      self.assessment = "Limited Evidence"
-
-    # No Evidence: No sprites
-    else:
-      self.assessment = "Limited Evidence"
-
-  # Function to statically assess U3L18 'Position and Movement'
-  def u3l18_position_assessment(self, data):
-    sprites = data["object_types"]["sprites"]
-    other_elements = data["object_types"]["shapes"] + data["object_types"]["text"]
-    total_elements = sprites + other_elements
-
-    random = data["movement"]["random"]["count"]
-    counter = data["movement"]["counter"]["count"]
-    movement = random + counter
-    self.sprites_and_other_elements_evidence(data, sprites, other_elements)
-    self.movement_types_evidence(data, random, counter)
-
-    # Extensive Evidence: At least 3 sprites, 2 other elements, and 2 types of movement
-    if sprites >= 3 and other_elements >= 1 and counter > 0 and random > 0:
-      self.assessment = "Extensive Evidence"
-
-    # Convincing Evidence: At least 2 sprites, 1 other element, and some movement
-    elif sprites >= 2 and other_elements > 0 and movement > 0:
-      self.assessment = "Convincing Evidence"
-
-    # Limited Evidence: A cumulative of at least a total of 1 element
-    elif total_elements >= 1:
-      self.assessment = "Limited Evidence"
-
-    # No Evidence: No elements placed using the coordinate system.
-    else:
-      self.assessment = "No Evidence"
-
-  def u3l21_modularity_assessment(self, data):
-    sprites = data["object_types"]["sprites"]
-
-    # set of sprites that have their animation set outside the drawloop
-    animation_set = set([property["object"] for property in data["property_change"] if
-                                   any([obj["identifier"] == property["object"] and
-                                        obj["type"]=="sprite" for obj in data["objects"]])
-                                  and property["draw_loop"] == False
-                                  and "method" in property.keys()
-                                  and property["method"] == "setAnimation"
-                                  ])
-    
-    # set of sprites that have velocity set outside the drawloop
-    velocity_set = set([property["object"] for property in data["property_change"] if
-                                   any([obj["identifier"] == property["object"] and
-                                        obj["type"]=="sprite" for obj in data["objects"]])
-                                  and property["draw_loop"] == False
-                                  and "property" in property.keys()
-                                  and "velocity" in property["property"]
-                                  ])
-    
-    self.sprites_evidence(data, sprites)
-    self.animation_evidence(data)
-    self.velocity_evidence(data)
-
-    # Extensive Evidence: At least 3 sprites created and animations set properly. 
-    # The x velocity of the target and obstacle properly set outside the draw loop.
-    if sprites >= 3 and len(animation_set) >= 3 and len(velocity_set) >= 2:
-      self.assessment = "Extensive Evidence"
-
-    # Convincing Evidence: At least 2 sprites created and animations set properly. 
-    # The x velocity of the target or obstacle properly set outside the draw loop.
-    elif sprites >= 2 and len(animation_set) >= 2 and len(velocity_set) >= 1:
-      self.assessment = "Convincing Evidence"
-
-    # Limited Evidence: At least 2 sprites created and animations set. 
-    # The x velocity of the target or obstacle not set or set inside the draw loop.
-    elif sprites >= 2 and len(animation_set) >= 2:
-      self.assessment = "Limited Evidence"
-
-    # No Evidence: No sprites are used in the program.
-    else:
-      self.assessment = "No Evidence"
-
-  def u3l24_modularity_assessment(self, data):
-    sprites = data["object_types"]["sprites"]
-
-    # set of sprites that have their animation set outside the drawloop
-    animation_set = set([property["object"] for property in data["property_change"] if
-                                   any([obj["identifier"] == property["object"] and
-                                        obj["type"]=="sprite" for obj in data["objects"]])
-                                  and property["draw_loop"] == False
-                                  and "method" in property.keys()
-                                  and property["method"] == "setAnimation"
-                                  ])
-    
-    # set of sprites that have velocity set outside the drawloop
-    velocity_set = set([property["object"] for property in data["property_change"] if
-                                   any([obj["identifier"] == property["object"] and
-                                        obj["type"]=="sprite" for obj in data["objects"]])
-                                  and property["draw_loop"] == False
-                                  and "property" in property.keys()
-                                  and "velocity" in property["property"]
-                                  ])
-    
-    self.sprites_evidence(data, sprites)
-    self.animation_evidence(data)
-    self.velocity_evidence(data)
-
-    # Extensive Evidence: At least 4 sprites are created and their animations are set properly. 
-    # The velocities of at least 2 obstacle sprites are properly set outside the draw loop.
-    if sprites >= 4 and len(animation_set) >= 4 and len(velocity_set) >= 2:
-      self.assessment = "Extensive Evidence"
-
-    # Convincing Evidence: At least 3 sprites are created and their animations are set properly. 
-    # The velocity of at least 1 obstacle sprite is properly set outside the draw loop.
-    elif sprites >= 3 and len(animation_set) >= 3 and len(velocity_set) >= 1:
-      self.assessment = "Convincing Evidence"
-
-    # Limited Evidence: At least 2 sprites were created and their animations were set. 
-    # There are no velocities for obstacles set properly outside the draw loop.
-    elif sprites >= 2 and len(animation_set) >= 2:
-      self.assessment = "Limited Evidence"
-
-    # No Evidence: Either the program only contains the “player” sprite provided by the starter code, 
-    # or the sprites are not properly created.
-    else:
-      self.assessment = "No Evidence"
-
-  def u3l28_modularity_functions_assess(self, data):
-    user_functions = [func for func in data["user_functions"] if "draw_loop" not in func]
-    function_calls = [call for call in data["function_calls"] if call["function"] in [func["function"] for func in user_functions]]
-
-    call_count = [func['calls'] for func in data["user_functions"]]
-
-    multiple_calls = len([call for call in call_count if call > 1])
-    single_calls = len([call for call in call_count if call > 0])
-
-    self.function_definition_evidence(user_functions)
-    self.function_call_evidence(function_calls)
-
-    # Extensive Evidence: At least three functions are created outside the draw loop and used to organize your code into logical segments. 
-    # At least one of these functions is called multiple times in your program.
-    if len(user_functions) >= 3 and multiple_calls > 0:
-      self.assessment = "Extensive Evidence"
-
-    # Convincing Evidence: At least two functions are created outside the draw loop and used in your program to organize your code into logical segments.
-    elif len(user_functions) >= 2 and single_calls > 0:
-      self.assessment = "Convincing Evidence"
-      
-    # Limited Evidence: At least one function is created outside the draw loop and used in your program.,
-    elif len(user_functions) >= 1 and single_calls > 0:
-      self.assessment = "Limited Evidence"
-
-    # No Evidence: There are no functions created outside the draw loop and used in your program.
-    else:
-      self.assessment = "No Evidence"
@@ -0,0 +1,13 @@
+# Errors raised while labeling student work. They are also available from lib.assessment.label.
+
+class InvalidResponseError(Exception):
+    pass
+
+class RequestTooLargeError(Exception):
+    pass
+
+class OpenaiServerError(Exception):
+    pass
+
+class BedrockServerError(Exception):
+    pass
@@ -0,0 +1,208 @@
+# Failover and hedging across models. An assessment that fails with a server error or a
+# timeout is retried with the next model of a fallback chain. An assessment that is
+# slower than usual can be hedged: once it has taken longer than a percentile of the
+# recent latencies of its model, the next model is asked as well and the first result
+# is used. Slow tails of a single provider then no longer set the overall p99 latency.
+
+import time
+import asyncio
+import concurrent.futures
+from collections import deque
+from threading import Lock
+
+# The latencies of the most recent successful calls to each model
+class LatencyTracker:
+    def __init__(self, size):
+        self.size = size
+        self._latencies = {}
+        self._lock = Lock()
+
+    def record(self, model, seconds):
+        with self._lock:
+            self._latencies.setdefault(model, deque(maxlen=self.size)).append(seconds)
+
+    # Returns the given percentile (0-100) of the recorded latencies of the model, or None
+    # while fewer than min_samples have been recorded.
+    def percentile(self, model, percentile, min_samples=1):
+        with self._lock:
+            latencies = sorted(self._latencies.get(model, ()))
+        if len(latencies) < max(min_samples, 1):
+            return None
+        index = min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+        return latencies[index]
+
+    def clear(self):
+        with self._lock:
+            self._latencies.clear()
+
+# Describes a call that failed, for the `failover` metadata of an assessment
+def describe_error(e):
+    return f"{type(e).__name__}: {e}"
+
+# Labels with the first model of models, moving on to the next one whenever a call raises one
+# of retry_errors or returns None. Other errors are raised. call(model) makes the call.
+#
+# When hedge_after(model) returns a number of seconds and the call to that model is still running
+# after them, the next model is called at the same time (once per assessment), and whichever
+# result arrives first is used. The calls run on executor, and the slower one is left to finish
+# in the background.
+#
+# Returns the result and the `failover` metadata: the model that gave the result, every attempt
+# with the error it failed with, and whether a hedged request was sent. When every model fails,
+# the last error is raised, or the result is None when the last call returned None. Any other
+# error stops the failover, as it would without hedging, and is raised unless a hedged call
+# already in flight succeeds.
+def call_with_failover(models, call, retry_errors, latencies, hedge_after=None, executor=None):
+    failover = {'model': None, 'attempts': [], 'hedged': False}
+    remaining = list(models)
+    last_error = None
+
+    def timed_call(model):
+        start_time = time.time()
+        result = call(model)
+        if result is not None:
+            latencies.record(model, time.time() - start_time)
+        return result
+
+    def failed(attempt, error):
+        nonlocal last_error
+        last_error = error
+        attempt['error'] = describe_error(error) if error else 'no result'
+
+    if executor is None or hedge_after is None:
+        while remaining:
+            model = remaining.pop(0)
+            attempt = {'model': model}
+            failover['attempts'].append(attempt)
+            try:
+                result = timed_call(model)
+            except retry_errors as e:
+                failed(attempt, e)
+                continue
+            if result is not None:
+                failover['model'] = model
+                return result, failover
+            failed(attempt, None)
+    else:
+        pending = {}
+        # The first error not worth failing over for, after which no other model is called
+        fatal_error = None
+        def start():
+            model = remaining.pop(0)
+            attempt = {'model': model}
+            failover['attempts'].append(attempt)
+            pending[executor.submit(timed_call, model)] = (attempt, time.time(), hedge_after(model))
+
+        start()
+        while pending:
+            timeout = None
+            if remaining and not failover['hedged'] and fatal_error is None:
+                attempt, start_time, threshold = list(pending.values())[-1]
+                if threshold is not None:
+                    timeout = max(0, start_time + threshold - time.time())
+
+            done, _ = concurrent.futures.wait(pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                failover['hedged'] = True
+                start()
+                continue
+
+            for future in done:
+                attempt, start_time, threshold = pending.pop(future)
+                try:
+                    result = future.result()
+                except retry_errors as e:
+                    failed(attempt, e)
+                    result = None
+                except Exception as e:
+                    # Not worth failing over for, but a hedged call in flight may still succeed
+                    failed(attempt, e)
+                    fatal_error = fatal_error or e
+                    continue
+                else:
+                    if result is None:
+                        failed(attempt, None)
+                if result is not None:
+                    failover['model'] = attempt['model']
+                    return result, failover
+
+            if not pending and remaining and fatal_error is None:
+                start()
+
+        if fatal_error is not None:
+            raise fatal_error
+
+    if last_error is not None:
+        raise last_error
+    return None, failover
+
+# Asynchronous counterpart of call_with_failover, where call(model) is a coroutine function.
+# The slower of two hedged calls is cancelled.
+async def call_with_failover_async(models, call, retry_errors, latencies, hedge_after=None):
+    failover = {'model': None, 'attempts': [], 'hedged': False}
+    remaining = list(models)
+    last_error = None
+    # The first error not worth failing over for, after which no other model is called
+    fatal_error = None
+    pending = {}
+
+    async def timed_call(model):
+        start_time = time.time()
+        result = await call(model)
+        if result is not None:
+            latencies.record(model, time.time() - start_time)
+        return result
+
+    def start():
+        model = remaining.pop(0)
+        attempt = {'model': model}
+        failover['attempts'].append(attempt)
+        threshold = hedge_after(model) if hedge_after else None
+        pending[asyncio.ensure_future(timed_call(model))] = (attempt, time.time(), threshold)
+
+    start()
+    try:
+        while pending:
+            timeout = None
+            if remaining and not failover['hedged'] and fatal_error is None:
+                attempt, start_time, threshold = list(pending.values())[-1]
+                if threshold is not None:
+                    timeout = max(0, start_time + threshold - time.time())
+
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                failover['hedged'] = True
+                start()
+                continue
+
+            for task in done:
+                attempt, start_time, threshold = pending.pop(task)
+                try:
+                    result = task.result()
+                except retry_errors as e:
+                    last_error = e
+                    attempt['error'] = describe_error(e)
+                    continue
+                except Exception as e:
+                    # Not worth failing over for, but a hedged call in flight may still succeed
+                    fatal_error = fatal_error or e
+                    attempt['error'] = describe_error(e)
+                    continue
+                if result is None:
+                    last_error = None
+                    attempt['error'] = 'no result'
+                    continue
+                failover['model'] = attempt['model']
+                return result, failover
+
+            if not pending and remaining and fatal_error is None:
+                start()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    if fatal_error is not None:
+        raise fatal_error
+    if last_error is not None:
+        raise last_error
+    return None, failover
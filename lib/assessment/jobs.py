@@ -0,0 +1,183 @@
+# A small in-process job queue for long-running assessments. Jobs are run on a
+# pool of worker threads and their status and results are kept in a job store,
+# so an HTTP request can submit work and return immediately while a later
+# request polls for the result.
+
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+import concurrent.futures
+from threading import Lock
+
+from lib.assessment.config import JOB_WORKERS, JOB_MAX_PENDING, JOB_RESULT_TTL, JOB_STORE, JOB_STORE_PATH
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+FINISHED_STATES = [SUCCEEDED, FAILED]
+
+class JobQueueFullError(Exception):
+    pass
+
+# Keeps jobs in a dictionary. Jobs are lost when the process exits.
+class MemoryJobStore:
+    def __init__(self):
+        self._jobs = {}
+        self._lock = Lock()
+
+    def create(self, job):
+        with self._lock:
+            self._jobs[job['id']] = dict(job)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def count_pending(self):
+        with self._lock:
+            return len([job for job in self._jobs.values() if job['status'] not in FINISHED_STATES])
+
+    # Remove finished jobs older than the given timestamp
+    def purge(self, finished_before):
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if job['status'] in FINISHED_STATES and job['finished'] < finished_before]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+# Keeps jobs in a SQLite database so finished results survive a restart. Jobs
+# that were still queued or running when the process stopped are marked failed.
+class SqliteJobStore:
+    _columns = ['id', 'status', 'created', 'started', 'finished', 'result', 'error', 'error_status']
+
+    def __init__(self, path):
+        self._lock = Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT, created REAL, started REAL, finished REAL, "
+                "result TEXT, error TEXT, error_status INTEGER)"
+            )
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, finished = ?, error = ?, error_status = ? WHERE status IN (?, ?)",
+                (FAILED, time.time(), "Job was interrupted by a service restart", 503, QUEUED, RUNNING)
+            )
+
+    def create(self, job):
+        row = self._to_row(job)
+        with self._lock, self._connection:
+            self._connection.execute(
+                f"INSERT INTO jobs ({', '.join(self._columns)}) VALUES ({', '.join('?' for _ in self._columns)})",
+                [row[column] for column in self._columns]
+            )
+
+    def update(self, job_id, **fields):
+        row = self._to_row(fields)
+        columns = [column for column in self._columns if column in fields and column != 'id']
+        if not columns:
+            return
+        with self._lock, self._connection:
+            self._connection.execute(
+                f"UPDATE jobs SET {', '.join(f'{column} = ?' for column in columns)} WHERE id = ?",
+                [row[column] for column in columns] + [job_id]
+            )
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._connection.execute(f"SELECT {', '.join(self._columns)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(self._columns, row))
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def count_pending(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)).fetchone()[0]
+
+    def purge(self, finished_before):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished < ?", (SUCCEEDED, FAILED, finished_before))
+
+    def _to_row(self, fields):
+        row = {column: fields.get(column) for column in self._columns}
+        if row['result'] is not None:
+            row['result'] = json.dumps(row['result'])
+        return row
+
+# Runs submitted functions on a thread pool and records their outcome in a job store.
+class JobQueue:
+    def __init__(self, store, workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING, result_ttl=JOB_RESULT_TTL):
+        self.store = store
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='assessment-job')
+        self._submit_lock = Lock()
+
+    # Queue fn(**kwargs) and return the new job id. When the function raises,
+    # format_error(e) may return a (message, status) pair to record on the job;
+    # otherwise the exception text is recorded with a 500 status.
+    def submit(self, fn, format_error=None, **kwargs):
+        now = time.time()
+        self.store.purge(now - self.result_ttl)
+
+        with self._submit_lock:
+            if self.store.count_pending() >= self.max_pending:
+                raise JobQueueFullError(f"Too many pending jobs (limit {self.max_pending})")
+
+            job_id = uuid.uuid4().hex
+            self.store.create({'id': job_id, 'status': QUEUED, 'created': now, 'started': None, 'finished': None,
+                              'result': None, 'error': None, 'error_status': None})
+
+        self._executor.submit(self._run, job_id, fn, format_error, kwargs)
+        return job_id
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def _run(self, job_id, fn, format_error, kwargs):
+        self.store.update(job_id, status=RUNNING, started=time.time())
+        try:
+            result = fn(**kwargs)
+        except Exception as e:
+            error = format_error(e) if format_error else None
+            message, status = error or (f"{type(e).__name__}: {e}", 500)
+            if error is None:
+                logging.exception(f"job {job_id} failed")
+            self.store.update(job_id, status=FAILED, finished=time.time(), error=message, error_status=status)
+        else:
+            self.store.update(job_id, status=SUCCEEDED, finished=time.time(), result=result)
+
+_job_queue = None
+_job_queue_lock = Lock()
+
+# Returns the process-wide job queue, creating it on first use. The store is
+# chosen with the ASSESSMENT_JOB_STORE environment variable ('memory' or 'sqlite').
+def get_job_queue():
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                store_type = os.getenv('ASSESSMENT_JOB_STORE', JOB_STORE)
+                if store_type == 'sqlite':
+                    store = SqliteJobStore(os.getenv('ASSESSMENT_JOB_STORE_PATH', JOB_STORE_PATH))
+                elif store_type == 'memory':
+                    store = MemoryJobStore()
+                else:
+                    raise ValueError(f"Unknown job store: {store_type}")
+                workers = int(os.getenv('ASSESSMENT_JOB_WORKERS', JOB_WORKERS))
+                logging.info(f"creating {store_type} job queue with {workers} workers")
+                _job_queue = JobQueue(store, workers=workers)
+    return _job_queue
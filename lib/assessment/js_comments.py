@@ -0,0 +1,95 @@
+# Removes comments from JavaScript source in a single pass. The code is split into
+# tokens with anchored patterns that never backtrack, so the work done is linear in
+# the length of the code. Strings, template literals (including code inside ${}) and
+# regular expression literals are kept as written, even when they contain // or /*.
+
+import re
+
+# The characters that can start a comment, string, template literal or regular expression.
+# Everything in between is copied without being looked at. Inside a ${} substitution
+# braces are also needed to find where it ends.
+_special = re.compile(r'["\'`/]')
+_special_in_template = re.compile(r'["\'`/{}]')
+_line_comment = re.compile(r'//[^\n\r\u2028\u2029]*')
+_strings = {
+    '"': re.compile(r'"(?:[^"\\\n]|\\[\s\S])*"?'),
+    "'": re.compile(r"'(?:[^'\\\n]|\\[\s\S])*'?"),
+}
+# The text of a template literal up to its end, the start of a ${} substitution, or
+# the end of the code
+_template_text = re.compile(r'(?:[^`\\$]|\\[\s\S]|\$(?!\{))*(`|\$\{)?')
+_regex_literal = re.compile(r'/(?:[^/\\\[\n]|\\.|\[(?:[^\]\\\n]|\\.)*\])+/[\w$]*')
+# The last word before a position, when the code there ends with one
+_last_word = re.compile(r'[\w$]+$')
+
+# Words after which a / starts a regular expression rather than a division
+_keywords_before_expression = {
+    'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void',
+    'throw', 'case', 'do', 'else', 'yield', 'await',
+}
+
+# Returns whether a / at pos starts a regular expression, judged by the code before it.
+# After a value (a name, number, string or closing bracket) it is a division.
+def _regex_allowed(code, pos):
+    end = pos
+    while end > 0 and code[end - 1].isspace():
+        end -= 1
+    if end == 0:
+        return True
+
+    char = code[end - 1]
+    if char in ')]"\'`':
+        return False
+    if char in '+-' and end > 1 and code[end - 2] == char:
+        # Increments and decrements leave the value before them in place
+        return False
+    if char == '$' or char == '_' or char.isalnum():
+        return _last_word.search(code, max(0, end - 20), end).group(0) in _keywords_before_expression
+    return True
+
+# Returns the code with its comments removed. When preserve_lines is true, the line
+# breaks inside block comments are kept, so every remaining token stays on its line.
+def strip_js_comments(code, preserve_lines=False):
+    pieces = []
+    last = 0
+    pos = 0
+    length = len(code)
+    # The depth of open braces inside each ${} substitution we are in
+    templates = []
+
+    while True:
+        match = (_special_in_template if templates else _special).search(code, pos)
+        if not match:
+            break
+        pos = match.start()
+        char = code[pos]
+
+        if code.startswith('//', pos):
+            end = _line_comment.match(code, pos).end()
+            pieces.append(code[last:pos])
+            last = pos = end
+        elif code.startswith('/*', pos):
+            end = code.find('*/', pos + 2)
+            end = length if end == -1 else end + 2
+            pieces.append(code[last:pos])
+            if preserve_lines:
+                pieces.append('\n' * code.count('\n', pos, end))
+            last = pos = end
+        elif char == '/':
+            match = _regex_literal.match(code, pos) if _regex_allowed(code, pos) else None
+            pos = match.end() if match else pos + 1
+        elif char in _strings:
+            pos = _strings[char].match(code, pos).end()
+        elif char == '`' or (char == '}' and templates[-1] == 0):
+            if char == '}':
+                templates.pop()
+            match = _template_text.match(code, pos + 1)
+            pos = match.end()
+            if match.group(1) == '${':
+                templates.append(0)
+        else:
+            templates[-1] += 1 if char == '{' else -1
+            pos += 1
+
+    pieces.append(code[last:])
+    return ''.join(pieces)
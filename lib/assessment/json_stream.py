@@ -0,0 +1,69 @@
+# Incremental parsing of a JSON array that arrives in pieces, such as a streamed
+# LLM response. Each element is handed back as soon as its closing bracket has
+# arrived, so callers can act on it without waiting for the rest of the array.
+
+class JsonStreamError(Exception):
+    pass
+
+# Splits a streamed JSON array into the text of its elements. Any text before the
+# first '[' is skipped, since models often introduce their answer. Elements must be
+# objects or arrays. The work done is linear in the length of the text fed in.
+class JsonArrayStream:
+    def __init__(self):
+        self.started = False
+        self.finished = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._element = []
+
+    # Consumes the next piece of text and returns the text of every element that
+    # was completed by it. Raises JsonStreamError as soon as the text cannot be
+    # part of a valid array of objects.
+    def feed(self, text):
+        elements = []
+        start = 0
+        for i, char in enumerate(text):
+            if self.finished:
+                break
+
+            if not self.started:
+                if char == '[':
+                    self.started = True
+                continue
+
+            if self._depth == 0:
+                if char in ' \t\r\n,':
+                    continue
+                elif char == ']':
+                    self.finished = True
+                elif char in '{[':
+                    self._depth = 1
+                    start = i
+                else:
+                    raise JsonStreamError(f"unexpected {char!r} between array elements")
+                continue
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._element.append(text[start:i + 1])
+                    elements.append(''.join(self._element))
+                    self._element = []
+
+        # Keep the start of an element that continues in the next piece
+        if self._depth > 0:
+            self._element.append(text[start:])
+
+        return elements
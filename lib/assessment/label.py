@@ -1,38 +1,65 @@
 import os
+import copy
 import json
 import re
+import bisect
+import hashlib
 import csv
 import time
 import requests
 import logging
 import boto3
+import botocore
+import esprima
 from botocore.config import Config
 from threading import Lock
 import subprocess
+import asyncio
+import concurrent.futures
 
 from typing import List, Dict, Any
-from lib.assessment.config import VALID_LABELS, OPENAI_API_TIMEOUT
-from lib.assessment.code_feature_extractor import CodeFeatures
-from lib.assessment.decision_trees import DecisionTrees
+from lib.assessment.config import VALID_LABELS, OPENAI_API_TIMEOUT, OPENAI_POOL_SIZE, OPENAI_CONNECT_TIMEOUT, RESPONSE_CACHE, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_PATH, RESPONSE_CACHE_NORMALIZE_CODE, BEDROCK_MAX_CONCURRENT_SAMPLES, ADAPTIVE_CONSENSUS, CFE_THREADS, FEATURE_CACHE, FEATURE_CACHE_SIZE, FEATURE_CACHE_PATH, LLM_FALLBACK_CHAIN, LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_SAMPLES, LLM_LATENCY_SAMPLES, LLM_HEDGE_THREADS, LLM_RATE_LIMITS
+from lib.assessment.errors import InvalidResponseError, RequestTooLargeError, OpenaiServerError, BedrockServerError
+from lib.assessment.cache import LRUCache, SqliteCache
+from lib.assessment.json_stream import JsonArrayStream, JsonStreamError
+from lib.assessment.js_comments import strip_js_comments
+from lib.assessment.cfe_pool import pooled_extract_features, EXTRACTOR_VERSION
+from lib.assessment.async_clients import run_blocking
+from lib.assessment.providers import get_provider
+from lib.assessment.failover import LatencyTracker, call_with_failover, call_with_failover_async
+from lib.assessment.rate_limiter import RateLimiter, estimate_tokens
+from lib.assessment.decision_trees import DecisionTrees, FeatureIndex
 
 from io import StringIO
 
-class InvalidResponseError(Exception):
-    pass
-
-class RequestTooLargeError(Exception):
-    pass
-
-class OpenaiServerError(Exception):
-    pass
-
-class BedrockServerError(Exception):
-    pass
+# Errors after which an assessment is retried with the next model of the fallback chain
+FAILOVER_ERRORS = (
+    BedrockServerError,
+    OpenaiServerError,
+    requests.exceptions.Timeout,
+    asyncio.TimeoutError,
+    botocore.exceptions.ReadTimeoutError,
+    botocore.exceptions.ConnectTimeoutError,
+)
 
 class Label:
     _bedrock_client = None
     _bedrock_lock = Lock()
     _aws_account = None
+    _response_cache = None
+    _response_cache_lock = Lock()
+    _cfe_executor = None
+    _cfe_executor_lock = Lock()
+    _feature_cache = None
+    _feature_cache_lock = Lock()
+    _openai_session = None
+    _openai_pool_size = None
+    _openai_session_lock = Lock()
+    _hedge_executor = None
+    _hedge_executor_lock = Lock()
+    _latencies = LatencyTracker(LLM_LATENCY_SAMPLES)
+    _rate_limiter = None
+    _rate_limiter_lock = Lock()
 
     # Check to ensure that student project is not blank. Assessment is statically generated for blank code.
     def test_for_blank_code(self, rubric, student_code, student_id):
@@ -71,125 +98,187 @@ class Label:
         # Prep output data
         results = {"metadata": {"agent": "code feature extractor"},"data": []}
 
-        # Extract features from student code
-        cfe = CodeFeatures()
-        cfe.extract_features(student_code)
+        # Extract features from student code, or reuse the features extracted from identical code
+        features = None
+        cache = self.get_feature_cache()
+        if cache:
+            cache_key = self.feature_cache_key(student_code)
+            features = cache.get(cache_key)
+            results["metadata"]["feature_cache"] = {"hit": features is not None}
+        if features is None:
+            features = pooled_extract_features(student_code)
+            if cache:
+                cache.set(cache_key, features)
+        if cache:
+            results["metadata"]["feature_cache"].update(cache.stats())
+        feature_index = FeatureIndex(features)
 
         # Send extracted features through decision tree for each learning goal with CFE enabled
         for learning_goal in learning_goals:
             dt = DecisionTrees()
-            dt.assess(cfe.features, learning_goal, lesson)
+            dt.assess(features, learning_goal, lesson, index=feature_index)
             results["data"].append({"Label": dt.assessment,
                                     "Key Concept": learning_goal["Key Concept"],
                                     "Observations": '',
                                     "Reason": learning_goal[dt.assessment] if dt.assessment else '',
                                     "Evidence": dt.evidence,
                                         })
-            logging.debug(f"Key Concept: {learning_goal['Key Concept']} CFE features: {cfe.features}")
+            logging.debug(f"Key Concept: {learning_goal['Key Concept']} CFE features: {features}")
 
         return results
 
-    def ai_label_student_work(self, prompt, rubric, student_code, student_id, examples=[], num_responses=0, temperature=0.0, llm_model="", response_type='tsv'):
-        if llm_model.startswith("gpt"):
-            return self.openai_label_student_work(prompt, rubric, student_code, student_id, examples=examples, num_responses=num_responses, temperature=temperature, llm_model=llm_model, response_type=response_type)
-        elif llm_model.startswith("bedrock.meta"):
-            return self.bedrock_meta_label_student_work(prompt, rubric, student_code, student_id, examples=examples, num_responses=num_responses, temperature=temperature, llm_model=llm_model)
-        elif llm_model.startswith("bedrock.anthropic") or llm_model.startswith("bedrock.us.anthropic"):
-            return self.bedrock_anthropic_label_student_work(prompt, rubric, student_code, student_id, examples=examples, num_responses=num_responses, temperature=temperature, llm_model=llm_model)
-        else:
-            raise Exception("Unknown model: {}".format(llm_model))
-
-    def bedrock_anthropic_label_student_work(self, prompt, rubric, student_code, student_id, examples=[], num_responses=0, temperature=0.0, llm_model=""):
-        aws_account = self.get_aws_account()
-        aws_region  = 'us-east-1'
-
-        bedrock = self.get_bedrock_client(student_id)
+    # Features depend on the code and on the version of the extractor, so a fixed extractor does not
+    # reuse the features found by the previous one
+    def feature_cache_key(self, student_code):
+        return hashlib.sha256(f"{EXTRACTOR_VERSION}\n{student_code}".encode('utf-8')).hexdigest()
 
-        # Update claude 4+ to use inference profiles. Otherwise, claude 3 just needs 'bedrock.' stripped from the beginning
-        if not "claude-3" in llm_model:
-            bedrock_model = f'arn:aws:bedrock:{aws_region}:{aws_account.strip()}:inference-profile/{llm_model[8:]}'
-        else:
-            bedrock_model = llm_model[8:]
-
-        anthropic_prompt = self.compute_anthropic_prompt(prompt, rubric, student_code, examples=examples)
-        if "claude" in bedrock_model:
-            body = json.dumps({"anthropic_version": "bedrock-2023-05-31",
-                               "max_tokens": 4096,
-                               "messages": [{"role": "user",
-                                             "content": [{"type": "text",
-                                                          "text": anthropic_prompt}
-                                                        ]
-                                            }]
-                              })
-        else:
-            body = json.dumps({
-                "prompt": anthropic_prompt,
-                "max_tokens_to_sample": 4000,
-                "temperature": temperature,
-                # "top_p": 0.9,
-            })
-        accept = 'application/json'
-        content_type = 'application/json'
-        response = bedrock.invoke_model(body=body, modelId=bedrock_model, accept=accept, contentType=content_type)
-        
-        status = response['ResponseMetadata']['HTTPStatusCode']
-
-        if status == 500:
-            logging.warning(f"{student_id} Error calling the API: {status}")
-            logging.warning(f"{student_id} Response body: {response['body']}")
-            raise BedrockServerError(f"Error calling Bedrock Anthropic API: {status}")
-        elif status != 200:
-            logging.error(f"{student_id} Error calling the API: {status}")
-            logging.error(f"{student_id} Response body: {response['body']}")
-            return None
-        
-        response_body = json.loads(response.get('body').read())
+    # Runs cfe_label_student_work and returns its results with the time it took
+    def timed_cfe_label_student_work(self, rubric, student_code, code_feature_extractor, lesson):
+        start_time = time.time()
+        results = self.cfe_label_student_work(rubric, student_code, code_feature_extractor, lesson)
+        return results, time.time() - start_time
 
-        if '\\"Stretch\\"' in response_body["content"][0]["text"]:
-            response_body["content"][0]["text"] = response_body["content"][0]["text"].replace('\\"Stretch\\"', "“Stretch”")   
+    # The feature cache is shared by every Label in the process. Features only depend on the code and
+    # the extractor version (see feature_cache_key), so entries do not expire. Returns None when
+    # caching is disabled.
+    @classmethod
+    def get_feature_cache(cls):
+        if cls._feature_cache is None:
+            with cls._feature_cache_lock:
+                if cls._feature_cache is None:
+                    backend = os.getenv('FEATURE_CACHE', FEATURE_CACHE)
+                    max_size = int(os.getenv('FEATURE_CACHE_SIZE', FEATURE_CACHE_SIZE))
+                    if backend == 'sqlite':
+                        cls._feature_cache = SqliteCache(os.getenv('FEATURE_CACHE_PATH', FEATURE_CACHE_PATH), max_size, table='features')
+                    elif backend == 'memory':
+                        cls._feature_cache = LRUCache(max_size)
+                    elif backend == 'none':
+                        cls._feature_cache = False
+                    else:
+                        raise ValueError(f"Unknown feature cache: {backend}")
+        return cls._feature_cache or None
+
+    # The code feature extractor runs on a thread pool shared by every Label in the process, so it
+    # can overlap with the LLM request.
+    @classmethod
+    def get_cfe_executor(cls):
+        if cls._cfe_executor is None:
+            with cls._cfe_executor_lock:
+                if cls._cfe_executor is None:
+                    workers = int(os.getenv('CFE_THREADS', CFE_THREADS))
+                    cls._cfe_executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cfe')
+        return cls._cfe_executor
+
+    # Labels the student work with the provider that serves llm_model (see providers.py). Server
+    # errors and timeouts fail over to the next model of the fallback chain, and slow requests may
+    # be hedged (see failover.py). Requests wait their turn when the model is over its rate limits
+    # (see rate_limiter.py).
+    def ai_label_student_work(self, prompt, rubric, student_code, student_id, examples=[], num_responses=0, temperature=0.0, llm_model="", response_type='tsv'):
+        def call(model):
+            provider = get_provider(model)
+            request_count, tokens = self.rate_limit_cost(provider, model, prompt, rubric, student_code, examples, num_responses)
+            with self.get_rate_limiter().limit(model, request_count, tokens) as queue_time:
+                result = provider.label_student_work(self, prompt, rubric, student_code, student_id, examples=examples, num_responses=num_responses, temperature=temperature, llm_model=model, response_type=response_type)
+            return self._with_rate_limit_metadata(result, queue_time, tokens)
+
+        models = self.fallback_models(llm_model)
+        hedge_after = self.hedge_after if len(models) > 1 and self.hedging_enabled() else None
+        executor = self.get_hedge_executor() if hedge_after else None
+        result, failover = call_with_failover(models, call, FAILOVER_ERRORS, self._latencies, hedge_after=hedge_after, executor=executor)
+        return self._with_failover_metadata(result, failover, models)
+
+    # Asynchronous counterpart of ai_label_student_work. Providers without an asynchronous
+    # client make the blocking call on the blocking thread pool.
+    async def ai_label_student_work_async(self, prompt, rubric, student_code, student_id, examples=[], num_responses=0, temperature=0.0, llm_model="", response_type='tsv'):
+        async def call(model):
+            provider = get_provider(model)
+            request_count, tokens = self.rate_limit_cost(provider, model, prompt, rubric, student_code, examples, num_responses)
+            async with self.get_rate_limiter().limit_async(model, request_count, tokens) as queue_time:
+                result = await provider.label_student_work_async(self, prompt, rubric, student_code, student_id, examples=examples, num_responses=num_responses, temperature=temperature, llm_model=model, response_type=response_type)
+            return self._with_rate_limit_metadata(result, queue_time, tokens)
+
+        models = self.fallback_models(llm_model)
+        hedge_after = self.hedge_after if len(models) > 1 and self.hedging_enabled() else None
+        result, failover = await call_with_failover_async(models, call, FAILOVER_ERRORS, self._latencies, hedge_after=hedge_after)
+        return self._with_failover_metadata(result, failover, models)
+
+    # Returns the models to try for an assessment with llm_model: llm_model itself, followed by the
+    # models after it in the fallback chain.
+    def fallback_models(self, llm_model):
+        chain = os.getenv('LLM_FALLBACK_CHAIN')
+        chain = [model.strip() for model in chain.split(',') if model.strip()] if chain is not None else LLM_FALLBACK_CHAIN
+        if llm_model in chain:
+            return chain[chain.index(llm_model):]
+        return [llm_model]
+
+    def hedging_enabled(self):
+        return os.getenv('LLM_HEDGE_PERCENTILE', LLM_HEDGE_PERCENTILE) not in [None, '']
+
+    # Returns the seconds after which a request to llm_model is hedged, or None while too few
+    # of its requests have been timed.
+    def hedge_after(self, llm_model):
+        percentile = float(os.getenv('LLM_HEDGE_PERCENTILE', LLM_HEDGE_PERCENTILE))
+        min_samples = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', LLM_HEDGE_MIN_SAMPLES))
+        return self._latencies.percentile(llm_model, percentile, min_samples=min_samples)
 
-        data = self.get_response_data_if_valid(response_body, rubric, student_id, response_type='json', reraise=True)
+    @classmethod
+    def get_hedge_executor(cls):
+        if cls._hedge_executor is None:
+            with cls._hedge_executor_lock:
+                if cls._hedge_executor is None:
+                    workers = int(os.getenv('LLM_HEDGE_THREADS', LLM_HEDGE_THREADS))
+                    cls._hedge_executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hedge')
+        return cls._hedge_executor
+
+    # The rate limits of every model, shared by all Labels in the process
+    @classmethod
+    def get_rate_limiter(cls):
+        if cls._rate_limiter is None:
+            with cls._rate_limiter_lock:
+                if cls._rate_limiter is None:
+                    limits = os.getenv('LLM_RATE_LIMITS')
+                    cls._rate_limiter = RateLimiter(json.loads(limits) if limits else LLM_RATE_LIMITS)
+        return cls._rate_limiter
+
+    # Returns the number of requests and the estimated number of prompt tokens that labeling the
+    # student work counts against the rate limits of llm_model. Each request reads the whole prompt.
+    # Nothing is estimated for models without limits.
+    def rate_limit_cost(self, provider, llm_model, prompt, rubric, student_code, examples, num_responses):
+        if self.get_rate_limiter().get(llm_model) is None:
+            return 0, 0
+        request_count = provider.request_count(self, num_responses)
+        example_texts = [text for example in examples for text in example]
+        return request_count, request_count * estimate_tokens(prompt, rubric, student_code, *example_texts)
+
+    # Reports in the result's metadata how long the request waited on the model's rate limits
+    def _with_rate_limit_metadata(self, result, queue_time, tokens):
+        if result is not None and queue_time is not None:
+            result.setdefault('metadata', {})['rate_limit'] = {'queue_time': queue_time, 'estimated_tokens': tokens}
+        return result
+
+    # Reports in the result's metadata which model answered when there were others to fall back on
+    def _with_failover_metadata(self, result, failover, models):
+        if result is not None and len(models) > 1:
+            result.setdefault('metadata', {})['failover'] = failover
+        return result
+
+    # The Bedrock requests are made by the providers of the models (see providers.py)
+    def bedrock_anthropic_label_student_work(self, prompt, rubric, student_code, student_id, examples=[], num_responses=0, temperature=0.0, llm_model=""):
+        return get_provider(llm_model).label_student_work(self, prompt, rubric, student_code, student_id, examples=examples, num_responses=num_responses, temperature=temperature, llm_model=llm_model)
 
-        return {
-            'metadata': {
-                'agent': 'anthropic',
-                'request': body,
-            },
-            'data': data,
-        }
+    def bedrock_anthropic_stream_label_student_work(self, prompt, rubric, student_code, student_id, examples=[], temperature=0.0, llm_model=""):
+        return get_provider(llm_model).stream_label_student_work(self, prompt, rubric, student_code, student_id, examples=examples, temperature=temperature, llm_model=llm_model)
 
     def bedrock_meta_label_student_work(self, prompt, rubric, student_code, student_id, examples=[], num_responses=0, temperature=0.0, llm_model=""):
-        bedrock = self.get_bedrock_client(student_id)
+        return get_provider(llm_model).label_student_work(self, prompt, rubric, student_code, student_id, examples=examples, num_responses=num_responses, temperature=temperature, llm_model=llm_model)
 
-        # strip 'bedrock.' from the model name
-        bedrock_model = llm_model[8:]
-
-        # raise if the model name does not start with 'meta'
-        if not bedrock_model.startswith("meta."):
-            raise Exception(f"Error parsing llm_model: {llm_model} bedrock_model: {bedrock_model}")
-
-        meta_prompt = self.compute_meta_prompt(prompt, rubric, student_code, examples=examples)
-        body = json.dumps({
-            "prompt": meta_prompt,
-            "max_gen_len": 1536,
-            "temperature": temperature,
-        })
-        accept = 'application/json'
-        content_type = 'application/json'
-        response = bedrock.invoke_model(body=body, modelId=bedrock_model, accept=accept, contentType=content_type)
-
-        response_body = json.loads(response.get('body').read())
-        generation = response_body.get('generation')
-
-        data = self.get_response_data_if_valid(generation, rubric, student_id, response_type='json')
-
-        return {
-            'metadata': {
-                'agent': 'meta',
-                'request': body,
-            },
-            'data': data,
-        }
+    # Calls fn(index) for each index in range(count) on up to max_workers threads and returns the
+    # results in index order. A single call is made on the current thread.
+    def _run_concurrently(self, fn, count, max_workers):
+        if count <= 1 or max_workers <= 1:
+            return [fn(index) for index in range(count)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(count, max_workers)) as executor:
+            return list(executor.map(fn, range(count)))
 
     # make sure only one client is created, otherwise we sometimes end up with a corrupt .aws/credentials file
     # when rubric tester calls this function multiple times in parallel.
@@ -204,6 +293,34 @@ class Label:
                     cls._bedrock_client = boto3.client(service_name='bedrock-runtime', config=bedrock_config)
         return cls._bedrock_client
     
+    # The OpenAI session is shared by every Label in the process, so connections are reused
+    # across assessments. Sessions are safe to share between threads for sending requests.
+    @classmethod
+    def get_openai_session(cls):
+        if cls._openai_session is None:
+            with cls._openai_session_lock:
+                if cls._openai_session is None:
+                    pool_size = int(os.getenv('OPENAI_POOL_SIZE', OPENAI_POOL_SIZE))
+                    session = requests.Session()
+                    session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+                    cls._openai_pool_size = pool_size
+                    cls._openai_session = session
+        return cls._openai_session
+
+    # Reports the size of the OpenAI connection pool, the connections opened and the requests
+    # sent on them so far, and how many connections are open but not in use.
+    @classmethod
+    def get_openai_pool_stats(cls):
+        pool_manager = cls.get_openai_session().adapters['https://'].poolmanager
+        pools = [pool_manager.pools[key] for key in pool_manager.pools.keys()]
+        return {
+            'pool_size': cls._openai_pool_size,
+            'connections': sum(pool.num_connections for pool in pools),
+            'requests': sum(pool.num_requests for pool in pools),
+            # urllib3 fills the free slots of a pool with None
+            'idle': sum(1 for pool in pools if pool.pool is not None for conn in list(pool.pool.queue) if conn is not None),
+        }
+
     # When using inference profiles, we need to access the AWS account ID
     def get_aws_account(cls):
         if cls._aws_account is None:
@@ -212,7 +329,92 @@ class Label:
                 cls._aws_account = result.stdout
         return cls._aws_account
 
+    # The response cache is shared by every Label in the process. Returns None when caching is disabled.
+    @classmethod
+    def get_response_cache(cls):
+        if cls._response_cache is None:
+            with cls._response_cache_lock:
+                if cls._response_cache is None:
+                    backend = os.getenv('RESPONSE_CACHE', RESPONSE_CACHE)
+                    max_size = int(os.getenv('RESPONSE_CACHE_SIZE', RESPONSE_CACHE_SIZE))
+                    ttl = float(os.getenv('RESPONSE_CACHE_TTL', RESPONSE_CACHE_TTL))
+                    if backend == 'sqlite':
+                        cls._response_cache = SqliteCache(os.getenv('RESPONSE_CACHE_PATH', RESPONSE_CACHE_PATH), max_size, ttl=ttl, table='responses')
+                    elif backend == 'memory':
+                        cls._response_cache = LRUCache(max_size, ttl=ttl)
+                    elif backend == 'none':
+                        cls._response_cache = False
+                    else:
+                        raise ValueError(f"Unknown response cache: {backend}")
+        return cls._response_cache or None
+
+    # Computes the response cache key from everything that can change the assessment result.
+    def response_cache_key(self, prompt, rubric, student_code, examples=[], num_responses=0, temperature=0.0, llm_model="", response_type='tsv', code_feature_extractor=None, lesson=None):
+        key_data = {
+            'prompt': prompt,
+            'rubric': rubric,
+            'code': student_code,
+            'examples': examples,
+            'num_responses': num_responses,
+            'temperature': temperature,
+            'model': llm_model,
+            'response_type': response_type,
+            'code_feature_extractor': code_feature_extractor,
+            'lesson': lesson,
+        }
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode('utf-8')).hexdigest()
+
     def openai_label_student_work(self, prompt, rubric, student_code, student_id, examples=[], num_responses=0, temperature=0.0, llm_model="", response_type='tsv'):
+        api_url, headers, data = self.compute_openai_request(prompt, rubric, student_code, examples=examples, num_responses=num_responses, temperature=temperature, llm_model=llm_model)
+
+        if not self.adaptive_consensus_enabled(num_responses):
+            info = self._openai_post(api_url, headers, data, student_id)
+            return self._openai_result(info, data, rubric, student_id, response_type=response_type)
+
+        # Ask for the responses in smaller batches, stopping once more would not change the vote
+        infos = []
+        # If every choice is invalid, the last error is raised, as in response_data_from_choices
+        last_error = None
+        def request_wave(count, first_index):
+            nonlocal last_error
+            info = self._openai_post(api_url, headers, dict(data, n=count), student_id)
+            if info is None:
+                return None
+            infos.append(info)
+            results = []
+            for index, choice in enumerate(info['choices']):
+                if not choice['message']['content']:
+                    continue
+                try:
+                    results.append(self.get_response_data_if_valid(choice, rubric, student_id, choice_index=first_index + index, reraise=True, response_type=response_type))
+                except (InvalidResponseError, RequestTooLargeError) as e:
+                    last_error = e
+            return results
+
+        choices, requested = self.sample_responses(request_wave, num_responses)
+        if not infos:
+            return None
+        if not choices:
+            raise last_error or InvalidResponseError("No valid responses.")
+
+        usage = {}
+        for info in infos:
+            for key, value in info['usage'].items():
+                if isinstance(value, (int, float)):
+                    usage[key] = usage.get(key, 0) + value
+
+        return {
+            'metadata': {
+                'agent': 'openai',
+                'usage': usage,
+                'request': data,
+                'consensus': {'requested': requested, 'valid': len(choices)},
+            },
+            'data': choices[0] if len(choices) == 1 else self.get_consensus_response(choices, student_id),
+        }
+
+    # Returns the URL, headers and body of a chat completion request
+    def compute_openai_request(self, prompt, rubric, student_code, examples=[], num_responses=0, temperature=0.0, llm_model=""):
         # Determine the OpenAI URL and headers
         api_url = 'https://api.openai.com/v1/chat/completions'
         headers = {
@@ -228,25 +430,13 @@ class Label:
             'messages': messages,
             'n': num_responses,
         }
+        return api_url, headers, data
 
-        # Post to the AI service
-        response = requests.post(api_url, headers=headers, json=data, timeout=OPENAI_API_TIMEOUT)
-
-        if response.status_code == 500:
-            logging.warning(f"{student_id} Error calling the API: {response.status_code}")
-            logging.warning(f"{student_id} Response body: {response.text}")
-            raise OpenaiServerError(f"Error calling OpenAI API: {response.text}")
-        elif self._openai_context_length_exceeded(response):
-            message = response.json().get('error', {}).get('message')
-            logging.warning(f"{student_id} Request too large: {message}")
-            raise RequestTooLargeError(f"{student_id} {message}")
-        elif response.status_code != 200:
-            logging.error(f"{student_id} Error calling the API: {response.status_code}")
-            logging.error(f"{student_id} Response body: {response.text}")
+    # Builds the result of a single chat completion request from its decoded response
+    def _openai_result(self, info, data, rubric, student_id, response_type='tsv'):
+        if info is None:
             return None
 
-        info = response.json()
-
         response_data = self.response_data_from_choices(info, rubric, student_id, response_type=response_type)
 
         return {
@@ -258,23 +448,104 @@ class Label:
             'data': response_data,
         }
 
-    def _openai_context_length_exceeded(self, response):
+    # Posts a chat completion request. Returns the decoded response, or None when the request
+    # failed in a way that should not raise.
+    def _openai_post(self, api_url, headers, data, student_id):
+        timeout = (min(OPENAI_CONNECT_TIMEOUT, OPENAI_API_TIMEOUT), OPENAI_API_TIMEOUT)
+        response = self.get_openai_session().post(api_url, headers=headers, json=data, timeout=timeout)
+        return self._openai_response_info(response.status_code, response.headers.get('Content-Type'), response.text, student_id)
+
+    # Decodes a chat completion response given its status, content type and body. Shared by the
+    # blocking and asynchronous clients.
+    def _openai_response_info(self, status_code, content_type, text, student_id):
+        if status_code == 500:
+            logging.warning(f"{student_id} Error calling the API: {status_code}")
+            logging.warning(f"{student_id} Response body: {text}")
+            raise OpenaiServerError(f"Error calling OpenAI API: {text}")
+        elif self._openai_context_length_exceeded(status_code, content_type, text):
+            message = json.loads(text).get('error', {}).get('message')
+            logging.warning(f"{student_id} Request too large: {message}")
+            raise RequestTooLargeError(f"{student_id} {message}")
+        elif status_code != 200:
+            logging.error(f"{student_id} Error calling the API: {status_code}")
+            logging.error(f"{student_id} Response body: {text}")
+            return None
+
+        return json.loads(text)
+
+    def _openai_context_length_exceeded(self, status_code, content_type, text):
         return (
-            response.status_code == 400 and
-            response.headers.get('Content-Type') == 'application/json' and
-            response.json().get('error', {}).get('code') == 'context_length_exceeded'
+            status_code == 400 and
+            content_type == 'application/json' and
+            json.loads(text).get('error', {}).get('code') == 'context_length_exceeded'
         )
 
-    def label_student_work(self, prompt, rubric, student_code, student_id, examples=[], use_cached=False, write_cached=False, num_responses=0, temperature=0.0, llm_model="", remove_comments=False, response_type='tsv', cache_prefix="", code_feature_extractor=None, lesson=None):
+    def label_student_work(self, prompt, rubric, student_code, student_id, examples=[], use_cached=False, write_cached=False, num_responses=0, temperature=0.0, llm_model="", remove_comments=False, response_type='tsv', cache_prefix="", code_feature_extractor=None, lesson=None, response_cache=True):
+        assessment = self.start_assessment(prompt, rubric, student_code, student_id, examples=examples, use_cached=use_cached, num_responses=num_responses, temperature=temperature, llm_model=llm_model, remove_comments=remove_comments, response_type=response_type, cache_prefix=cache_prefix, code_feature_extractor=code_feature_extractor, lesson=lesson, response_cache=response_cache)
+        if assessment['response'] is not None:
+            return assessment['response']
+
+        ai_result, llm_time = None, None
+        if assessment['llm_rubric'] is not None:
+            # Send data to LLM for assessment
+            llm_start_time = time.time()
+            try:
+                ai_result = self.ai_label_student_work(prompt, assessment['llm_rubric'], assessment['student_code'], student_id, examples=assessment['llm_examples'], num_responses=num_responses, temperature=temperature, llm_model=llm_model, response_type=response_type)
+            except requests.exceptions.ReadTimeout as exception:
+                logging.warning(f"{student_id} request timed out in {(time.time() - assessment['start_time']):.0f} seconds.")
+                raise exception
+            llm_time = time.time() - llm_start_time
+
+        cfe_result = assessment['cfe_future'].result() if assessment['cfe_future'] else (None, None)
+        return self.finish_assessment(assessment, ai_result, llm_time, cfe_result, write_cached=write_cached, cache_prefix=cache_prefix)
+
+    # Asynchronous counterpart of label_student_work for callers on an event loop. Only the LLM
+    # request is awaited; the work before and after it runs on the blocking thread pool.
+    async def label_student_work_async(self, prompt, rubric, student_code, student_id, examples=[], num_responses=0, temperature=0.0, llm_model="", remove_comments=False, response_type='tsv', code_feature_extractor=None, lesson=None, response_cache=True):
+        assessment = await run_blocking(self.start_assessment, prompt, rubric, student_code, student_id, examples=examples, num_responses=num_responses, temperature=temperature, llm_model=llm_model, remove_comments=remove_comments, response_type=response_type, code_feature_extractor=code_feature_extractor, lesson=lesson, response_cache=response_cache)
+        if assessment['response'] is not None:
+            return assessment['response']
+
+        ai_result, llm_time = None, None
+        if assessment['llm_rubric'] is not None:
+            llm_start_time = time.time()
+            try:
+                ai_result = await self.ai_label_student_work_async(prompt, assessment['llm_rubric'], assessment['student_code'], student_id, examples=assessment['llm_examples'], num_responses=num_responses, temperature=temperature, llm_model=llm_model, response_type=response_type)
+            except (requests.exceptions.ReadTimeout, asyncio.TimeoutError) as exception:
+                logging.warning(f"{student_id} request timed out in {(time.time() - assessment['start_time']):.0f} seconds.")
+                raise exception
+            llm_time = time.time() - llm_start_time
+
+        cfe_result = await asyncio.wrap_future(assessment['cfe_future']) if assessment['cfe_future'] else (None, None)
+        return await run_blocking(self.finish_assessment, assessment, ai_result, llm_time, cfe_result)
+
+    # Does everything label_student_work does before asking the LLM. Returns a dictionary
+    # describing the assessment. Its 'response' is already set when no LLM is needed because
+    # the code is blank or was assessed before. Otherwise 'llm_rubric' and 'llm_examples' are
+    # what to send to the LLM (the rubric is None when the code feature extractor covers all of
+    # it), and 'cfe_future' is running the code feature extractor when one is requested.
+    def start_assessment(self, prompt, rubric, student_code, student_id, examples=[], use_cached=False, num_responses=0, temperature=0.0, llm_model="", remove_comments=False, response_type='tsv', cache_prefix="", code_feature_extractor=None, lesson=None, response_cache=True):
+        assessment = {
+            'response': None,
+            'rubric': rubric,
+            'student_id': student_id,
+            'code_feature_extractor': code_feature_extractor,
+            'lesson': lesson,
+            'llm_model': llm_model,
+            'cache': None,
+            'cfe_future': None,
+        }
+
         if use_cached and os.path.exists(os.path.join(cache_prefix, f"cached_responses/{student_id}.json")):
             with open(os.path.join(cache_prefix, f"cached_responses/{student_id}.json"), 'r') as f:
-                return json.load(f)
+                assessment['response'] = json.load(f)
+                return assessment
 
         # We will record the time it takes to perform the assessment
-        start_time = time.time()
+        start_time = assessment['start_time'] = time.time()
 
         # Sanitize student code
-        student_code = self.sanitize_code(student_code, remove_comments=remove_comments)
+        student_code = assessment['student_code'] = self.sanitize_code(student_code, remove_comments=remove_comments)
 
         # Test for empty student code file
         blank_code_result = self.test_for_blank_code(rubric, student_code, student_id)
@@ -282,49 +553,124 @@ class Label:
         # If code is blank, return results
         if blank_code_result:
             blank_code_result["metadata"]["time"] = time.time() - start_time
-            return blank_code_result
+            assessment['response'] = blank_code_result
+            return assessment
+
+        # Return the previous assessment if this request has been assessed before. When the code
+        # is normalized, cached Evidence refers to canonical line numbers and is mapped back onto
+        # the lines of this submission.
+        cache = assessment['cache'] = self.get_response_cache() if response_cache else None
+        if cache:
+            cache_code, line_numbers = student_code, None
+            if os.getenv('RESPONSE_CACHE_NORMALIZE_CODE', str(int(RESPONSE_CACHE_NORMALIZE_CODE))) not in ['0', 'false', 'False']:
+                canonical_lines, line_numbers = self.canonicalize_code(student_code)
+                cache_code = "\n".join(canonical_lines)
+            cache_key = self.response_cache_key(prompt, rubric, cache_code, examples=examples, num_responses=num_responses, temperature=temperature, llm_model=llm_model, response_type=response_type, code_feature_extractor=code_feature_extractor, lesson=lesson)
+            assessment['cache_key'], assessment['line_numbers'] = cache_key, line_numbers
+            cached_response = cache.get(cache_key)
+            if cached_response:
+                if line_numbers is not None:
+                    self.remap_evidence_lines(cached_response['data'], lambda line: self._original_line(line, line_numbers))
+                cached_response['metadata']['student_id'] = student_id
+                cached_response['metadata']['time'] = time.time() - start_time
+                cached_response['metadata']['cache'] = {'hit': True, 'key': cache_key}
+                logging.info(f"{student_id} response cache hit")
+                assessment['response'] = cached_response
+                return assessment
 
         # If student code is not blank, check for learning goals flagged for code feature extractor
         # Send student code and learning goals(s) for feature extraction and labeling.
-        cfe_results = None
+        # Only the Key Concepts the code feature extractor does not cover are sent to the LLM.
+        llm_rubric, llm_examples = rubric, examples
         if code_feature_extractor:
-            cfe_results = self.cfe_label_student_work(rubric, student_code, code_feature_extractor, lesson)
-        
-        # Send data to LLM for assessment
-        try:
-            ai_result = self.ai_label_student_work(prompt, rubric, student_code, student_id, examples=examples, num_responses=num_responses, temperature=temperature, llm_model=llm_model, response_type=response_type)
-        except requests.exceptions.ReadTimeout as exception:
-            logging.warning(f"{student_id} request timed out in {(time.time() - start_time):.0f} seconds.")
-            raise exception
+            llm_rubric, llm_examples = self.llm_rubric_and_examples(rubric, examples, code_feature_extractor, response_type=response_type)
+        assessment['llm_rubric'], assessment['llm_examples'] = llm_rubric, llm_examples
+
+        # The code feature extractor runs while the LLM request is in flight
+        if llm_rubric is not None and code_feature_extractor:
+            assessment['cfe_future'] = self.get_cfe_executor().submit(self.timed_cfe_label_student_work, rubric, student_code, code_feature_extractor, lesson)
+
+        return assessment
+
+    # Completes an assessment begun by start_assessment, given the LLM's result and the seconds
+    # it took (both None when the LLM was not asked) and the (results, seconds) of the code
+    # feature extractor when it ran alongside the LLM. Returns the response.
+    def finish_assessment(self, assessment, ai_result, llm_time, cfe_result=(None, None), write_cached=False, cache_prefix=""):
+        rubric, student_id, start_time = assessment['rubric'], assessment['student_id'], assessment['start_time']
+
+        if assessment['llm_rubric'] is None:
+            # Every Key Concept is assessed without the LLM
+            cfe_results, cfe_time = self.timed_cfe_label_student_work(rubric, assessment['student_code'], assessment['code_feature_extractor'], assessment['lesson'])
+            elapsed = time.time() - start_time
+            logging.info(f"{student_id} assessed by code feature extractor in {elapsed:.3f} seconds.")
+            response = {
+                'metadata': {
+                    'time': elapsed,
+                    'student_id': student_id,
+                    'agent': cfe_results['metadata']['agent'],
+                    'path': 'cfe',
+                    'timings': {'cfe': cfe_time},
+                },
+                'data': cfe_results['data'],
+            }
+            if 'feature_cache' in cfe_results['metadata']:
+                response['metadata']['feature_cache'] = cfe_results['metadata']['feature_cache']
+        else:
+            # No assessment was possible
+            if ai_result is None:
+                raise Exception("AI assessment failed.")
 
-        # No assessment was possible
-        if ai_result is None:
-            raise Exception("AI assessment failed.")
+            cfe_results, cfe_time = cfe_result
 
-        elapsed = time.time() - start_time
-        tokens = ai_result.get('metadata', {}).get('usage', {}).get('total_tokens', 0)
-        logging.info(f"{student_id} request succeeded in {elapsed:.0f} seconds. {tokens} tokens used.")
+            elapsed = time.time() - start_time
+            tokens = get_provider(assessment['llm_model']).usage(ai_result).get('total_tokens', 0)
+            logging.info(f"{student_id} request succeeded in {elapsed:.0f} seconds. {tokens} tokens used.")
 
-        # Craft the response dictionary
-        response = {
-            'metadata': {
-                'time': elapsed,
-                'student_id': student_id,
-            },
-            'data': ai_result.get('data', []),
-        }
-        response['metadata'].update(ai_result.get('metadata', {}))
+            # Craft the response dictionary
+            response = {
+                'metadata': {
+                    'time': elapsed,
+                    'student_id': student_id,
+                },
+                'data': ai_result.get('data', []),
+            }
+            response['metadata'].update(ai_result.get('metadata', {}))
+            response['metadata']['path'] = 'llm'
+            response['metadata']['timings'] = {'llm': llm_time}
+
+            if cfe_results:
+                response["metadata"]["timings"]["cfe"] = cfe_time
+                if 'feature_cache' in cfe_results['metadata']:
+                    response["metadata"]["feature_cache"] = cfe_results["metadata"]["feature_cache"]
 
-        # If any learning goals were assessed by the code feature extractor, replace the AI results with cfe results
-        if cfe_results:
-            response["metadata"]["agent"] += ", " + cfe_results["metadata"]["agent"]
-            for i, row in enumerate(response["data"]):
-                if row["Key Concept"] in code_feature_extractor:
-                    response["data"][i] = [cfe_row for cfe_row in cfe_results["data"] if cfe_row["Key Concept"] == row["Key Concept"]][0]
+            # If any learning goals were assessed by the code feature extractor, combine them with the AI results
+            if cfe_results and cfe_results["data"]:
+                response["metadata"]["agent"] += ", " + cfe_results["metadata"]["agent"]
+                response["metadata"]["path"] = 'llm+cfe'
+                response["data"] = self.merge_cfe_results(rubric, response["data"], cfe_results["data"])
 
         # Sanitize Evidence
         self._sanitize_result(response['data'])
 
+        cache = assessment['cache']
+        if cache:
+            cache_key, line_numbers = assessment['cache_key'], assessment['line_numbers']
+            response['metadata']['cache'] = {'hit': False, 'key': cache_key}
+            # An answer from a fallback model is not an answer from the requested model
+            answered_by = response['metadata'].get('failover', {}).get('model') or assessment['llm_model']
+            if answered_by == assessment['llm_model']:
+                # Failover and rate limits describe only this request
+                uncached = ['failover', 'rate_limit']
+                if line_numbers is not None:
+                    # The request holds this submission's exact code, which a later submission may not share
+                    uncached.append('request')
+                metadata = {key: value for key, value in response['metadata'].items() if key not in uncached}
+                cached_response = {'metadata': metadata, 'data': response['data']}
+                if line_numbers is not None:
+                    cached_response['data'] = copy.deepcopy(response['data'])
+                    self.remap_evidence_lines(cached_response['data'], lambda line: self._canonical_line(line, line_numbers))
+                cache.set(cache_key, cached_response)
+
         # only write to cache if the response is valid
         if write_cached and ai_result:
             with open(os.path.join(cache_prefix, f"cached_responses/{student_id}.json"), 'w+') as f:
@@ -332,22 +678,177 @@ class Label:
 
         return response
 
-    def remove_js_comments(self, code):
-        # This regex pattern captures three groups:
-        # 1) Single or double quoted strings
-        # 2) Multi-line comments
-        # 3) Single-line comments
-        pattern = r'(".*?[^\\]"|\'.*?[^\\]\'|/\*.*?\*/|//.*?$)'
+    # Returns the rubric and examples to send to the LLM when the code feature extractor assesses
+    # the Key Concepts named in code_feature_extractor. The rubric is None when no Key Concepts are
+    # left for the LLM, and both are returned unchanged when none are assessed by the extractor.
+    # Example responses are in the format of response_type.
+    def llm_rubric_and_examples(self, rubric, examples, code_feature_extractor, response_type='tsv'):
+        reader = csv.DictReader(rubric.splitlines())
+        rubric_rows = list(reader)
+        llm_rows = [row for row in rubric_rows if not row["Key Concept"] in code_feature_extractor]
+
+        if not llm_rows:
+            return None, []
+        if len(llm_rows) == len(rubric_rows):
+            return rubric, examples
+
+        output = StringIO()
+        writer = csv.DictWriter(output, fieldnames=reader.fieldnames, lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(llm_rows)
+
+        key_concepts = set(row["Key Concept"] for row in llm_rows)
+        llm_examples = []
+        for example_js, example_response in examples:
+            if response_type == 'json':
+                example_response = json.dumps([row for row in json.loads(example_response) if row["Key Concept"] in key_concepts], indent=4)
+            else:
+                example_reader = csv.DictReader(example_response.splitlines(), delimiter="\t")
+                example_rows = [row for row in example_reader if row["Key Concept"] in key_concepts]
+                example_output = StringIO()
+                example_writer = csv.DictWriter(example_output, fieldnames=example_reader.fieldnames, delimiter="\t", lineterminator="\n")
+                example_writer.writeheader()
+                example_writer.writerows(example_rows)
+                example_response = example_output.getvalue()
+            llm_examples.append([example_js, example_response])
+
+        return output.getvalue(), llm_examples
+
+    # Combines the LLM's rows with the code feature extractor's, in rubric order. The code feature
+    # extractor's row is used for any Key Concept both assessed.
+    def merge_cfe_results(self, rubric, llm_data, cfe_data):
+        rows = {row["Key Concept"]: row for row in llm_data}
+        rows.update({row["Key Concept"]: row for row in cfe_data})
+
+        data = []
+        for row in csv.DictReader(rubric.splitlines()):
+            if row["Key Concept"] in rows:
+                data.append(rows.pop(row["Key Concept"]))
+        return data + list(rows.values())
+
+    # Streams an assessment as (event, data) pairs: a 'label' event with each Key Concept's row as
+    # soon as it is known, followed by a 'metadata' event. Blank code is labeled statically and Key
+    # Concepts assessed by the code feature extractor are sent before the LLM is asked about the
+    # rest. LLM rows are streamed from the model for single response Bedrock Anthropic assessments;
+    # other assessments are made as a whole by label_student_work and their rows sent once it returns.
+    def label_student_work_stream(self, prompt, rubric, student_code, student_id, examples=[], num_responses=0, temperature=0.0, llm_model="", remove_comments=False, response_type='tsv', code_feature_extractor=None, lesson=None):
+        start_time = time.time()
+        student_code = self.sanitize_code(student_code, remove_comments=remove_comments)
+
+        blank_code_result = self.test_for_blank_code(rubric, student_code, student_id)
+        if blank_code_result:
+            for row in blank_code_result['data']:
+                yield 'label', row
+            blank_code_result['metadata']['time'] = time.time() - start_time
+            yield 'metadata', blank_code_result['metadata']
+            return
+
+        # Only the Key Concepts the code feature extractor does not cover are sent to the LLM
+        cfe_results = None
+        llm_rubric, llm_examples = rubric, examples
+        if code_feature_extractor:
+            cfe_results = self.cfe_label_student_work(rubric, student_code, code_feature_extractor, lesson)
+            self._sanitize_result(cfe_results['data'])
+            for row in cfe_results['data']:
+                yield 'label', row
+            llm_rubric, llm_examples = self.llm_rubric_and_examples(rubric, examples, code_feature_extractor, response_type=response_type)
+
+        first_label_time = None
+        if llm_rubric is None:
+            metadata = {'agent': cfe_results['metadata']['agent'], 'path': 'cfe'}
+        elif get_provider(llm_model).supports_stream and num_responses <= 1:
+            provider = get_provider(llm_model)
+            request_count, tokens = self.rate_limit_cost(provider, llm_model, prompt, llm_rubric, student_code, llm_examples, num_responses)
+            with self.get_rate_limiter().limit(llm_model, request_count, tokens) as queue_time:
+                for row in provider.stream_label_student_work(self, prompt, llm_rubric, student_code, student_id, examples=llm_examples, temperature=temperature, llm_model=llm_model):
+                    if first_label_time is None:
+                        first_label_time = time.time() - start_time
+                    yield 'label', row
+            metadata = self._with_rate_limit_metadata({'metadata': {'agent': provider.agent, 'path': 'llm'}}, queue_time, tokens)['metadata']
+        else:
+            # The code has already been sanitized
+            response = self.label_student_work(
+                prompt, llm_rubric, student_code, student_id,
+                examples=llm_examples,
+                num_responses=num_responses,
+                temperature=temperature,
+                llm_model=llm_model,
+                response_type=response_type,
+            )
+            for row in response['data']:
+                yield 'label', row
+            metadata = response['metadata']
+
+        elapsed = time.time() - start_time
+        logging.info(f"{student_id} streamed request succeeded in {elapsed:.0f} seconds.")
+
+        metadata.update({
+            'time': elapsed,
+            'student_id': student_id,
+        })
+        if first_label_time is not None:
+            metadata['first_label_time'] = first_label_time
+        if cfe_results and cfe_results['data'] and llm_rubric is not None:
+            metadata['agent'] += ", " + cfe_results['metadata']['agent']
+            metadata['path'] = 'llm+cfe'
+        if cfe_results and 'feature_cache' in cfe_results['metadata']:
+            metadata['feature_cache'] = cfe_results['metadata']['feature_cache']
+        yield 'metadata', metadata
+
+    # Removes comments from the code, leaving strings, template literals and regular
+    # expression literals alone. When preserve_lines is true, comments keep their line breaks.
+    def remove_js_comments(self, code, preserve_lines=False):
+        return strip_js_comments(code, preserve_lines=preserve_lines)
+
+    # Reduces code to a canonical form that is the same for programs differing only in comments,
+    # whitespace or line endings. Returns the list of canonical lines and, for each of them, the
+    # 1-based line of the original code it came from. Blank and comment-only lines are dropped.
+    def canonicalize_code(self, code):
+        code = code.replace("\r\n", "\n").replace("\r", "\n")
 
+        try:
+            tokens = esprima.tokenize(code, {'loc': True})
+        except esprima.Error:
+            tokens = None
+
+        lines = {}
+        if tokens is not None:
+            # Tokens never include comments, and are joined by a single space per line
+            for token in tokens:
+                lines.setdefault(token.loc.start.line, []).append(token.value)
+            lines = {line: " ".join(values) for line, values in lines.items()}
+        else:
+            # The code cannot be tokenized, so fall back to collapsing whitespace line by line
+            code = self.remove_js_comments(code, preserve_lines=True)
+            for line, text in enumerate(code.split("\n"), start=1):
+                text = " ".join(text.split())
+                if text:
+                    lines[line] = text
+
+        line_numbers = sorted(lines)
+        return [lines[line] for line in line_numbers], line_numbers
+
+    # Rewrites the line numbers in "Line N" and "Lines N-M" Evidence using map_line.
+    def remap_evidence_lines(self, data, map_line):
         def replacer(match):
-            # If the match is a string, return it unchanged
-            if match.group(0).startswith(("'", '"')):
-                return match.group(0)
+            start = map_line(int(match['start']))
+            if match['end'] is None:
+                return f"{match['word']} {start}"
+            return f"{match['word']} {start}{match['sep']}{map_line(int(match['end']))}"
 
-            # Otherwise, it's a comment, so remove it
-            return ''
+        for row in data:
+            if isinstance(row.get('Evidence'), str):
+                row['Evidence'] = re.sub(r"(?P<word>\bLines?) (?P<start>\d+)(?:(?P<sep>\s*-\s*)(?P<end>\d+))?", replacer, row['Evidence'])
 
-        return re.sub(pattern, replacer, code, flags=re.DOTALL | re.MULTILINE)
+    # Maps an original line number to the canonical line at or before it
+    def _canonical_line(self, line, line_numbers):
+        return max(bisect.bisect_right(line_numbers, line), 1)
+
+    # Maps a canonical line number to the line of the original code it came from
+    def _original_line(self, line, line_numbers):
+        if not line_numbers:
+            return line
+        return line_numbers[min(max(line, 1), len(line_numbers)) - 1]
 
     def sanitize_code(self, student_code, remove_comments=False):
         # Remove comments
@@ -541,6 +1042,22 @@ class Label:
                 # Match the fully matched string with the first number and last number as a range
                 kc['Evidence'] = kc['Evidence'].replace(match[0], f"Lines {match['start']}-{match['end']}")
 
+    # Validates a single row of a streamed response. key_concepts holds the Key Concepts of the
+    # rows already accepted.
+    def _validate_server_row(self, row, rubric_key_concepts, key_concepts):
+        expected_columns = ["Key Concept", "Observations", "Label", "Reason"]
+
+        missing_columns = set(expected_columns) - set(row.keys())
+        if missing_columns:
+            unexpected_columns = set(row.keys()) - set(expected_columns)
+            raise InvalidResponseError(f'incorrect column names. unexpected: {unexpected_columns} missing: {missing_columns}')
+
+        if row['Key Concept'] not in rubric_key_concepts or row['Key Concept'] in key_concepts:
+            raise InvalidResponseError(f"unexpected or missing key concept. unexpected: {set([row['Key Concept']])} missing: None")
+
+        if row['Label'] not in VALID_LABELS:
+            raise InvalidResponseError(f"invalid label value: '{row['Label']}'")
+
     def _validate_server_response(self, response_data, rubric):
         expected_columns = ["Key Concept", "Observations", "Label", "Reason"]
 
@@ -565,6 +1082,61 @@ class Label:
             if row['Label'] not in VALID_LABELS:
                 raise InvalidResponseError(f"invalid label value: '{row['Label']}'")
 
+    # Adaptive consensus requests responses in waves and stops as soon as the remaining
+    # responses could no longer change the majority label of any Key Concept.
+    def adaptive_consensus_enabled(self, num_responses):
+        return num_responses > 2 and os.getenv('ADAPTIVE_CONSENSUS', str(int(ADAPTIVE_CONSENSUS))) in ['1', 'true', 'True']
+
+    # Gathers num_responses responses with request_wave(count, first_index), which returns a list
+    # holding the response data of each response (None when invalid), or None when the request
+    # failed. Returns the valid response data and the number of responses requested.
+    def sample_responses(self, request_wave, num_responses):
+        if not self.adaptive_consensus_enabled(num_responses):
+            return [data for data in request_wave(num_responses, 0) or [] if data], num_responses
+
+        choices = []
+        requested = 0
+        while requested < num_responses:
+            count = self._next_wave_size(choices, num_responses - requested)
+            results = request_wave(count, requested)
+            requested += count
+            if results is None:
+                break
+            choices += [data for data in results if data]
+            if self._consensus_locked(choices, num_responses - requested):
+                logging.info(f"consensus reached after {requested} of {num_responses} responses")
+                break
+        return choices, requested
+
+    # Difference in votes between the leading label and the runner-up for each Key Concept
+    def _consensus_leads(self, choices):
+        from collections import Counter
+
+        key_concept_to_labels = {}
+        for choice in choices:
+            for row in choice:
+                key_concept_to_labels.setdefault(row['Key Concept'], []).append(row['Label'])
+
+        leads = []
+        for labels in key_concept_to_labels.values():
+            counts = [count for _, count in Counter(labels).most_common(2)] + [0]
+            leads.append(counts[0] - counts[1])
+        return leads
+
+    # The majority is locked when no Key Concept's runner-up could overtake the leader, even by
+    # winning every remaining response.
+    def _consensus_locked(self, choices, remaining):
+        if remaining <= 0:
+            return True
+        if not choices:
+            return False
+        return all(lead > remaining for lead in self._consensus_leads(choices))
+
+    # The fewest responses that could lock every Key Concept if they all agree with the leader
+    def _next_wave_size(self, choices, remaining):
+        leads = self._consensus_leads(choices) or [0]
+        return min(remaining, max((remaining - lead) // 2 + 1 for lead in leads))
+
     def get_consensus_response(self, choices, student_id):
         from collections import Counter
 
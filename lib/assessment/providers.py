@@ -0,0 +1,367 @@
+# Registry of the LLM providers that label student work. Each provider serves the
+# models whose names start with one of its prefixes, and the provider of a model name
+# is looked up once and cached, so choosing one for a request is a dictionary lookup.
+# New backends are added with register_provider, without changes to Label.
+
+import os
+import csv
+import json
+import time
+import logging
+import functools
+from threading import Lock
+
+from lib.assessment.config import BEDROCK_MAX_CONCURRENT_SAMPLES, LOCAL_PROVIDER
+from lib.assessment.errors import InvalidResponseError, RequestTooLargeError, BedrockServerError
+from lib.assessment.json_stream import JsonArrayStream, JsonStreamError
+from lib.assessment.async_clients import post_openai, run_blocking
+
+AWS_REGION = 'us-east-1'
+
+class UnknownModelError(Exception):
+    pass
+
+# A family of models. Providers label student work through a Label, which supplies the
+# prompts, response validation and consensus voting shared by every provider.
+#
+# Every provider implements build_request, invoke and parse, and label_student_work chains
+# them for a single request. Providers that make several requests per assessment (one per
+# response, or in waves) override label_student_work, building on the same methods.
+class Provider:
+    # Reported as the `agent` in the metadata of assessments
+    agent = None
+    # Model names starting with any of these are served by this provider
+    prefixes = ()
+    # Whether stream_label_student_work yields rows while the model is responding
+    supports_stream = False
+
+    # Returns the result of labeling the student work, a dictionary with `metadata` and
+    # `data`, or None when the model did not give an assessment.
+    def label_student_work(self, label, prompt, rubric, student_code, student_id, examples=[], num_responses=0, temperature=0.0, llm_model="", response_type='tsv'):
+        request = self.build_request(label, prompt, rubric, student_code, examples=examples, num_responses=num_responses, temperature=temperature, llm_model=llm_model)
+        response = self.invoke(label, request, student_id)
+        return self.parse(label, request, response, rubric, student_id, response_type=response_type)
+
+    # Asynchronous counterpart of label_student_work. Unless a provider has an asynchronous
+    # client, the blocking call is made on the blocking thread pool.
+    async def label_student_work_async(self, label, prompt, rubric, student_code, student_id, examples=[], num_responses=0, temperature=0.0, llm_model="", response_type='tsv'):
+        return await run_blocking(self.label_student_work, label, prompt, rubric, student_code, student_id, examples=examples, num_responses=num_responses, temperature=temperature, llm_model=llm_model, response_type=response_type)
+
+    # Yields each validated row of a single response as soon as it arrives
+    def stream_label_student_work(self, label, prompt, rubric, student_code, student_id, examples=[], temperature=0.0, llm_model=""):
+        raise NotImplementedError(f"{self.agent} does not stream assessments")
+
+    # Returns the request to send to the model
+    def build_request(self, label, prompt, rubric, student_code, examples=[], num_responses=0, temperature=0.0, llm_model=""):
+        raise NotImplementedError
+
+    # Sends the request and returns the model's response
+    def invoke(self, label, request, student_id):
+        raise NotImplementedError
+
+    # Returns the result of labeling the student work from the model's response
+    def parse(self, label, request, response, rubric, student_id, response_type='tsv'):
+        raise NotImplementedError
+
+    # Wraps the data of an assessment with the metadata reported for it: the agent, the request
+    # sent to the model and any other metadata given
+    def result(self, request, data, **metadata):
+        return {'metadata': {'agent': self.agent, 'request': request, **metadata}, 'data': data}
+
+    # Returns the token counts reported in the metadata of a result
+    def usage(self, result):
+        return (result or {}).get('metadata', {}).get('usage', {})
+
+    # Returns the most API requests made to label student work with num_responses responses,
+    # which counts against the model's requests per minute (see rate_limiter.py)
+    def request_count(self, label, num_responses):
+        return 1
+
+class OpenaiProvider(Provider):
+    agent = 'openai'
+    prefixes = ('gpt',)
+
+    # Multiple responses may be requested in waves (see Label.sample_responses), which
+    # openai_label_student_work handles.
+    def label_student_work(self, label, prompt, rubric, student_code, student_id, examples=[], num_responses=0, temperature=0.0, llm_model="", response_type='tsv'):
+        return label.openai_label_student_work(prompt, rubric, student_code, student_id, examples=examples, num_responses=num_responses, temperature=temperature, llm_model=llm_model, response_type=response_type)
+
+    async def label_student_work_async(self, label, prompt, rubric, student_code, student_id, examples=[], num_responses=0, temperature=0.0, llm_model="", response_type='tsv'):
+        if label.adaptive_consensus_enabled(num_responses):
+            return await super().label_student_work_async(label, prompt, rubric, student_code, student_id, examples=examples, num_responses=num_responses, temperature=temperature, llm_model=llm_model, response_type=response_type)
+
+        request = self.build_request(label, prompt, rubric, student_code, examples=examples, num_responses=num_responses, temperature=temperature, llm_model=llm_model)
+        api_url, headers, data = request
+        status_code, content_type, text = await post_openai(api_url, headers, data)
+        response = label._openai_response_info(status_code, content_type, text, student_id)
+        return self.parse(label, request, response, rubric, student_id, response_type=response_type)
+
+    def build_request(self, label, prompt, rubric, student_code, examples=[], num_responses=0, temperature=0.0, llm_model=""):
+        return label.compute_openai_request(prompt, rubric, student_code, examples=examples, num_responses=num_responses, temperature=temperature, llm_model=llm_model)
+
+    def invoke(self, label, request, student_id):
+        api_url, headers, data = request
+        return label._openai_post(api_url, headers, data, student_id)
+
+    def parse(self, label, request, response, rubric, student_id, response_type='tsv'):
+        api_url, headers, data = request
+        return label._openai_result(response, data, rubric, student_id, response_type=response_type)
+
+    # A request asks for every response at once, unless they are requested in waves. The first
+    # wave asks for more than half of them and each later wave for at least one more.
+    def request_count(self, label, num_responses):
+        if not label.adaptive_consensus_enabled(num_responses):
+            return 1
+        return 1 + num_responses - label._next_wave_size([], num_responses)
+
+# Models on Amazon Bedrock, called with the boto3 client shared by every Label. A request is the
+# Bedrock model id and the JSON body to send to it, and a response is the decoded response body.
+class BedrockProvider(Provider):
+    # Named in the errors of failed calls
+    api_name = 'Bedrock'
+
+    # The Bedrock model id of a model: its name without 'bedrock.'
+    def bedrock_model(self, label, llm_model):
+        return llm_model[len('bedrock.'):]
+
+    # Returns the decoded response body, or None when the call failed but should not fail the
+    # assessment on its own. Raises BedrockServerError on server errors.
+    def invoke(self, label, request, student_id):
+        return self.invoke_with(label.get_bedrock_client(student_id), request, student_id)
+
+    # Makes the call of invoke with the given client
+    def invoke_with(self, bedrock, request, student_id):
+        bedrock_model, body = request
+        response = bedrock.invoke_model(body=body, modelId=bedrock_model, accept='application/json', contentType='application/json')
+        if not self.check_status(response, student_id):
+            return None
+        return json.loads(response.get('body').read())
+
+    # Returns whether a Bedrock call succeeded. Raises BedrockServerError on server errors.
+    def check_status(self, response, student_id):
+        status = response['ResponseMetadata']['HTTPStatusCode']
+        if status == 500:
+            logging.warning(f"{student_id} Error calling the API: {status}")
+            logging.warning(f"{student_id} Response body: {response['body']}")
+            raise BedrockServerError(f"Error calling {self.api_name} API: {status}")
+        elif status != 200:
+            logging.error(f"{student_id} Error calling the API: {status}")
+            logging.error(f"{student_id} Response body: {response['body']}")
+            return False
+        return True
+
+class BedrockAnthropicProvider(BedrockProvider):
+    agent = 'anthropic'
+    api_name = 'Bedrock Anthropic'
+    prefixes = ('bedrock.anthropic', 'bedrock.us.anthropic')
+    supports_stream = True
+
+    def request_count(self, label, num_responses):
+        return max(1, num_responses)
+
+    # Claude 4 and later are called through inference profiles. Claude 3 just needs 'bedrock.'
+    # stripped from the beginning.
+    def bedrock_model(self, label, llm_model):
+        if not "claude-3" in llm_model:
+            return f'arn:aws:bedrock:{AWS_REGION}:{label.get_aws_account().strip()}:inference-profile/{llm_model[8:]}'
+        return super().bedrock_model(label, llm_model)
+
+    def build_request(self, label, prompt, rubric, student_code, examples=[], num_responses=0, temperature=0.0, llm_model=""):
+        bedrock_model = self.bedrock_model(label, llm_model)
+        anthropic_prompt = label.compute_anthropic_prompt(prompt, rubric, student_code, examples=examples)
+        if "claude" in bedrock_model:
+            body = json.dumps({"anthropic_version": "bedrock-2023-05-31",
+                               "max_tokens": 4096,
+                               "messages": [{"role": "user",
+                                             "content": [{"type": "text",
+                                                          "text": anthropic_prompt}
+                                                        ]
+                                            }]
+                              })
+        else:
+            body = json.dumps({
+                "prompt": anthropic_prompt,
+                "max_tokens_to_sample": 4000,
+                "temperature": temperature,
+                # "top_p": 0.9,
+            })
+        return bedrock_model, body
+
+    # Raises InvalidResponseError or RequestTooLargeError when the response is not a valid assessment
+    def parse(self, label, request, response, rubric, student_id, response_type='tsv', choice_index=None):
+        if response is None:
+            return None
+        bedrock_model, body = request
+        if '\\"Stretch\\"' in response["content"][0]["text"]:
+            response["content"][0]["text"] = response["content"][0]["text"].replace('\\"Stretch\\"', "“Stretch”")
+        data = label.get_response_data_if_valid(response, rubric, student_id, choice_index=choice_index, response_type='json', reraise=True)
+        return self.result(body, data)
+
+    # Bedrock has no equivalent of OpenAI's `n`, so each response is a separate call. The calls
+    # are made concurrently and the valid responses are combined by majority vote.
+    def label_student_work(self, label, prompt, rubric, student_code, student_id, examples=[], num_responses=0, temperature=0.0, llm_model="", response_type='tsv'):
+        bedrock = label.get_bedrock_client(student_id)
+        request = self.build_request(label, prompt, rubric, student_code, examples=examples, temperature=temperature, llm_model=llm_model)
+        max_workers = int(os.getenv('BEDROCK_MAX_CONCURRENT_SAMPLES', BEDROCK_MAX_CONCURRENT_SAMPLES))
+        samples = []
+        def request_wave(count, first_index):
+            wave = label._run_concurrently(
+                lambda index: self.sample(label, bedrock, request, rubric, student_id, first_index + index),
+                count,
+                max_workers,
+            )
+            samples.extend(wave)
+            return [sample['data'] for sample in wave]
+
+        choices, _ = label.sample_responses(request_wave, max(num_responses, 1))
+        if not choices:
+            # Report the first failure the way a single call would
+            errors = [sample['error'] for sample in samples if sample['error']]
+            if errors:
+                raise errors[0]
+            return None
+
+        data = choices[0] if len(choices) == 1 else label.get_consensus_response(choices, student_id)
+        bedrock_model, body = request
+        return self.result(body, data, samples=[{'time': sample['time'], 'valid': bool(sample['data'])} for sample in samples])
+
+    # Makes one call. Returns the elapsed time with either the validated response data or the
+    # error that prevented it. Data and error are both None when the call did not succeed but
+    # should not fail the assessment on its own.
+    def sample(self, label, bedrock, request, rubric, student_id, index):
+        start_time = time.time()
+        try:
+            result = self.parse(label, request, self.invoke_with(bedrock, request, student_id), rubric, student_id, choice_index=index)
+        except (BedrockServerError, InvalidResponseError, RequestTooLargeError) as e:
+            return {'time': time.time() - start_time, 'data': None, 'error': e}
+        return {'time': time.time() - start_time, 'data': result['data'] if result else None, 'error': None}
+
+    # Streams the assessment with invoke_model_with_response_stream, yielding each row of the
+    # response as soon as it has arrived and been validated. Raises InvalidResponseError as soon as
+    # the response can no longer be valid instead of waiting for it to finish.
+    def stream_label_student_work(self, label, prompt, rubric, student_code, student_id, examples=[], temperature=0.0, llm_model=""):
+        bedrock_model, body = self.build_request(label, prompt, rubric, student_code, examples=examples, temperature=temperature, llm_model=llm_model)
+        if not "claude" in bedrock_model:
+            raise ValueError(f"Streaming is not supported for {llm_model}")
+
+        bedrock = label.get_bedrock_client(student_id)
+        response = bedrock.invoke_model_with_response_stream(body=body, modelId=bedrock_model, accept='application/json', contentType='application/json')
+        if not self.check_status(response, student_id):
+            raise BedrockServerError(f"Error calling {self.api_name} API: {response['ResponseMetadata']['HTTPStatusCode']}")
+
+        rubric_key_concepts = set(row['Key Concept'] for row in csv.DictReader(rubric.splitlines()))
+        key_concepts = set()
+        stream = JsonArrayStream()
+        stop_reason = None
+        for event in response['body']:
+            chunk = json.loads(event['chunk']['bytes'])
+            if chunk['type'] == 'message_delta':
+                stop_reason = chunk['delta'].get('stop_reason')
+            if chunk['type'] != 'content_block_delta':
+                continue
+
+            try:
+                elements = stream.feed(chunk['delta'].get('text', ''))
+            except JsonStreamError as e:
+                raise InvalidResponseError(f"JSON decoding error: {e}")
+
+            for element in elements:
+                element = element.replace('\\"Stretch\\"', "“Stretch”")
+                try:
+                    row = json.loads(element, strict=False)
+                except json.JSONDecodeError as e:
+                    raise InvalidResponseError(f"JSON decoding error: {e}\n{element}")
+
+                response_data = [row] if isinstance(row, dict) else []
+                label._sanitize_server_response(response_data)
+                for row in response_data:
+                    label._validate_server_row(row, rubric_key_concepts, key_concepts)
+                    key_concepts.add(row['Key Concept'])
+                    label._sanitize_result([row])
+                    yield row
+
+        if not stream.finished:
+            if stop_reason == 'max_tokens':
+                raise RequestTooLargeError(f"{student_id}: no valid JSON data")
+            raise InvalidResponseError("response ended before the JSON data was complete")
+
+        missing_concepts = rubric_key_concepts - key_concepts
+        if missing_concepts:
+            raise InvalidResponseError(f'unexpected or missing key concept. unexpected: None missing: {missing_concepts}')
+
+class BedrockMetaProvider(BedrockProvider):
+    agent = 'meta'
+    api_name = 'Bedrock Meta'
+    prefixes = ('bedrock.meta',)
+
+    def build_request(self, label, prompt, rubric, student_code, examples=[], num_responses=0, temperature=0.0, llm_model=""):
+        bedrock_model = self.bedrock_model(label, llm_model)
+
+        # raise if the model name does not start with 'meta'
+        if not bedrock_model.startswith("meta."):
+            raise Exception(f"Error parsing llm_model: {llm_model} bedrock_model: {bedrock_model}")
+
+        meta_prompt = label.compute_meta_prompt(prompt, rubric, student_code, examples=examples)
+        body = json.dumps({
+            "prompt": meta_prompt,
+            "max_gen_len": 1536,
+            "temperature": temperature,
+        })
+        return bedrock_model, body
+
+    def parse(self, label, request, response, rubric, student_id, response_type='tsv'):
+        if response is None:
+            return None
+        bedrock_model, body = request
+        data = label.get_response_data_if_valid(response.get('generation'), rubric, student_id, response_type='json')
+        return self.result(body, data)
+
+# A stand-in for a model that answers immediately without any network call, labeling
+# every Key Concept with the lowest label. Useful for exercising the service end to end
+# without credentials, for example in load tests. Registered only with LOCAL_PROVIDER.
+class LocalProvider(Provider):
+    agent = 'local'
+    prefixes = ('local.',)
+
+    def build_request(self, label, prompt, rubric, student_code, examples=[], num_responses=0, temperature=0.0, llm_model=""):
+        return {'model': llm_model, 'key_concepts': [row['Key Concept'] for row in csv.DictReader(rubric.splitlines())]}
+
+    def invoke(self, label, request, student_id):
+        return [
+            {'Key Concept': key_concept, 'Observations': '', 'Evidence': '', 'Reason': 'Assessed by a local stand-in model.', 'Label': 'No Evidence'}
+            for key_concept in request['key_concepts']
+        ]
+
+    def parse(self, label, request, response, rubric, student_id, response_type='tsv'):
+        return self.result(request, response, usage={'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0})
+
+_providers = []
+_providers_lock = Lock()
+
+# Adds a provider. When several providers match a model name, the one with the longest
+# matching prefix serves it, and of those the one registered last.
+def register_provider(provider):
+    with _providers_lock:
+        _providers.append(provider)
+        get_provider.cache_clear()
+
+# Returns the provider that serves the model. Raises UnknownModelError when there is none.
+@functools.lru_cache(maxsize=256)
+def get_provider(llm_model):
+    matches = [
+        (len(prefix), index, provider)
+        for index, provider in enumerate(_providers)
+        for prefix in provider.prefixes
+        if llm_model.startswith(prefix)
+    ]
+    if not matches:
+        raise UnknownModelError(f"Unknown model: {llm_model}")
+    return max(matches, key=lambda match: (match[0], match[1]))[2]
+
+register_provider(OpenaiProvider())
+register_provider(BedrockAnthropicProvider())
+register_provider(BedrockMetaProvider())
+
+# The stand-in answers without asking any model, so it is only served when asked for
+if os.getenv('LOCAL_PROVIDER', str(int(LOCAL_PROVIDER))) in ['1', 'true', 'True']:
+    register_provider(LocalProvider())
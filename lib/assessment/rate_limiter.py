@@ -0,0 +1,211 @@
+# Client-side rate limits for the LLM APIs. Each model can be given a budget of requests
+# per minute, of tokens per minute and of requests in flight at once. Callers over budget
+# are queued in the order they arrived and let through as the budget refills, instead of
+# being throttled by Bedrock or turned away with a 429 by OpenAI. Models without limits
+# are not queued at all.
+#
+# Budgets are token buckets holding up to a minute's worth, so a quiet minute allows a
+# burst of that size. Token counts are estimated from the size of the prompt before the
+# request is made.
+
+import time
+import asyncio
+import itertools
+import contextlib
+from collections import deque
+from threading import Condition
+
+# A rough average for English text and code, and close enough for budgeting
+CHARS_PER_TOKEN = 4
+
+# Returns the estimated number of tokens in the given texts
+def estimate_tokens(*texts):
+    return sum(len(text) for text in texts) // CHARS_PER_TOKEN + 1
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Returns the seconds until amount can be taken. Amounts over the capacity only wait for
+    # a full bucket, so a single large request is slowed down but never stuck.
+    def wait_time(self, amount, now):
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return max(0, (amount - self.level) / self.rate)
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+# Lets an asynchronous caller waiting on future check whether it is its turn
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+# The budget and queue of a single model
+class ModelLimit:
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, max_concurrent=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrent = max_concurrent
+        self.active = 0
+        self._buckets = []
+        if requests_per_minute:
+            self._buckets.append(('requests', TokenBucket(requests_per_minute)))
+        if tokens_per_minute:
+            self._buckets.append(('tokens', TokenBucket(tokens_per_minute)))
+        self._queue = deque()
+        self._tickets = itertools.count()
+        self._condition = Condition()
+        # The event loop and future of each waiting asynchronous caller, by ticket
+        self._async_waiters = {}
+
+    # Lets the caller holding ticket through when it is first in the queue and the budget allows,
+    # and returns 0. Otherwise returns the seconds until the budget allows, or None when waiting on
+    # an earlier caller or on a request in flight. Called with the condition held.
+    def _try_acquire(self, ticket, requests, tokens):
+        if self._queue[0] != ticket:
+            return None
+        if self.max_concurrent and self.active >= self.max_concurrent:
+            return None
+
+        now = time.monotonic()
+        amounts = {'requests': requests, 'tokens': tokens}
+        wait = max([bucket.wait_time(amounts[name], now) for name, bucket in self._buckets], default=0)
+        if wait > 0:
+            return wait
+
+        for name, bucket in self._buckets:
+            bucket.take(amounts[name])
+        self._queue.popleft()
+        self.active += 1
+        self._notify()
+        return 0
+
+    # Wakes the blocking callers, and the asynchronous caller first in the queue, to check whether
+    # it is their turn. Called with the condition held.
+    def _notify(self):
+        self._condition.notify_all()
+        waiter = self._async_waiters.get(self._queue[0]) if self._queue else None
+        if waiter:
+            loop, future = waiter
+            loop.call_soon_threadsafe(_wake, future)
+
+    def _leave_queue(self, ticket):
+        with self._condition:
+            if ticket in self._queue:
+                self._queue.remove(ticket)
+                self._notify()
+
+    # Waits for the budget to allow the requests and tokens, and returns the seconds waited.
+    # Every acquire must be followed by a release once the requests have finished.
+    def acquire(self, requests=1, tokens=0):
+        start_time = time.monotonic()
+        with self._condition:
+            ticket = next(self._tickets)
+            self._queue.append(ticket)
+            try:
+                while (wait := self._try_acquire(ticket, requests, tokens)) != 0:
+                    self._condition.wait(wait)
+            except BaseException:
+                self._queue.remove(ticket)
+                self._notify()
+                raise
+        return time.monotonic() - start_time
+
+    # Asynchronous counterpart of acquire, which waits without blocking the event loop. Shares the
+    # queue with callers of acquire. The caller sleeps until the budget allows, or until woken by
+    # the caller ahead of it or a release.
+    async def acquire_async(self, requests=1, tokens=0):
+        start_time = time.monotonic()
+        loop = asyncio.get_running_loop()
+        with self._condition:
+            ticket = next(self._tickets)
+            self._queue.append(ticket)
+        try:
+            while True:
+                with self._condition:
+                    wait = self._try_acquire(ticket, requests, tokens)
+                    if wait == 0:
+                        break
+                    woken = loop.create_future()
+                    self._async_waiters[ticket] = (loop, woken)
+                await asyncio.wait([woken], timeout=wait)
+        except BaseException:
+            self._leave_queue(ticket)
+            raise
+        finally:
+            with self._condition:
+                self._async_waiters.pop(ticket, None)
+        return time.monotonic() - start_time
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._notify()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'requests_per_minute': self.requests_per_minute,
+                'tokens_per_minute': self.tokens_per_minute,
+                'max_concurrent': self.max_concurrent,
+                'active': self.active,
+                'queued': len(self._queue),
+            }
+
+# The options a model's limits may set
+LIMIT_OPTIONS = ('requests_per_minute', 'tokens_per_minute', 'max_concurrent')
+
+# The limits of every model in the process. limits maps model names to the keyword arguments of
+# a ModelLimit (see LIMIT_OPTIONS). Raises ValueError when the limits of a model are malformed.
+class RateLimiter:
+    def __init__(self, limits):
+        if not isinstance(limits, dict):
+            raise ValueError(f"Rate limits must map model names to their limits, not {limits!r}")
+        for model, options in limits.items():
+            if not isinstance(options, dict):
+                raise ValueError(f"Rate limits of {model} must be an object, not {options!r}")
+            unknown = sorted(set(options) - set(LIMIT_OPTIONS))
+            if unknown:
+                raise ValueError(f"Unknown rate limits for {model}: {', '.join(unknown)}. Expected any of {', '.join(LIMIT_OPTIONS)}")
+        self._limits = {model: ModelLimit(**options) for model, options in limits.items()}
+
+    def get(self, model):
+        return self._limits.get(model)
+
+    # Context manager holding a place in the model's budget while the requests are made. Yields the
+    # seconds spent queued, or None when the model is not limited.
+    @contextlib.contextmanager
+    def limit(self, model, requests=1, tokens=0):
+        limit = self._limits.get(model)
+        if limit is None:
+            yield None
+            return
+        queue_time = limit.acquire(requests, tokens)
+        try:
+            yield queue_time
+        finally:
+            limit.release()
+
+    # Asynchronous counterpart of limit
+    @contextlib.asynccontextmanager
+    async def limit_async(self, model, requests=1, tokens=0):
+        limit = self._limits.get(model)
+        if limit is None:
+            yield None
+            return
+        queue_time = await limit.acquire_async(requests, tokens)
+        try:
+            yield queue_time
+        finally:
+            limit.release()
+
+    def stats(self):
+        return {model: limit.stats() for model, limit in self._limits.items()}
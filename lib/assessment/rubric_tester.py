@@ -24,6 +24,7 @@ from collections import defaultdict
 
 from lib.assessment.config import SUPPORTED_MODELS, DEFAULT_MODEL, VALID_LABELS, PASSING_LABELS, LESSONS, DEFAULT_DATASET_NAME
 from lib.assessment.label import Label, InvalidResponseError, RequestTooLargeError
+from lib.assessment.batch_cfe import batch_cfe_label_student_work
 from lib.assessment.report import Report
 from lib.assessment.confidence import get_pass_fail_confidence, get_exact_match_confidence
 
@@ -72,6 +73,8 @@ def command_line_options():
     parser.add_argument('-w', '--workers', type=int, default=7,
                         help='Number of workers to use for processing. Defaults to 7 workers.')
     parser.add_argument('--new-labels', action='store_true', help='Generate new labels for the dataset using LLM')
+    parser.add_argument('--batch-cfe', action='store_true',
+                        help='When the code feature extractor assesses every Key Concept of a lesson, label all students at once without evidence.')
 
     args = parser.parse_args()
 
@@ -291,6 +294,16 @@ def read_and_label_student_work(prompt, rubric, student_file, examples, options,
     return student_id, labels
 
 
+# Labels every student with the code feature extractor in one batch. Returns
+# (student_id, labels) pairs like read_and_label_student_work.
+def batch_label_student_files(rubric, student_files, params):
+    submissions = []
+    for student_file in student_files:
+        with open(student_file, 'r') as f:
+            submissions.append((os.path.splitext(os.path.basename(student_file))[0], f.read()))
+    return batch_cfe_label_student_work(submissions, rubric, params['code-feature-extractor'], params.get('lesson', None))
+
+
 def main():
     log_level = os.getenv('LOG_LEVEL', 'INFO')
     logging.basicConfig(format='%(asctime)s: %(levelname)s: %(message)s', level=log_level)
@@ -369,9 +382,16 @@ def main():
             for file in glob.glob(f'{os.path.join(params_lesson_prefix, cache_dir_name)}/*'):
                 os.remove(file)
 
-        # call label function to either call the AI agent or read from cache
-        with concurrent.futures.ThreadPoolExecutor(max_workers=options.workers) as executor:
-            predicted_labels = list(executor.map(lambda student_file: read_and_label_student_work(prompt, rubric, student_file, examples, options, params, params_lesson_prefix, response_type), student_files))
+        # call label function to either call the AI agent or read from cache. When the code feature
+        # extractor covers the whole rubric, --batch-cfe labels every student at once instead.
+        cfe_key_concepts = params.get('code-feature-extractor') or []
+        if options.batch_cfe and cfe_key_concepts and all(row['Key Concept'] in cfe_key_concepts for row in csv.DictReader(rubric.splitlines())):
+            predicted_labels = batch_label_student_files(rubric, student_files, params)
+        else:
+            if options.batch_cfe:
+                logging.info(f"code feature extractor does not assess every Key Concept of {lesson}, labeling students individually")
+            with concurrent.futures.ThreadPoolExecutor(max_workers=options.workers) as executor:
+                predicted_labels = list(executor.map(lambda student_file: read_and_label_student_work(prompt, rubric, student_file, examples, options, params, params_lesson_prefix, response_type), student_files))
 
         errors = [student_id for student_id, labels in predicted_labels if not labels]
         # predicted_labels contains metadata and data (labels), we care about the data key
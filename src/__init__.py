@@ -8,6 +8,7 @@ import logging
 from src.test import test_routes
 from src.openai import openai_routes
 from src.assessment import assessment_routes
+from lib.assessment.label import Label
 
 
 # Flask
@@ -49,15 +50,23 @@ def create_app(test_config=None):
     def root():
         return 'Success.'
 
+    # Malformed rate limits fail at startup rather than on every assessment
+    Label.get_rate_limiter()
+
     app.register_blueprint(test_routes)
     app.register_blueprint(openai_routes)
     app.register_blueprint(assessment_routes)
 
     @app.before_request
     def require_aiproxy_api_key():
-        if request.method == "POST":
-            aiproxy_api_key = request.headers.get('Authorization')
-            if aiproxy_api_key != os.getenv('AIPROXY_API_KEY'):
-                return jsonify({"error": "Unauthorized"}), 401
+        if request.method == "POST" and not is_authorized(request.headers):
+            return jsonify(UNAUTHORIZED), 401
 
     return app
+
+# The body of the response to POST requests without the AIProxy API key
+UNAUTHORIZED = {"error": "Unauthorized"}
+
+# Whether the request headers carry the AIProxy API key. Shared with the ASGI entry point (src/asgi.py).
+def is_authorized(headers):
+    return headers.get('Authorization') == os.getenv('AIPROXY_API_KEY')
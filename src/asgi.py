@@ -0,0 +1,178 @@
+# ASGI entry point, alongside the WSGI app from src:create_app. POST /assessment is
+# served on the event loop: the request waits for the LLM without holding a thread,
+# so a single process can have hundreds of assessments in flight. Every other route
+# is passed on to the Flask app, which runs on the blocking thread pool.
+#
+# Serve it with any ASGI server, for example:
+#   uvicorn --factory src.asgi:create_asgi_app
+
+import io
+import os
+import sys
+import json
+import asyncio
+
+import openai
+from werkzeug.wrappers import Request
+
+from src import create_app, is_authorized, UNAUTHORIZED
+from src.assessment import assessment_options, assessment_failure, missing_parameter_error, invalid_labels_error
+from lib.assessment import assess
+from lib.assessment.config import DEFAULT_MODEL
+from lib.assessment.async_clients import close_openai_session, get_blocking_executor
+
+
+def create_asgi_app(test_config=None):
+    flask_app = create_app(test_config)
+
+    async def app(scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await lifespan(receive, send)
+            return
+        if scope['type'] == 'websocket':
+            # Closing before accepting rejects the handshake
+            await receive()
+            await send({'type': 'websocket.close'})
+            return
+        if scope['type'] != 'http':
+            return
+
+        body = await read_body(receive)
+        environ = wsgi_environ(scope, body)
+        if scope['method'] == 'POST' and scope['path'] == '/assessment':
+            status, content_type, content = await post_assessment(Request(environ))
+            await send_response(send, status, content_type, content)
+        else:
+            await call_wsgi(flask_app.wsgi_app, environ, send)
+
+    return app
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_openai_session()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+# Submit a rubric assessment. Shares its checks and error responses with post_assessment in
+# src/assessment.py. Returns the status, content type and body of the response; errors that
+# are not mapped to a response are raised.
+async def post_assessment(request):
+    if not is_authorized(request.headers):
+        return 401, 'application/json', json.dumps(UNAUTHORIZED)
+
+    openai.api_key = os.getenv('OPENAI_API_KEY')
+    error = missing_parameter_error(request.values)
+    if error:
+        return error_response(error)
+
+    llm_model = request.values.get("model", DEFAULT_MODEL)
+
+    try:
+        labels = await assess.validate_and_label_async(
+            code=request.values.get("code", ""),
+            **assessment_options(request.values)
+        )
+    except Exception as e:
+        return error_response(assessment_failure(e, llm_model))
+
+    error = invalid_labels_error(labels)
+    if error:
+        return error_response(error)
+
+    return 200, 'application/json', json.dumps(labels)
+
+# The status, content type and body of a (message, status) error response, as Flask sends it
+def error_response(error):
+    message, status = error
+    return status, 'text/html; charset=utf-8', message
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body', False):
+            return body
+
+async def send_response(send, status, content_type, content):
+    body = content.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode('latin-1')), (b'content-length', str(len(body)).encode('latin-1'))],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+# Builds the WSGI environ of an HTTP request from its ASGI scope and body
+def wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+
+    for name, value in scope.get('headers', []):
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'content-length':
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+# Serves a request with a WSGI app. The app runs on a single thread of the blocking pool
+# from start to finish, and each piece of its response is sent as soon as it is produced,
+# so streamed responses stay streamed.
+async def call_wsgi(wsgi_app, environ, send):
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+    def run():
+        try:
+            iterable = wsgi_app(environ, start_response)
+            try:
+                for chunk in iterable:
+                    loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+            finally:
+                if hasattr(iterable, 'close'):
+                    iterable.close()
+        finally:
+            loop.call_soon_threadsafe(chunks.put_nowait, None)
+
+    finished = loop.run_in_executor(get_blocking_executor(), run)
+    started = False
+    while (chunk := await chunks.get()) is not None:
+        if not started:
+            await send({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+            started = True
+        if chunk:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    await finished
+
+    if not started:
+        await send({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+    await send({'type': 'http.response.body', 'body': b''})
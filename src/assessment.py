@@ -1,79 +1,273 @@
 # These routes (/assessment) issue AI driven rubric assessments.
 # The /test/assessment will issue a hard-coded AI assessment of a rubric.
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 
 import os
 import openai
 import json
 import logging
+import time
+import asyncio
 import requests
+import botocore
 
-from lib.assessment.config import DEFAULT_MODEL
+from lib.assessment.config import DEFAULT_MODEL, BATCH_MAX_SUBMISSIONS
 
 # Our assessment code
 from lib.assessment import assess
 from lib.assessment.assess import KeyConceptError
-from lib.assessment.label import InvalidResponseError, RequestTooLargeError, OpenaiServerError, BedrockServerError
+from lib.assessment.jobs import get_job_queue, JobQueueFullError
+from lib.assessment.label import Label, InvalidResponseError, RequestTooLargeError, OpenaiServerError, BedrockServerError
 
 
 assessment_routes = Blueprint('assessment_routes', __name__)
 
 
+# Maps an exception raised while labeling to the (message, status) pair returned
+# to the caller. Returns None for exceptions that should propagate.
+def assessment_error(e, llm_model):
+    if isinstance(e, ValueError):
+        return "One of the arguments is not parseable as a number", 400
+    elif isinstance(e, RequestTooLargeError):
+        return str(e), 413
+    elif isinstance(e, InvalidResponseError):
+        return f'InvalidResponseError: {str(e)}', 400
+    elif isinstance(e, KeyConceptError):
+        return str(e), 400
+    elif isinstance(e, OpenaiServerError):
+        return f"OpenAI server error: #{e}: ", 503
+    elif isinstance(e, BedrockServerError):
+        return f"Bedrock server error: #{e}: ", 503
+    elif isinstance(e, (requests.exceptions.ReadTimeout, asyncio.TimeoutError, botocore.exceptions.ReadTimeoutError)):
+        if 'gpt' in llm_model:
+            return f"OpenAI timeout: #{e}: ", 504
+        elif 'bedrock' in llm_model:
+            return f"Bedrock timeout: #{e}: ", 504
+        else:
+            return f"LLM timeout: #{e}: ", 504
+    return None
+
+# Returns the (message, status) response for an exception raised while labeling. Exceptions
+# that are not mapped to a response are raised again.
+def assessment_failure(e, llm_model):
+    error = assessment_error(e, llm_model)
+    if error is None:
+        raise e
+    return error
+
+# Returns the (message, status) response for a request missing one of the named parameters,
+# or None when they are all given.
+def missing_parameter_error(values, names=("code", "prompt", "rubric")):
+    for name in names:
+        if values.get(name, None) == None:
+            return f"`{name}` is required", 400
+    return None
+
+# Returns the (message, status) response when labels are not a usable assessment, or None.
+def invalid_labels_error(labels):
+    if not isinstance(labels, dict) or not isinstance(labels.get("data"), list):
+        return "response from AI or service not valid", 400
+    return None
+
+# Parses the `codes` parameter of a batch assessment into (student_id, code) pairs.
+# Each entry is either a string of code or an object with `code` and an optional `student_id`.
+def parse_batch_submissions(codes):
+    submissions = []
+    for i, entry in enumerate(codes):
+        if isinstance(entry, str):
+            submissions.append((str(i), entry))
+        elif isinstance(entry, dict) and isinstance(entry.get("code"), str):
+            submissions.append((str(entry.get("student_id", i)), entry["code"]))
+        else:
+            raise ValueError(f"entry {i} of `codes` must be a string or an object with a `code` string")
+    return submissions
+
+
+# Reads the assessment options shared by the assessment routes from the request, or
+# from the given form values. Raises ValueError when a numeric option cannot be parsed.
+def assessment_options(values=None):
+    if values is None:
+        values = request.values
+    return dict(
+        prompt=values.get("prompt", ""),
+        rubric=values.get("rubric", ""),
+        examples=json.loads(values.get("examples", "[]")),
+        api_key=values.get("api-key", openai.api_key),
+        llm_model=values.get("model", DEFAULT_MODEL),
+        remove_comments=(values.get("remove-comments", "0") != "0"),
+        num_responses=int(values.get("num-responses", "1")),
+        temperature=float(values.get("temperature", "0.2")),
+        response_type=values.get("response-type", "tsv"),
+        code_feature_extractor=(values.get("code-feature-extractor", None)),
+        lesson=(values.get("lesson", None))
+    )
+
 # Submit a rubric assessment
 @assessment_routes.route('/assessment', methods=['POST'])
 def post_assessment():
     openai.api_key = os.getenv('OPENAI_API_KEY')
-    if request.values.get("code", None) == None:
-        return "`code` is required", 400
+    error = missing_parameter_error(request.values)
+    if error:
+        return error
 
-    if request.values.get("prompt", None) == None:
-        return "`prompt` is required", 400
+    llm_model = request.values.get("model", DEFAULT_MODEL)
 
-    if request.values.get("rubric", None) == None:
-        return "`rubric` is required", 400
+    try:
+        labels = assess.validate_and_label(
+            code=request.values.get("code", ""),
+            **assessment_options()
+        )
+    except Exception as e:
+        return assessment_failure(e, llm_model)
+
+    return invalid_labels_error(labels) or labels
+
+# Submit a rubric assessment and stream the result as server-sent events. Each Key
+# Concept is sent in a `label` event as soon as it is known, followed by a `metadata`
+# event. Failures after the stream has started are sent as an `error` event.
+@assessment_routes.route('/assessment/stream', methods=['POST'])
+def post_assessment_stream():
+    openai.api_key = os.getenv('OPENAI_API_KEY')
+    error = missing_parameter_error(request.values)
+    if error:
+        return error
 
-    examples = json.loads(request.values.get("examples", "[]"))
     llm_model = request.values.get("model", DEFAULT_MODEL)
 
     try:
-        labels = assess.validate_and_label(
+        events = assess.validate_and_label_stream(
             code=request.values.get("code", ""),
-            prompt=request.values.get("prompt", ""),
-            rubric=request.values.get("rubric", ""),
-            examples=examples,
-            api_key=request.values.get("api-key", openai.api_key),
-            llm_model=llm_model,
-            remove_comments=(request.values.get("remove-comments", "0") != "0"),
-            num_responses=int(request.values.get("num-responses", "1")),
-            temperature=float(request.values.get("temperature", "0.2")),
-            response_type=request.values.get("response-type", "tsv"),
-            code_feature_extractor=(request.values.get("code-feature-extractor", None)),
-            lesson=(request.values.get("lesson", None))
+            **assessment_options()
         )
+    except Exception as e:
+        return assessment_failure(e, llm_model)
+
+    if events is None:
+        return "response from AI or service not valid", 400
+
+    def generate():
+        try:
+            for event, data in events:
+                yield server_sent_event(event, data)
+        except Exception as e:
+            message, status = assessment_error(e, llm_model) or (f"Assessment failed: {type(e).__name__}", 500)
+            if status == 500:
+                logging.exception("streamed assessment failed")
+            yield server_sent_event('error', {'error': message, 'status': status})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+def server_sent_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Submit a batch of rubric assessments that share a prompt, rubric and examples
+@assessment_routes.route('/assessment/batch', methods=['POST'])
+def post_assessment_batch():
+    openai.api_key = os.getenv('OPENAI_API_KEY')
+    error = missing_parameter_error(request.values, names=("codes", "prompt", "rubric"))
+    if error:
+        return error
+
+    try:
+        codes = json.loads(request.values.get("codes"))
+        if not isinstance(codes, list):
+            raise ValueError("`codes` must be a JSON array")
+        submissions = parse_batch_submissions(codes)
+    except ValueError as e:
+        return f"`codes` is not valid: {e}", 400
+
+    if len(submissions) > BATCH_MAX_SUBMISSIONS:
+        return f"`codes` may contain at most {BATCH_MAX_SUBMISSIONS} submissions", 413
+
+    llm_model = request.values.get("model", DEFAULT_MODEL)
+
+    start_time = time.time()
+    try:
+        results = assess.validate_and_label_batch(submissions, **assessment_options())
     except ValueError:
         return "One of the arguments is not parseable as a number", 400
-    except RequestTooLargeError as e:
-        return str(e), 413
-    except InvalidResponseError as e:
-        return f'InvalidResponseError: {str(e)}', 400
     except KeyConceptError as e:
-        return e, 400
-    except OpenaiServerError as e:
-        return f"OpenAI server error: #{e}: ", 503
-    except BedrockServerError as e:
-        return f"Bedrock server error: #{e}: ", 503
-    except requests.exceptions.ReadTimeout as e:
-        if 'gpt' in llm_model:
-            return f"OpenAI timeout: #{e}: ", 504
-        elif 'bedrock' in llm_model:
-            return f"Bedrock timeout: #{e}: ", 504
-        else:
-            return f"LLM timeout: #{e}: ", 504
+        return str(e), 400
 
-    if not isinstance(labels, dict) or not isinstance(labels.get("data"), list):
+    # An empty result for a non-empty batch means the service could not label anything
+    if len(submissions) > 0 and len(results) == 0:
         return "response from AI or service not valid", 400
 
+    data = []
+    for student_id, labels, error in results:
+        if error is not None:
+            message, status = assessment_error(error, llm_model) or (f"Assessment failed: {error}", 500)
+        else:
+            message, status = invalid_labels_error(labels) or (None, 200)
+        if status == 200:
+            data.append({'student_id': student_id, 'status': 200, **labels})
+        else:
+            data.append({'student_id': student_id, 'status': status, 'error': message})
+
+    succeeded = len([result for result in data if result['status'] == 200])
+    return {
+        'metadata': {
+            'time': time.time() - start_time,
+            'count': len(data),
+            'succeeded': succeeded,
+            'failed': len(data) - succeeded,
+        },
+        'data': data,
+    }
+
+# Queue a rubric assessment to run in the background. Poll the returned job id
+# with GET /assessment/jobs/<id> for its status and result.
+@assessment_routes.route('/assessment/jobs', methods=['POST'])
+def post_assessment_job():
+    openai.api_key = os.getenv('OPENAI_API_KEY')
+    error = missing_parameter_error(request.values)
+    if error:
+        return error
+
+    llm_model = request.values.get("model", DEFAULT_MODEL)
+
+    try:
+        options = assessment_options()
+    except ValueError:
+        return "One of the arguments is not parseable as a number", 400
+
+    try:
+        job_id = get_job_queue().submit(
+            run_assessment_job,
+            format_error=lambda e: assessment_error(e, llm_model),
+            code=request.values.get("code", ""),
+            **options
+        )
+    except JobQueueFullError as e:
+        return str(e), 429
+
+    return {'id': job_id, 'status': get_job_queue().get(job_id)['status']}, 202
+
+# Report the status of a queued assessment, including its result once finished
+@assessment_routes.route('/assessment/jobs/<job_id>', methods=['GET'])
+def get_assessment_job(job_id):
+    # Results include the submitted code, so require the same key as the POST routes
+    if request.headers.get('Authorization') != os.getenv('AIPROXY_API_KEY'):
+        return jsonify({"error": "Unauthorized"}), 401
+
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return "Unknown job", 404
+
+    return job
+
+# Report the rate limits of each limited model and the requests it has active and queued
+@assessment_routes.route('/assessment/rate_limits', methods=['GET'])
+def get_assessment_rate_limits():
+    return jsonify(Label.get_rate_limiter().stats())
+
+# Runs a queued assessment, failing the job when the result is not usable.
+def run_assessment_job(**kwargs):
+    labels = assess.validate_and_label(**kwargs)
+    error = invalid_labels_error(labels)
+    if error:
+        raise InvalidResponseError(error[0])
     return labels
 
 # Submit a test rubric assessment
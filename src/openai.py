@@ -1,6 +1,7 @@
 # These routes (/openai) will query the OpenAI API with the configured API key.
 # This is useful for using the OpenAI API to determine metrics and usage data.
 # Right now, we can query the list of models available. (/openai/models)
+# The connections kept open to the API for assessments are reported by /openai/pool.
 # The '/test/openai' route will query the given chat model with a small prompt.
 
 from flask import Blueprint, request, jsonify
@@ -8,6 +9,8 @@ from flask import Blueprint, request, jsonify
 import os
 import openai
 
+from lib.assessment.label import Label
+
 openai_routes = Blueprint('openai_routes', __name__)
 
 # Just report the models from OpenAI
@@ -16,6 +19,11 @@ def get_openai_models():
     openai.api_key = os.getenv('OPENAI_API_KEY')
     return openai.Model.list().data
 
+# Report the pool of connections that assessments use to reach OpenAI
+@openai_routes.route('/openai/pool')
+def get_openai_pool():
+    return jsonify(Label.get_openai_pool_stats())
+
 # Submit a test prompt
 @openai_routes.route('/test/openai', methods=['GET'])
 def test_openai():
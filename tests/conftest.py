@@ -58,6 +58,23 @@ def mock_env_vars(request):
             yield
 
 
+@pytest.fixture(autouse=True)
+def reset_response_cache():
+    """ Ensures cached assessments, code features, OpenAI connections, model latencies and rate limits do not leak between tests.
+    """
+    from lib.assessment.label import Label
+    Label._response_cache = None
+    Label._feature_cache = None
+    Label._openai_session = None
+    Label._latencies.clear()
+    Label._rate_limiter = None
+    yield
+    Label._response_cache = None
+    Label._feature_cache = None
+    Label._openai_session = None
+    Label._rate_limiter = None
+
+
 @pytest.fixture()
 def client(app):
     return app.test_client()
@@ -72,3 +89,25 @@ def randomstring():
         return ''.join(random.choices(string.ascii_uppercase + string.ascii_lowercase + string.digits, k=N))
 
     return genrandomstring
+
+
+@pytest.fixture()
+def claude_stream_events():
+    """ Returns a function that splits response text into the events of a Bedrock
+        invoke_model_with_response_stream body.
+    """
+    import json
+
+    def gen_events(text, chunk_size=16, stop_reason='end_turn'):
+        chunks = [{'type': 'message_start', 'message': {'role': 'assistant'}}]
+        chunks += [
+            {'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': text[i:i + chunk_size]}}
+            for i in range(0, len(text), chunk_size)
+        ]
+        chunks += [
+            {'type': 'message_delta', 'delta': {'stop_reason': stop_reason}},
+            {'type': 'message_stop'},
+        ]
+        return [{'chunk': {'bytes': json.dumps(chunk).encode('utf-8')}} for chunk in chunks]
+
+    return gen_events
@@ -0,0 +1,119 @@
+import json
+import os
+import asyncio
+
+from urllib.parse import urlencode
+
+import pytest
+
+from src.asgi import create_asgi_app
+
+
+def asgi_request(app, method, path, data=None, authorization=None):
+    """ Sends one HTTP request to the ASGI app and returns its status, headers and body.
+    """
+
+    body = urlencode(data).encode('utf-8') if data is not None else b''
+    headers = [(b'content-type', b'application/x-www-form-urlencoded')]
+    if authorization is not None:
+        headers.append((b'authorization', authorization.encode('latin-1')))
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'headers': headers}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(app(scope, receive, send))
+
+    start = messages[0]
+    assert start['type'] == 'http.response.start'
+    return start['status'], dict(start['headers']), b''.join(message.get('body', b'') for message in messages[1:])
+
+@pytest.fixture
+def asgi_app():
+    yield create_asgi_app()
+
+class TestAsgiApp:
+    def test_should_serve_other_routes_with_flask(self, asgi_app):
+        status, headers, body = asgi_request(asgi_app, 'GET', '/')
+
+        assert status == 200
+        assert body == b'Success.'
+
+    def test_should_complete_the_lifespan(self, asgi_app):
+        received = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return received.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        asyncio.run(asgi_app({'type': 'lifespan'}, receive, send))
+
+        assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+
+    def test_should_reject_websockets(self, asgi_app):
+        sent = []
+
+        async def receive():
+            return {'type': 'websocket.connect'}
+
+        async def send(message):
+            sent.append(message['type'])
+
+        asyncio.run(asgi_app({'type': 'websocket', 'path': '/assessment', 'headers': []}, receive, send))
+
+        assert sent == ['websocket.close']
+
+class TestAsgiPostAssessment:
+    """ Tests POST to '/assessment' on the event loop of the ASGI app.
+    """
+
+    def test_should_require_the_api_key(self, asgi_app, lesson_11_openai_request_data):
+        os.environ['AIPROXY_API_KEY'] = 'test_key'
+
+        status, headers, body = asgi_request(asgi_app, 'POST', '/assessment', lesson_11_openai_request_data, authorization='wrong_key')
+
+        assert status == 401
+
+    def test_should_require_code(self, asgi_app, lesson_11_openai_request_data):
+        os.environ['AIPROXY_API_KEY'] = 'test_key'
+        del lesson_11_openai_request_data['code']
+
+        status, headers, body = asgi_request(asgi_app, 'POST', '/assessment', lesson_11_openai_request_data, authorization='test_key')
+
+        assert status == 400
+        assert body == b'`code` is required'
+
+    def test_succeeds_when_openai_returns_valid_response(self, mocker, asgi_app, lesson_11_openai_request_data, lesson_11_openai_response_data):
+        post_openai = mocker.patch('lib.assessment.providers.post_openai', return_value=(200, 'application/json', json.dumps(lesson_11_openai_response_data)))
+        os.environ['AIPROXY_API_KEY'] = 'test_key'
+
+        status, headers, body = asgi_request(asgi_app, 'POST', '/assessment', lesson_11_openai_request_data, authorization='test_key')
+
+        assert status == 200
+        assert headers[b'content-type'] == b'application/json'
+        response_data = json.loads(body)
+        assert response_data['metadata']['agent'] == 'openai'
+        assert response_data['data'][2]['Key Concept'] == "Position - Elements and the Coordinate System"
+        post_openai.assert_called_once()
+
+    def test_should_return_504_when_openai_times_out(self, mocker, asgi_app, lesson_11_openai_request_data):
+        mocker.patch('lib.assessment.providers.post_openai', side_effect=asyncio.TimeoutError())
+        os.environ['AIPROXY_API_KEY'] = 'test_key'
+
+        status, headers, body = asgi_request(asgi_app, 'POST', '/assessment', lesson_11_openai_request_data, authorization='test_key')
+
+        assert status == 504
+
+    def test_should_raise_unmapped_errors(self, mocker, asgi_app, lesson_11_openai_request_data):
+        mocker.patch('lib.assessment.providers.post_openai', side_effect=RuntimeError('unexpected'))
+        os.environ['AIPROXY_API_KEY'] = 'test_key'
+
+        with pytest.raises(RuntimeError):
+            asgi_request(asgi_app, 'POST', '/assessment', lesson_11_openai_request_data, authorization='test_key')
@@ -2,8 +2,12 @@ import json
 import io
 import openai
 import os
+import time
 
-from lib.assessment.label import Label, RequestTooLargeError
+import pytest
+
+from lib.assessment.jobs import JobQueue, MemoryJobStore
+from lib.assessment.label import Label, RequestTooLargeError, BedrockServerError
 
 class TestPostAssessment:
     """ Tests POST to '/assessment' to start an assessment.
@@ -19,7 +23,8 @@ class TestPostAssessment:
 
     def test_succeeds_when_bedrock_returns_valid_response(self, mocker, client, stub_code, stub_prompt, lesson_11_rubric, claude_model, lesson_11_claude_request_data, lesson_11_claude_response_body):
         # stub the bedrock response
-        bedrock_response = self._get_bedrock_response(lesson_11_claude_response_body)
+        # each call reads its own response body
+        bedrock_response = lambda: self._get_bedrock_response(lesson_11_claude_response_body)
         class mock_bedrock_client:
             def invoke_model(body, modelId, accept, contentType):
                 assert stub_code in body
@@ -29,7 +34,7 @@ class TestPostAssessment:
                 assert modelId == claude_model
                 assert accept == 'application/json'
                 assert contentType == 'application/json'
-                return bedrock_response
+                return bedrock_response()
         get_bedrock_client_mock = mocker.patch.object(
             Label,
             'get_bedrock_client',
@@ -64,10 +69,11 @@ class TestPostAssessment:
 
     def test_returns_4xx_when_bedrock_returns_mismatched_key_concept(self, mocker, client, lesson_11_claude_request_data, lesson_11_claude_response_body_mismatched):
         # stub the bedrock response
-        bedrock_response = self._get_bedrock_response(lesson_11_claude_response_body_mismatched)
+        # each call reads its own response body
+        bedrock_response = lambda: self._get_bedrock_response(lesson_11_claude_response_body_mismatched)
         class mock_bedrock_client:
             def invoke_model(body, modelId, accept, contentType):
-                return bedrock_response
+                return bedrock_response()
         get_bedrock_client_mock = mocker.patch.object(
             Label,
             'get_bedrock_client',
@@ -92,10 +98,10 @@ class TestPostAssessment:
 
     def test_should_return_413_when_json_is_truncated_due_to_length(self, mocker, client, randomstring, lesson_11_rubric, bedrock_claude_model, lesson_11_claude_response_body_too_large):
         # stub the bedrock response
-        bedrock_response = self._get_bedrock_response(lesson_11_claude_response_body_too_large)
+        bedrock_response = lambda: self._get_bedrock_response(lesson_11_claude_response_body_too_large)
         class mock_bedrock_client:
             def invoke_model(body, modelId, accept, contentType):
-                return bedrock_response
+                return bedrock_response()
         get_bedrock_client_mock = mocker.patch.object(
             Label,
             'get_bedrock_client',
@@ -140,12 +146,15 @@ class TestPostAssessment:
 
         assert response.status_code == 200
 
-    def test_uses_code_feature_extractor_when_requested(self, client, mocker, lesson_11_claude_request_data, lesson_11_claude_response_body):
-        # stub the bedrock response
-        bedrock_response = self._get_bedrock_response(lesson_11_claude_response_body)
+    def test_uses_code_feature_extractor_when_requested(self, client, mocker, lesson_11_claude_request_data, lesson_11_eval):
+        # stub the bedrock response, which only assesses the Key Concepts not covered by the code feature extractor
+        # each call reads its own response body
+        response_body = json.dumps({'content': [{'type': 'text', 'text': json.dumps(lesson_11_eval[:2])}], 'stop_reason': 'end_turn'})
+        bedrock_response = lambda: self._get_bedrock_response(response_body)
         class mock_bedrock_client:
             def invoke_model(body, modelId, accept, contentType):
-                return bedrock_response
+                assert "Position - Elements and the Coordinate System" not in body
+                return bedrock_response()
         get_bedrock_client_mock = mocker.patch.object(
             Label,
             'get_bedrock_client',
@@ -169,6 +178,7 @@ class TestPostAssessment:
         # validate response data
         response_data = response.json
         assert response_data['metadata']['agent'] == 'anthropic, code feature extractor'
+        assert response_data['metadata']['path'] == 'llm+cfe'
         learning_goal = response_data['data'][2]
         assert learning_goal['Key Concept'] == "Position - Elements and the Coordinate System"
         # LLM label overridden by CFE
@@ -362,6 +372,309 @@ class TestPostAssessmentUnitTests:
         assert response.json == label_mock.return_value
 
 
+class TestPostAssessmentStream:
+    """ Tests POST to '/assessment/stream' to stream an assessment as server-sent events.
+    """
+
+    def _parse_events(self, body):
+        events = []
+        for message in body.decode('utf-8').strip().split("\n\n"):
+            lines = dict(line.split(": ", 1) for line in message.split("\n"))
+            events.append((lines['event'], json.loads(lines['data'])))
+        return events
+
+    def _stub_stream(self, mocker, events):
+        class mock_bedrock_client:
+            def invoke_model_with_response_stream(body, modelId, accept, contentType):
+                return {'ResponseMetadata': {'HTTPStatusCode': 200}, 'body': iter(events)}
+        mocker.patch.object(Label, 'get_bedrock_client', return_value=mock_bedrock_client)
+        mocker.patch.object(Label, 'get_aws_account', return_value='12345')
+
+    def test_should_stream_each_label_then_metadata(self, mocker, client, lesson_11_claude_request_data, lesson_11_eval, claude_stream_events):
+        self._stub_stream(mocker, claude_stream_events(json.dumps(lesson_11_eval)))
+        request_data = lesson_11_claude_request_data
+        request_data['num-responses'] = '1'
+
+        os.environ['AIPROXY_API_KEY'] = 'test_key'
+        response = client.post('/assessment/stream', query_string=request_data, headers={"Content-type": "application/x-www-form-urlencoded", "Authorization": "test_key"})
+
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        events = self._parse_events(response.data)
+        assert [event for event, _ in events] == ['label', 'label', 'label', 'metadata']
+        assert [data['Key Concept'] for _, data in events[:3]] == [row['Key Concept'] for row in lesson_11_eval]
+        assert events[2][1]['Label'] == "Limited Evidence"
+        assert events[3][1]['agent'] == 'anthropic'
+
+    def test_should_stream_code_feature_extractor_labels_first(self, mocker, client, lesson_11_claude_request_data, lesson_11_eval, claude_stream_events):
+        self._stub_stream(mocker, claude_stream_events(json.dumps(lesson_11_eval[:2])))
+        request_data = lesson_11_claude_request_data
+        request_data['num-responses'] = '1'
+        request_data['code-feature-extractor'] = "Position - Elements and the Coordinate System"
+        request_data['lesson'] = 'csd3-2023-L11'
+
+        os.environ['AIPROXY_API_KEY'] = 'test_key'
+        response = client.post('/assessment/stream', query_string=request_data, headers={"Content-type": "application/x-www-form-urlencoded", "Authorization": "test_key"})
+
+        assert response.status_code == 200
+        events = self._parse_events(response.data)
+        assert [event for event, _ in events] == ['label', 'label', 'label', 'metadata']
+        assert events[0][1]['Key Concept'] == "Position - Elements and the Coordinate System"
+        # LLM label overridden by CFE
+        assert events[0][1]['Label'] == "No Evidence"
+        assert [data['Key Concept'] for _, data in events[1:3]] == [row['Key Concept'] for row in lesson_11_eval[:2]]
+        assert events[3][1]['agent'] == 'anthropic, code feature extractor'
+
+    def test_should_stream_static_labels_for_blank_code(self, client, lesson_11_claude_request_data):
+        request_data = lesson_11_claude_request_data
+        request_data['code'] = ""
+
+        os.environ['AIPROXY_API_KEY'] = 'test_key'
+        response = client.post('/assessment/stream', query_string=request_data, headers={"Content-type": "application/x-www-form-urlencoded", "Authorization": "test_key"})
+
+        assert response.status_code == 200
+        events = self._parse_events(response.data)
+        assert [event for event, _ in events] == ['label', 'label', 'label', 'metadata']
+        assert events[3][1]['agent'] == 'static'
+
+    def test_should_send_error_event_when_response_is_invalid(self, mocker, client, lesson_11_claude_request_data, lesson_11_eval, claude_stream_events):
+        lesson_11_eval[1]["Key Concept"] = "Bogus Key Concept"
+        self._stub_stream(mocker, claude_stream_events(json.dumps(lesson_11_eval)))
+        request_data = lesson_11_claude_request_data
+        request_data['num-responses'] = '1'
+
+        os.environ['AIPROXY_API_KEY'] = 'test_key'
+        response = client.post('/assessment/stream', query_string=request_data, headers={"Content-type": "application/x-www-form-urlencoded", "Authorization": "test_key"})
+
+        assert response.status_code == 200
+        events = self._parse_events(response.data)
+        assert [event for event, _ in events] == ['label', 'error']
+        assert events[1][1]['status'] == 400
+        assert 'InvalidResponseError' in events[1][1]['error']
+
+    def test_should_return_400_when_examples_do_not_match_rubric(self, client, lesson_11_claude_request_data):
+        request_data = lesson_11_claude_request_data
+        request_data['examples'] = json.dumps([["code", "Key Concept\tLabel\nBogus\tNo Evidence"]])
+
+        os.environ['AIPROXY_API_KEY'] = 'test_key'
+        response = client.post('/assessment/stream', query_string=request_data, headers={"Content-type": "application/x-www-form-urlencoded", "Authorization": "test_key"})
+
+        assert response.status_code == 400
+
+    def test_should_return_400_when_code_is_missing(self, client, lesson_11_claude_request_data):
+        request_data = lesson_11_claude_request_data
+        del request_data['code']
+
+        os.environ['AIPROXY_API_KEY'] = 'test_key'
+        response = client.post('/assessment/stream', query_string=request_data, headers={"Content-type": "application/x-www-form-urlencoded", "Authorization": "test_key"})
+
+        assert response.status_code == 400
+
+class TestPostAssessmentBatch:
+    """ Tests POST to '/assessment/batch' to assess many submissions at once.
+    """
+
+    def test_should_return_400_when_no_codes(self, client, randomstring):
+        os.environ['AIPROXY_API_KEY'] = 'test_key'
+        response = client.post('/assessment/batch', query_string={
+            "prompt": randomstring(10),
+            "rubric": randomstring(10),
+            "model": randomstring(10),
+        }, headers={"Content-type": "application/x-www-form-urlencoded", "Authorization": "test_key"})
+        assert response.status_code == 400
+
+    def test_should_return_400_when_codes_is_not_a_list(self, client, randomstring):
+        os.environ['AIPROXY_API_KEY'] = 'test_key'
+        response = client.post('/assessment/batch', query_string={
+            "codes": json.dumps({"code": randomstring(10)}),
+            "prompt": randomstring(10),
+            "rubric": randomstring(10),
+            "model": randomstring(10),
+        }, headers={"Content-type": "application/x-www-form-urlencoded", "Authorization": "test_key"})
+        assert response.status_code == 400
+
+    def test_should_pass_submissions_to_batch_label_function(self, mocker, client, randomstring):
+        label_mock = mocker.patch('lib.assessment.assess.validate_and_label_batch', return_value=[])
+        codes = [{"student_id": "s1", "code": randomstring(10)}, randomstring(10)]
+
+        os.environ['AIPROXY_API_KEY'] = 'test_key'
+        client.post('/assessment/batch', query_string={
+            "codes": json.dumps(codes),
+            "prompt": randomstring(10),
+            "rubric": randomstring(10),
+            "model": randomstring(10),
+        }, headers={"Content-type": "application/x-www-form-urlencoded", "Authorization": "test_key"})
+
+        submissions = label_mock.call_args.args[0]
+        assert submissions == [("s1", codes[0]["code"]), ("1", codes[1])]
+
+    def test_should_report_per_student_results_and_errors(self, mocker, client, randomstring):
+        labels = {
+            'metadata': {'agent': 'anthropic'},
+            'data': [{'Key Concept': randomstring(10), 'Observations': 'foo', 'Label': 'No Evidence', 'Reason': 'bar'}]
+        }
+        mocker.patch('lib.assessment.assess.validate_and_label_batch', return_value=[
+            ("s1", labels, None),
+            ("s2", None, BedrockServerError("500")),
+        ])
+
+        os.environ['AIPROXY_API_KEY'] = 'test_key'
+        response = client.post('/assessment/batch', query_string={
+            "codes": json.dumps(["a", "b"]),
+            "prompt": randomstring(10),
+            "rubric": randomstring(10),
+            "model": randomstring(10),
+        }, headers={"Content-type": "application/x-www-form-urlencoded", "Authorization": "test_key"})
+
+        assert response.status_code == 200
+        assert response.json['metadata']['succeeded'] == 1
+        assert response.json['metadata']['failed'] == 1
+        assert response.json['data'][0] == {'student_id': 's1', 'status': 200, **labels}
+        assert response.json['data'][1]['student_id'] == 's2'
+        assert response.json['data'][1]['status'] == 503
+
+    def test_labels_every_submission_through_bedrock(self, mocker, client, lesson_11_claude_request_data, lesson_11_claude_response_body):
+        class mock_bedrock_client:
+            def invoke_model(body, modelId, accept, contentType):
+                return {'ResponseMetadata': {'HTTPStatusCode': 200}, 'body': io.StringIO(lesson_11_claude_response_body)}
+        mocker.patch.object(Label, 'get_bedrock_client', return_value=mock_bedrock_client)
+        mocker.patch.object(Label, 'get_aws_account', return_value='12345')
+
+        request_data = lesson_11_claude_request_data
+        request_data['num-responses'] = '1'
+        del request_data['code']
+        request_data['codes'] = json.dumps([{"student_id": f"s{i}", "code": f"var x = {i};"} for i in range(5)] + [""])
+
+        os.environ['AIPROXY_API_KEY'] = 'test_key'
+        response = client.post('/assessment/batch', query_string=request_data, headers={"Content-type": "application/x-www-form-urlencoded", "Authorization": "test_key"})
+
+        assert response.status_code == 200
+        results = response.json['data']
+        assert [result['student_id'] for result in results] == ['s0', 's1', 's2', 's3', 's4', '5']
+        assert all(result['status'] == 200 for result in results)
+        assert all(result['metadata']['agent'] == 'anthropic' for result in results[:5])
+        assert results[5]['metadata']['agent'] == 'static'
+
+
+class TestAssessmentJobs:
+    """ Tests POST to '/assessment/jobs' and GET of '/assessment/jobs/<id>'.
+    """
+
+    @pytest.fixture(autouse=True)
+    def job_queue(self, mocker):
+        queue = JobQueue(MemoryJobStore(), workers=2)
+        mocker.patch('src.assessment.get_job_queue', return_value=queue)
+        yield queue
+
+    def _wait_for_job(self, client, job_id):
+        for _ in range(500):
+            response = client.get(f'/assessment/jobs/{job_id}', headers={"Authorization": "test_key"})
+            if response.json['status'] in ['succeeded', 'failed']:
+                return response
+            time.sleep(0.01)
+        raise TimeoutError(job_id)
+
+    def test_should_return_400_when_no_code(self, client, randomstring):
+        os.environ['AIPROXY_API_KEY'] = 'test_key'
+        response = client.post('/assessment/jobs', query_string={
+            "prompt": randomstring(10),
+            "rubric": randomstring(10),
+        }, headers={"Content-type": "application/x-www-form-urlencoded", "Authorization": "test_key"})
+        assert response.status_code == 400
+
+    def test_should_return_400_when_passing_not_a_number_to_temperature(self, client, randomstring):
+        os.environ['AIPROXY_API_KEY'] = 'test_key'
+        response = client.post('/assessment/jobs', query_string={
+            "code": randomstring(10),
+            "prompt": randomstring(10),
+            "rubric": randomstring(10),
+            "temperature": "x",
+        }, headers={"Content-type": "application/x-www-form-urlencoded", "Authorization": "test_key"})
+        assert response.status_code == 400
+
+    def test_should_return_404_for_unknown_job(self, client):
+        os.environ['AIPROXY_API_KEY'] = 'test_key'
+        response = client.get('/assessment/jobs/unknown', headers={"Authorization": "test_key"})
+        assert response.status_code == 404
+
+    def test_should_return_401_when_polling_without_key(self, client):
+        os.environ['AIPROXY_API_KEY'] = 'test_key'
+        response = client.get('/assessment/jobs/unknown')
+        assert response.status_code == 401
+
+    def test_should_return_the_result_from_label_function_when_finished(self, mocker, client, randomstring):
+        label_mock = mocker.patch('lib.assessment.assess.validate_and_label')
+        label_mock.return_value = {
+            'metadata': {},
+            'data': [{'Key Concept': randomstring(10), 'Observations': 'foo', 'Label': 'No Evidence', 'Reason': 'bar'}]
+        }
+
+        os.environ['AIPROXY_API_KEY'] = 'test_key'
+        response = client.post('/assessment/jobs', query_string={
+            "code": randomstring(10),
+            "prompt": randomstring(10),
+            "rubric": randomstring(10),
+        }, headers={"Content-type": "application/x-www-form-urlencoded", "Authorization": "test_key"})
+
+        assert response.status_code == 202
+        job = self._wait_for_job(client, response.json['id']).json
+        assert job['status'] == 'succeeded'
+        assert job['result'] == label_mock.return_value
+
+    def test_should_record_the_error_status_when_labeling_fails(self, mocker, client, randomstring):
+        mocker.patch('lib.assessment.assess.validate_and_label').side_effect = BedrockServerError("500")
+
+        os.environ['AIPROXY_API_KEY'] = 'test_key'
+        response = client.post('/assessment/jobs', query_string={
+            "code": randomstring(10),
+            "prompt": randomstring(10),
+            "rubric": randomstring(10),
+        }, headers={"Content-type": "application/x-www-form-urlencoded", "Authorization": "test_key"})
+
+        job = self._wait_for_job(client, response.json['id']).json
+        assert job['status'] == 'failed'
+        assert job['error_status'] == 503
+
+    def test_should_return_429_when_the_queue_is_full(self, mocker, client, randomstring, job_queue):
+        job_queue.max_pending = 0
+
+        os.environ['AIPROXY_API_KEY'] = 'test_key'
+        response = client.post('/assessment/jobs', query_string={
+            "code": randomstring(10),
+            "prompt": randomstring(10),
+            "rubric": randomstring(10),
+        }, headers={"Content-type": "application/x-www-form-urlencoded", "Authorization": "test_key"})
+
+        assert response.status_code == 429
+
+
+class TestAssessmentRateLimits:
+    """ Tests GET to '/assessment/rate_limits' and the validation of LLM_RATE_LIMITS.
+    """
+
+    def test_should_return_no_limits_by_default(self, client):
+        response = client.get('/assessment/rate_limits')
+        assert response.status_code == 200
+        assert response.json == {}
+
+    def test_should_return_the_limits_of_each_model(self):
+        from src import create_app
+        os.environ['LLM_RATE_LIMITS'] = json.dumps({'gpt-4-turbo-2024-04-09': {'requests_per_minute': 500}})
+
+        response = create_app().test_client().get('/assessment/rate_limits')
+
+        assert response.json == {
+            'gpt-4-turbo-2024-04-09': {'requests_per_minute': 500, 'tokens_per_minute': None, 'max_concurrent': None, 'active': 0, 'queued': 0},
+        }
+
+    def test_should_not_start_with_unknown_limits(self):
+        from src import create_app
+        os.environ['LLM_RATE_LIMITS'] = json.dumps({'gpt-4-turbo-2024-04-09': {'request_per_minute': 500}})
+
+        with pytest.raises(ValueError, match='request_per_minute'):
+            create_app()
+
+
 class TestPostTestAssessment:
     """ Tests POST to '/test/assessment' to start an assessment.
     """
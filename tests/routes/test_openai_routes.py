@@ -32,6 +32,24 @@ class TestGetOpenAiModels:
         assert openai.api_key == openai_api_key
 
 
+class TestGetOpenAiPool:
+    """ Tests GET to '/openai/pool' to report the connections used for assessments.
+    """
+
+    def test_should_return_the_pool_stats(self, client):
+        response = client.get('/openai/pool')
+        assert response.status_code == 200
+        assert response.json == {'pool_size': 8, 'connections': 0, 'requests': 0, 'idle': 0}
+
+    def test_should_count_connections_once_the_pool_exists(self, client):
+        from lib.assessment.label import Label
+        pool = Label.get_openai_session().adapters['https://'].poolmanager.connection_from_url('https://api.openai.com')
+        # Takes a connection out of the pool and returns it, as a finished request does
+        pool._put_conn(pool._get_conn())
+
+        response = client.get('/openai/pool')
+        assert response.json == {'pool_size': 8, 'connections': 1, 'requests': 0, 'idle': 1}
+
 class TestPostOpenAi:
     def test_should_set_the_openai_api_key_to_the_environment_var(self, mocker, client, randomstring):
         # Set the key into the environment
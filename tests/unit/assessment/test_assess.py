@@ -1,6 +1,7 @@
 import pytest
 
-from lib.assessment.assess import get_example_key_concepts
+from lib.assessment.assess import get_example_key_concepts, validate_and_label_batch, KeyConceptError
+from lib.assessment.label import Label, BedrockServerError
 
 def test_get_example_key_concepts_from_tsv():
     """ Tests lib.assessment.assess.get_example_key_concepts()
@@ -33,3 +34,44 @@ def test_get_example_key_concepts_from_json():
     actual_concepts = get_example_key_concepts(example_tsv, 'json')
 
     assert set(expected_concepts) == set(actual_concepts)
+
+def test_validate_and_label_batch_labels_each_submission(mocker, prompt, rubric):
+    """ Tests lib.assessment.assess.validate_and_label_batch()
+    """
+
+    label_mock = mocker.patch.object(Label, 'label_student_work', side_effect=lambda *args, **kwargs: {'metadata': {}, 'data': [args[2]]})
+    submissions = [(f"s{i}", f"code {i}") for i in range(10)]
+
+    results = validate_and_label_batch(submissions, prompt, rubric, llm_model='bedrock.anthropic.claude-v2', max_workers=3)
+
+    assert label_mock.call_count == len(submissions)
+    assert [student_id for student_id, _, _ in results] == [student_id for student_id, _ in submissions]
+    assert all(labels['data'] == [code] and error is None for (_, labels, error), (_, code) in zip(results, submissions))
+
+def test_validate_and_label_batch_reports_errors_per_submission(mocker, prompt, rubric):
+    """ Tests lib.assessment.assess.validate_and_label_batch()
+    """
+
+    def label_student_work(prompt, rubric, code, student_id, **kwargs):
+        if student_id == 'bad':
+            raise BedrockServerError("500")
+        return {'metadata': {}, 'data': []}
+    mocker.patch.object(Label, 'label_student_work', side_effect=label_student_work)
+
+    results = validate_and_label_batch([('good', 'x'), ('bad', 'y')], prompt, rubric, llm_model='bedrock.anthropic.claude-v2')
+
+    assert results[0][2] is None
+    assert results[1][1] is None
+    assert isinstance(results[1][2], BedrockServerError)
+
+def test_validate_and_label_batch_validates_examples_once(mocker, prompt, rubric):
+    """ Tests lib.assessment.assess.validate_and_label_batch()
+    """
+
+    label_mock = mocker.patch.object(Label, 'label_student_work')
+    examples = [['code', 'Key Concept\tObservations\tGrade\tReason\nBogus\tfoo\tNo Evidence\tbar']]
+
+    with pytest.raises(KeyConceptError):
+        validate_and_label_batch([('s1', 'x'), ('s2', 'y')], prompt, rubric, examples=examples, llm_model='bedrock.anthropic.claude-v2')
+
+    label_mock.assert_not_called()
@@ -0,0 +1,32 @@
+import asyncio
+import threading
+
+from lib.assessment.async_clients import get_openai_session, close_openai_session, run_blocking
+
+
+class TestOpenaiSession:
+    def test_should_reuse_the_session_of_the_event_loop(self):
+        async def sessions():
+            first, second = get_openai_session(), get_openai_session()
+            await close_openai_session()
+            return first, second
+
+        first, second = asyncio.run(sessions())
+
+        assert first is second
+        assert first.closed
+
+    def test_should_give_each_event_loop_its_own_session(self):
+        async def session():
+            session = get_openai_session()
+            await close_openai_session()
+            return session
+
+        assert asyncio.run(session()) is not asyncio.run(session())
+
+class TestRunBlocking:
+    def test_should_run_on_another_thread(self):
+        result = asyncio.run(run_blocking(lambda a, b=0: (threading.current_thread(), a + b), 1, b=2))
+
+        assert result[0] is not threading.main_thread()
+        assert result[1] == 3
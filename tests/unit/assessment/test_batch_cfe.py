@@ -0,0 +1,75 @@
+import csv
+import glob
+import io
+
+import numpy as np
+import pytest
+
+from lib.assessment.batch_cfe import batch_cfe_label_student_work, feature_matrix, tree_labels
+from lib.assessment.decision_trees import compile_tree
+from lib.assessment.label import Label
+from lib.assessment.config import LESSONS, VALID_LABELS
+
+def lesson_rubric(key_concepts):
+    """ Creates a rubric for the given Key Concepts with a distinct reason for each label.
+    """
+    rubric = io.StringIO()
+    writer = csv.DictWriter(rubric, fieldnames=['Key Concept'] + VALID_LABELS)
+    writer.writeheader()
+    for key_concept in key_concepts:
+        writer.writerow({'Key Concept': key_concept, **{label: f"{key_concept}: {label}" for label in VALID_LABELS}})
+    return rubric.getvalue()
+
+
+class TestFeatureMatrix:
+    def test_should_count_named_feature_values(self):
+        features = {'object_types': {'shapes': 1, 'sprites': 2, 'text': 0},
+                    'objects': [],
+                    'property_change': [],
+                    'conditionals': [{'draw_loop': True, 'trigger': 'user'}, {'draw_loop': False, 'trigger': 'user'}]}
+
+        matrix = feature_matrix([features], ['sprites', 'total_elements', 'user_triggered_conditionals'])
+
+        assert matrix.tolist() == [[2, 3, 1]]
+
+
+class TestTreeLabels:
+    def test_should_label_every_row(self):
+        tree = compile_tree({'labels': [{'label': 'Extensive Evidence', 'when': {'sprites': {'>=': 2}, 'movement': {'>': 0}}},
+                                        {'label': 'Limited Evidence', 'when': {'sprites': {'>=': 1}}}],
+                             'default': 'No Evidence'})
+        matrix = np.array([[2, 1], [2, 0], [0, 3]])
+
+        assert tree_labels(tree, matrix, {'sprites': 0, 'movement': 1}) == ['Extensive Evidence', 'Limited Evidence', 'No Evidence']
+
+    def test_should_use_default_without_thresholds(self):
+        tree = compile_tree({'labels': [], 'default': 'Limited Evidence'})
+
+        assert tree_labels(tree, np.zeros((2, 0)), {}) == ['Limited Evidence', 'Limited Evidence']
+
+
+class TestBatchCfeLabelStudentWork:
+    @pytest.mark.parametrize("lesson", LESSONS)
+    def test_should_match_labeling_each_student(self, lesson):
+        key_concepts = {
+            'csd3-2023-L7': ['Position - Shapes'],
+            'csd3-2023-L11': ['Position - Elements and the Coordinate System'],
+            'csd3-2023-L14': ['Modularity - Sprites and Sprite Properties', 'Position and Movement'],
+            'csd3-2023-L18': ['Algorithms and Control - Conditionals', 'Modularity - Multiple Sprites', 'Position and Movement'],
+            'csd3-2023-L21': ['Modularity - Multiple Sprites'],
+            'csd3-2023-L24': ['Modularity - Multiple Sprites'],
+            'csd3-2023-L28': ['Modularity - Use of Functions', 'Program Development'],
+        }[lesson]
+        rubric = lesson_rubric(key_concepts)
+        submissions = []
+        for path in sorted(glob.glob('tests/data/*.js')):
+            with open(path, 'r') as f:
+                submissions.append((path, f.read()))
+
+        results = batch_cfe_label_student_work(submissions, rubric, key_concepts, lesson)
+
+        assert [student_id for student_id, labels in results] == [student_id for student_id, code in submissions]
+        for (student_id, code), (_, labels) in zip(submissions, results):
+            expected = Label().cfe_label_student_work(rubric, code, key_concepts, lesson)
+            assert labels['metadata']['agent'] == 'code feature extractor'
+            assert [{**row, 'Evidence': []} for row in expected['data']] == labels['data']
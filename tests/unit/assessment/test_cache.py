@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+from lib.assessment.cache import LRUCache, SqliteCache
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_cache(request, tmp_path):
+    """ Returns a function that creates each kind of cache.
+    """
+    def gen_cache(max_size=10, ttl=None):
+        if request.param == 'memory':
+            return LRUCache(max_size, ttl=ttl)
+        return SqliteCache(str(tmp_path / 'cache.sqlite'), max_size, ttl=ttl)
+
+    yield gen_cache
+
+
+class TestCache:
+    def test_should_return_stored_values(self, make_cache):
+        cache = make_cache()
+        cache.set('a', {'data': [1, 2]})
+
+        assert cache.get('a') == {'data': [1, 2]}
+        assert cache.get('b') is None
+        assert cache.stats() == {'hits': 1, 'misses': 1, 'size': 1}
+
+    def test_should_not_share_returned_values(self, make_cache):
+        cache = make_cache()
+        value = {'data': [1]}
+        cache.set('a', value)
+        value['data'].append(2)
+        cache.get('a')['data'].append(3)
+
+        assert cache.get('a') == {'data': [1]}
+
+    def test_should_evict_the_least_recently_used_entry(self, make_cache):
+        cache = make_cache(max_size=2)
+        cache.set('a', 1)
+        time.sleep(0.01)
+        cache.set('b', 2)
+        time.sleep(0.01)
+        cache.get('a')
+        time.sleep(0.01)
+        cache.set('c', 3)
+
+        assert cache.get('a') == 1
+        assert cache.get('b') is None
+        assert cache.get('c') == 3
+
+    def test_should_expire_entries_after_ttl(self, make_cache):
+        cache = make_cache(ttl=0.05)
+        cache.set('a', 1)
+        assert cache.get('a') == 1
+
+        time.sleep(0.1)
+        assert cache.get('a') is None
+
+    def test_should_clear_entries_and_stats(self, make_cache):
+        cache = make_cache()
+        cache.set('a', 1)
+        cache.get('a')
+        cache.clear()
+
+        assert cache.stats() == {'hits': 0, 'misses': 0, 'size': 0}
@@ -0,0 +1,65 @@
+import pytest
+
+from concurrent.futures.process import BrokenProcessPool
+
+from lib.assessment import cfe_pool
+from lib.assessment.cfe_pool import extract_features, get_cfe_pool, pooled_extract_features, pooled_extract_features_many
+
+@pytest.fixture(autouse=True)
+def reset_cfe_pool():
+    """ Shuts down any pool a test created so each test starts without one.
+    """
+    yield
+    if cfe_pool._pool is not None:
+        cfe_pool._pool.shutdown()
+        cfe_pool._pool = None
+
+@pytest.fixture
+def programs():
+    """ Student programs read from the test data directory.
+    """
+    programs = []
+    for name in ['cfe_code.js', 'u3l13_01.js', 'u3l23_01.js']:
+        with open(f"tests/data/{name}", 'r') as f:
+            programs.append(f.read())
+    yield programs
+
+
+class TestGetCfePool:
+    def test_should_not_create_a_pool_without_workers(self, monkeypatch):
+        monkeypatch.delenv('CFE_WORKERS', raising=False)
+
+        assert get_cfe_pool() is None
+
+    def test_should_create_one_pool(self, monkeypatch):
+        monkeypatch.setenv('CFE_WORKERS', '1')
+
+        assert get_cfe_pool() is get_cfe_pool()
+
+
+class TestPooledExtractFeatures:
+    def test_should_extract_in_thread_without_workers(self, monkeypatch, programs):
+        monkeypatch.delenv('CFE_WORKERS', raising=False)
+
+        assert pooled_extract_features(programs[0]) == extract_features(programs[0])
+
+    def test_should_extract_in_worker_processes(self, monkeypatch, programs):
+        monkeypatch.setenv('CFE_WORKERS', '2')
+
+        assert pooled_extract_features(programs[2]) == extract_features(programs[2])
+        assert pooled_extract_features_many(programs) == [extract_features(program) for program in programs]
+
+    def test_should_fall_back_to_thread_when_pool_breaks(self, monkeypatch, mocker, programs):
+        monkeypatch.setenv('CFE_WORKERS', '2')
+        pool = mocker.MagicMock()
+        pool.submit.return_value.result.side_effect = BrokenProcessPool("worker died")
+        pool.map.side_effect = BrokenProcessPool("worker died")
+
+        cfe_pool._pool = pool
+        assert pooled_extract_features(programs[0]) == extract_features(programs[0])
+        assert cfe_pool._pool is None
+
+        cfe_pool._pool = pool
+        assert pooled_extract_features_many(programs) == [extract_features(program) for program in programs]
+        assert cfe_pool._pool is None
+        pool.shutdown.assert_called_with(wait=False)
@@ -390,3 +390,84 @@ x = -1
     result2 = code_features.variable_assignment_helper(parsed.body[2])
     assert result == {'assignee': 'x', 'value': {'function': 'test_func', 'args': [1], 'user_interaction': False, 'start': 2, 'end': 2}, 'start': 2, 'end': 2}
     assert result2 == {'assignee': 'x', 'value': -1.0, 'start': 3, 'end': 3}
+
+  def test_statement_helper(self, code_features):
+    statement = """x = 1
+test_func(x)
+"""
+    parsed = esprima.parseScript(statement, {'tolerant': True, 'comment': True, 'loc': True})
+    result = code_features.statement_helper(parsed.body[1])
+    assert result == [{'function': 'test_func', 'args': ['x'], 'user_interaction': False, 'start': 2, 'end': 2}]
+    assert code_features.statement_helper(parsed.body[1]) is result
+
+  def test_flatten_conditional_paths_keeps_conditional(self, code_features):
+    statement = """if(x) {
+  x = 1
+} else {
+  x = 2
+}"""
+    parsed = esprima.parseScript(statement, {'tolerant': True, 'comment': True, 'loc': True})
+    conditional = code_features.if_statement_helper(parsed.body[0])
+    code_features.flatten_conditional_paths(conditional)
+    assert conditional['consequent'] == [{'assignee': 'x', 'value': 1, 'start': 2, 'end': 2}]
+
+  def test_conditional_statements_deeply_nested(self, code_features):
+    conditional = {'test': {}, 'consequent': [{'line': 0}]}
+    for line in range(1, 2000):
+      conditional = {'test': {}, 'consequent': [{'line': line}], 'alternate': [conditional]}
+    result = list(code_features.conditional_statements(conditional))
+    assert result == [{'line': line} for line in reversed(range(2000))]
+
+  def test_extract_features_summarizes_each_statement_once(self, code_features, mocker):
+    statement = """var sprite = createSprite(200, 200);
+function draw() {
+  if (sprite.x > 400) {
+    if (keyDown("up")) {
+      sprite.y++;
+    }
+  }
+  sprite.x = sprite.x + 1;
+}"""
+    update_expression_helper = mocker.spy(code_features, 'update_expression_helper')
+    variable_assignment_helper = mocker.spy(code_features, 'variable_assignment_helper')
+    code_features.extract_features(statement)
+    assert update_expression_helper.call_count == 1
+    assert variable_assignment_helper.call_count == 1
+    assert code_features.features['movement']['counter']['count'] == 2
+    assert code_features.summaries == {}
+
+  def test_extract_features_indexes(self, code_features):
+    statement = """var sprite = createSprite(200, 200);
+var score = 0;
+var sprite = 1;
+helper();
+function helper() {
+  score = score + 1;
+}
+helper();
+sprite.setAnimation("alien");
+"""
+    code_features.extract_features(statement)
+    assert code_features.objects_by_identifier == {'sprite': code_features.features['objects'][0]}
+    assert code_features.variable_identifiers == {'score'}
+    assert code_features.function_call_counts == {'helper': 2}
+    assert code_features.user_functions_by_name['helper'] is code_features.features['user_functions'][0]
+    assert code_features.features['user_functions'][0]['calls'] == 2
+
+  def test_extract_features_keeps_line_numbers_after_syntax_errors(self, code_features):
+    statement = """var muadib = createSprite(50, 100);
+var planet = ;
+var fremen = createSprite(0, 275);
+}
+var shai_hulud = createSprite(100, 275);
+"""
+    code_features.extract_features(statement)
+    assert [(obj['identifier'], obj['start']) for obj in code_features.features['objects']] == [('muadib', 1), ('fremen', 3), ('shai_hulud', 5)]
+    assert [(region['start'], region['end']) for region in code_features.skipped_regions] == [(2, 2), (4, 4)]
+
+  def test_extract_features_stops_after_max_parse_recoveries(self, code_features, mocker):
+    mocker.patch('lib.assessment.code_feature_extractor.max_parse_recoveries', 2)
+    statement = "\n".join(["}", "}", "}", "}", "var muadib = createSprite(50, 100);"])
+    code_features.extract_features(statement)
+    assert code_features.features['objects'] == []
+    assert [(region['start'], region['end']) for region in code_features.skipped_regions] == [(1, 1), (2, 2), (3, 5)]
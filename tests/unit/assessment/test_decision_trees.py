@@ -1,6 +1,7 @@
 import pytest
-from lib.assessment.decision_trees import DecisionTrees
+from lib.assessment.decision_trees import DecisionTrees, FeatureIndex, DecisionTreeRuleError, compile_tree, get_lesson_trees
 import esprima
+import json
 
 @pytest.fixture
 def decision_trees():
@@ -1295,3 +1296,61 @@ class TestDecisionTrees:
     assert decision_trees.evidence == ['Line 10: Code contains 1 instance of movement using the randomNumber() function', 
                                        'Line 10: Code contains 2 instances of movement using the counter pattern', 
                                        'Line 11: Code contains 2 instances of movement using the counter pattern']
+
+  def test_feature_index(self):
+    features = {'objects': [{'identifier': 'muadib', 'type': 'sprite', 'start': 1, 'end': 1},
+                            {'identifier': 'dune', 'type': 'shape', 'start': 2, 'end': 2}],
+                'property_change': [{'object': 'muadib', 'method': 'setAnimation', 'start': 3, 'end': 3, 'draw_loop': False},
+                                    {'object': 'dune', 'property': 'velocityX', 'start': 4, 'end': 4, 'draw_loop': False},
+                                    {'object': 'muadib', 'property': 'velocityX', 'start': 5, 'end': 5, 'draw_loop': False},
+                                    {'object': 'muadib', 'property': 'x', 'start': 6, 'end': 6, 'draw_loop': True}]}
+    index = FeatureIndex(features)
+    assert index.sprites == {'muadib'}
+    assert index.sprites_updated_in_draw == {'muadib'}
+    assert [prop['start'] for prop in index.sprite_property_changes[False]] == [3, 5]
+    assert [prop['start'] for prop in index.sprite_animations] == [3]
+    assert [prop['start'] for prop in index.sprite_velocities] == [5]
+
+  def test_assess_uses_given_feature_index(self, decision_trees, mocker):
+    learning_goal = {"Key Concept": "Modularity - Multiple Sprites"}
+    features = {'object_types': {'shapes': 0, 'sprites': 1, 'text': 0},
+                'objects': [{'identifier': 'muadib', 'type': 'sprite', 'start': 1, 'end': 1}],
+                'property_change': [{'object': 'muadib', 'property': 'x', 'start': 2, 'end': 2, 'draw_loop': True}]}
+    index = FeatureIndex(features)
+    feature_index = mocker.patch('lib.assessment.decision_trees.FeatureIndex')
+    decision_trees.assess(features, learning_goal, "csd3-2023-L18", index=index)
+    assert decision_trees.assessment == 'Convincing Evidence'
+    assert feature_index.call_count == 0
+
+  def test_get_lesson_trees_compiles_each_lesson_once(self):
+    trees = get_lesson_trees('csd3-2023-L18')
+    assert set(trees.keys()) == {'Algorithms and Control - Conditionals', 'Modularity - Multiple Sprites', 'Position and Movement'}
+    assert get_lesson_trees('csd3-2023-L18') is trees
+    assert get_lesson_trees('csd3-2099-L1') == {}
+
+  def test_assess_with_rules_from_file(self, decision_trees, tmp_path, monkeypatch):
+    rules_path = tmp_path / 'rules.json'
+    rules_path.write_text(json.dumps({'csd3-2099-L1': {'Sprites': {
+      'evidence': [{'function': 'sprites_evidence', 'args': ['data', 'sprites']}],
+      'labels': [{'label': 'Extensive Evidence', 'when': {'sprites': {'>=': 2}}}],
+      'default': 'No Evidence'}}}))
+    monkeypatch.setenv('DECISION_TREE_RULES_PATH', str(rules_path))
+    features = {'object_types': {'shapes': 0, 'sprites': 2, 'text': 0},
+                'objects': [{'identifier': 'muadib', 'type': 'sprite', 'start': 1, 'end': 1},
+                            {'identifier': 'fremen', 'type': 'sprite', 'start': 2, 'end': 2}],
+                'property_change': []}
+    decision_trees.assess(features, {'Key Concept': 'Sprites'}, 'csd3-2099-L1')
+    assert decision_trees.assessment == 'Extensive Evidence'
+    assert decision_trees.evidence == ['Line 1: Code contains 2 sprites', 'Line 2: Code contains 2 sprites']
+
+  def test_compile_tree_rejects_invalid_rules(self):
+    rule = {'evidence': [], 'labels': [{'label': 'Extensive Evidence', 'when': {'sprites': {'>=': 1}}}], 'default': 'No Evidence'}
+    compile_tree(rule)
+    with pytest.raises(DecisionTreeRuleError):
+      compile_tree({**rule, 'labels': [{'label': 'Extensive Evidence', 'when': {'spice': {'>=': 1}}}]})
+    with pytest.raises(DecisionTreeRuleError):
+      compile_tree({**rule, 'labels': [{'label': 'Extensive Evidence', 'when': {'sprites': {'~': 1}}}]})
+    with pytest.raises(DecisionTreeRuleError):
+      compile_tree({**rule, 'default': 'Some Evidence'})
+    with pytest.raises(DecisionTreeRuleError):
+      compile_tree({**rule, 'evidence': [{'function': 'assess', 'args': []}]})
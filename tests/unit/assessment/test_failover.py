@@ -0,0 +1,177 @@
+import time
+import asyncio
+import concurrent.futures
+
+import pytest
+
+from lib.assessment.failover import LatencyTracker, call_with_failover, call_with_failover_async
+
+
+class ServerError(Exception):
+    pass
+
+class InvalidError(Exception):
+    pass
+
+@pytest.fixture
+def latencies():
+    yield LatencyTracker(10)
+
+@pytest.fixture
+def executor():
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+    yield executor
+    executor.shutdown(wait=False)
+
+class TestLatencyTracker:
+    def test_should_report_percentiles_of_recent_latencies(self, latencies):
+        for seconds in range(1, 21):
+            latencies.record('model', seconds)
+
+        assert latencies.percentile('model', 0) == 11
+        assert latencies.percentile('model', 50) == 16
+        assert latencies.percentile('model', 100) == 20
+
+    def test_should_wait_for_enough_samples(self, latencies):
+        latencies.record('model', 1)
+
+        assert latencies.percentile('model', 95, min_samples=2) is None
+        assert latencies.percentile('other', 95) is None
+
+class TestCallWithFailover:
+    def test_should_use_the_first_model_that_succeeds(self, latencies):
+        def call(model):
+            if model == 'a':
+                raise ServerError('down')
+            return None if model == 'b' else {'data': model}
+
+        result, failover = call_with_failover(['a', 'b', 'c', 'd'], call, (ServerError,), latencies)
+
+        assert result == {'data': 'c'}
+        assert failover == {
+            'model': 'c',
+            'attempts': [{'model': 'a', 'error': 'ServerError: down'}, {'model': 'b', 'error': 'no result'}, {'model': 'c'}],
+            'hedged': False,
+        }
+        assert latencies.percentile('c', 50) is not None
+
+    def test_should_raise_other_errors(self, latencies):
+        def call(model):
+            raise ValueError(model)
+
+        with pytest.raises(ValueError):
+            call_with_failover(['a', 'b'], call, (ServerError,), latencies)
+
+    def test_should_raise_the_last_error_when_every_model_fails(self, latencies):
+        def call(model):
+            raise ServerError(model)
+
+        with pytest.raises(ServerError, match='b'):
+            call_with_failover(['a', 'b'], call, (ServerError,), latencies)
+
+    def test_should_hedge_slow_requests(self, latencies, executor):
+        def call(model):
+            if model == 'slow':
+                time.sleep(1)
+            return {'data': model}
+
+        start = time.time()
+        result, failover = call_with_failover(['slow', 'fast'], call, (ServerError,), latencies, hedge_after=lambda model: 0.05, executor=executor)
+
+        assert result == {'data': 'fast'}
+        assert failover['hedged'] == True
+        assert failover['model'] == 'fast'
+        assert time.time() - start < 1
+
+    def test_should_not_hedge_fast_requests(self, latencies, executor):
+        calls = []
+        def call(model):
+            calls.append(model)
+            return {'data': model}
+
+        result, failover = call_with_failover(['a', 'b'], call, (ServerError,), latencies, hedge_after=lambda model: 1, executor=executor)
+
+        assert result == {'data': 'a'}
+        assert failover['hedged'] == False
+        assert calls == ['a']
+
+    def test_should_wait_for_the_hedged_request_when_the_first_is_invalid(self, latencies, executor):
+        def call(model):
+            if model == 'invalid':
+                time.sleep(0.2)
+                raise InvalidError(model)
+            time.sleep(0.3)
+            return {'data': model}
+
+        result, failover = call_with_failover(['invalid', 'valid'], call, (ServerError,), latencies, hedge_after=lambda model: 0.05, executor=executor)
+
+        assert result == {'data': 'valid'}
+        assert failover['attempts'] == [{'model': 'invalid', 'error': 'InvalidError: invalid'}, {'model': 'valid'}]
+
+    def test_should_raise_other_errors_when_nothing_is_in_flight(self, latencies, executor):
+        def call(model):
+            raise InvalidError(model)
+
+        with pytest.raises(InvalidError):
+            call_with_failover(['a', 'b'], call, (ServerError,), latencies, hedge_after=lambda model: 1, executor=executor)
+
+    def test_should_not_fail_over_after_other_errors(self, latencies, executor):
+        calls = []
+        def call(model):
+            calls.append(model)
+            if model == 'a':
+                time.sleep(0.3)
+                raise ServerError(model)
+            raise InvalidError(model)
+
+        with pytest.raises(InvalidError, match='b'):
+            call_with_failover(['a', 'b', 'c'], call, (ServerError,), latencies, hedge_after=lambda model: 0.05, executor=executor)
+        assert calls == ['a', 'b']
+
+class TestCallWithFailoverAsync:
+    def test_should_fail_over_and_hedge(self, latencies):
+        cancelled = []
+        async def call(model):
+            if model == 'down':
+                raise ServerError(model)
+            try:
+                await asyncio.sleep(1 if model == 'slow' else 0)
+            except asyncio.CancelledError:
+                cancelled.append(model)
+                raise
+            return {'data': model}
+
+        start = time.time()
+        result, failover = asyncio.run(call_with_failover_async(['down', 'slow', 'fast'], call, (ServerError,), latencies, hedge_after=lambda model: 0.05))
+
+        assert result == {'data': 'fast'}
+        assert [attempt['model'] for attempt in failover['attempts']] == ['down', 'slow', 'fast']
+        assert failover['hedged'] == True
+        assert cancelled == ['slow']
+        assert time.time() - start < 1
+
+    def test_should_wait_for_the_hedged_request_when_the_first_is_invalid(self, latencies):
+        async def call(model):
+            if model == 'invalid':
+                await asyncio.sleep(0.2)
+                raise InvalidError(model)
+            await asyncio.sleep(0.3)
+            return {'data': model}
+
+        result, failover = asyncio.run(call_with_failover_async(['invalid', 'valid'], call, (ServerError,), latencies, hedge_after=lambda model: 0.05))
+
+        assert result == {'data': 'valid'}
+        assert failover['attempts'][0] == {'model': 'invalid', 'error': 'InvalidError: invalid'}
+
+    def test_should_not_fail_over_after_other_errors(self, latencies):
+        calls = []
+        async def call(model):
+            calls.append(model)
+            if model == 'a':
+                await asyncio.sleep(0.3)
+                raise ServerError(model)
+            raise InvalidError(model)
+
+        with pytest.raises(InvalidError, match='b'):
+            asyncio.run(call_with_failover_async(['a', 'b', 'c'], call, (ServerError,), latencies, hedge_after=lambda model: 0.05))
+        assert calls == ['a', 'b']
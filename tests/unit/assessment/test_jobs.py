@@ -0,0 +1,94 @@
+import time
+
+import pytest
+
+from lib.assessment.jobs import JobQueue, MemoryJobStore, SqliteJobStore, JobQueueFullError, QUEUED, RUNNING, SUCCEEDED, FAILED
+
+
+def wait_for(queue, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job['status'] in [SUCCEEDED, FAILED]:
+            return job
+        time.sleep(0.01)
+    raise TimeoutError(f"job {job_id} did not finish")
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    """ Creates each kind of job store.
+    """
+    if request.param == 'memory':
+        yield MemoryJobStore()
+    else:
+        yield SqliteJobStore(str(tmp_path / 'jobs.sqlite'))
+
+
+class TestJobQueue:
+    def test_should_record_the_result_of_a_successful_job(self, store):
+        queue = JobQueue(store, workers=2)
+
+        job_id = queue.submit(lambda x: {'data': [x]}, x=42)
+        job = wait_for(queue, job_id)
+
+        assert job['status'] == SUCCEEDED
+        assert job['result'] == {'data': [42]}
+        assert job['finished'] >= job['started'] >= job['created']
+
+    def test_should_record_formatted_errors(self, store):
+        queue = JobQueue(store, workers=2)
+
+        def fail():
+            raise ValueError("bad")
+
+        job_id = queue.submit(fail, format_error=lambda e: (f"formatted {e}", 418))
+        job = wait_for(queue, job_id)
+
+        assert job['status'] == FAILED
+        assert job['error'] == "formatted bad"
+        assert job['error_status'] == 418
+        assert job['result'] is None
+
+    def test_should_default_to_500_for_unformatted_errors(self, store):
+        queue = JobQueue(store, workers=2)
+
+        def fail():
+            raise ValueError("bad")
+
+        job = wait_for(queue, queue.submit(fail, format_error=lambda e: None))
+
+        assert job['error'] == "ValueError: bad"
+        assert job['error_status'] == 500
+
+    def test_should_return_none_for_unknown_jobs(self, store):
+        queue = JobQueue(store, workers=1)
+
+        assert queue.get('unknown') is None
+
+    def test_should_reject_jobs_when_too_many_are_pending(self, store):
+        queue = JobQueue(store, workers=1, max_pending=1)
+
+        queue.submit(lambda: time.sleep(0.2))
+        with pytest.raises(JobQueueFullError):
+            queue.submit(lambda: time.sleep(0.2))
+
+    def test_should_purge_expired_results(self, store):
+        queue = JobQueue(store, workers=1, result_ttl=0)
+
+        job_id = queue.submit(lambda: {})
+        wait_for(queue, job_id)
+        queue.submit(lambda: {})
+
+        assert queue.get(job_id) is None
+
+
+class TestSqliteJobStore:
+    def test_should_fail_interrupted_jobs_on_restart(self, tmp_path):
+        path = str(tmp_path / 'jobs.sqlite')
+        SqliteJobStore(path).create({'id': 'abc', 'status': RUNNING, 'created': time.time()})
+
+        job = SqliteJobStore(path).get('abc')
+
+        assert job['status'] == FAILED
+        assert job['error_status'] == 503
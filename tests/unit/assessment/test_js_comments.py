@@ -0,0 +1,36 @@
+from lib.assessment.js_comments import strip_js_comments
+
+
+class TestStripJsComments:
+    def test_should_remove_line_and_block_comments(self):
+        code = "var x = 1; // one\n/* two\n   three */ var y = 2;\n"
+
+        assert strip_js_comments(code) == "var x = 1; \n var y = 2;\n"
+        assert strip_js_comments(code, preserve_lines=True) == "var x = 1; \n\n var y = 2;\n"
+
+    def test_should_keep_strings(self):
+        code = """var a = ""; var b = "say \\"// hi\\""; var c = 'it\\'s /* here */'; // done"""
+
+        assert strip_js_comments(code) == """var a = ""; var b = "say \\"// hi\\""; var c = 'it\\'s /* here */'; """
+
+    def test_should_keep_template_literals(self):
+        code = "var a = `don't // ${b /* c */ + `x${ {k: 1}.k }//`} /* d */`; // e"
+
+        assert strip_js_comments(code) == "var a = `don't // ${b  + `x${ {k: 1}.k }//`} /* d */`; "
+
+    def test_should_keep_regular_expressions(self):
+        code = 'var r = /a\\/\\/b[/"]*/g; // c\nif (x) return /\'/.test(y); // d'
+
+        assert strip_js_comments(code) == 'var r = /a\\/\\/b[/"]*/g; \nif (x) return /\'/.test(y); '
+
+    def test_should_tell_divisions_from_regular_expressions(self):
+        assert strip_js_comments("x = a / b; // c") == "x = a / b; "
+        assert strip_js_comments("x = (a) / 2 / 3 // c") == "x = (a) / 2 / 3 "
+        assert strip_js_comments("x = y++ / 2 // c") == "x = y++ / 2 "
+
+    def test_should_remove_unterminated_block_comments(self):
+        assert strip_js_comments("var x = 1; /* never\nclosed") == "var x = 1; "
+        assert strip_js_comments("var x = 1; /* never\nclosed", preserve_lines=True) == "var x = 1; \n"
+
+    def test_should_end_unterminated_strings_at_the_line_break(self):
+        assert strip_js_comments('var x = "never closed\n// comment\nvar y = "";') == 'var x = "never closed\n\nvar y = "";'
@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+from lib.assessment.json_stream import JsonArrayStream, JsonStreamError
+
+
+class TestJsonArrayStream:
+    def test_should_return_elements_as_they_complete(self):
+        stream = JsonArrayStream()
+
+        assert stream.feed('Here is my answer: [{"a": 1},') == ['{"a": 1}']
+        assert stream.feed(' {"b": ') == []
+        assert stream.feed('[2, 3]}') == ['{"b": [2, 3]}']
+        assert stream.finished == False
+        assert stream.feed(']') == []
+        assert stream.finished == True
+
+    @pytest.mark.parametrize("chunk_size", [1, 2, 5, 1000])
+    def test_should_split_any_chunking_the_same_way(self, chunk_size):
+        rows = [
+            {"Key Concept": "Brackets [in] {strings}", "Reason": "an \"escaped\" quote \\"},
+            {"Key Concept": "Nested", "Evidence": [{"Line": 1}, {"Line": 2}]},
+        ]
+        text = "```json\n" + json.dumps(rows, indent=2) + "\n```\nSome trailing text ]"
+
+        stream = JsonArrayStream()
+        elements = []
+        for i in range(0, len(text), chunk_size):
+            elements += stream.feed(text[i:i + chunk_size])
+
+        assert [json.loads(element) for element in elements] == rows
+        assert stream.finished == True
+
+    def test_should_fail_on_values_that_are_not_objects(self):
+        stream = JsonArrayStream()
+
+        with pytest.raises(JsonStreamError):
+            stream.feed('[{"a": 1}, "b"]')
+
+    def test_should_not_finish_a_truncated_array(self):
+        stream = JsonArrayStream()
+
+        assert stream.feed('[{"a": 1}, {"b": "trunc') == ['{"a": 1}']
+        assert stream.finished == False
@@ -4,6 +4,9 @@ import csv
 import json
 import logging
 import random
+import threading
+import time
+import asyncio
 
 from io import StringIO
 
@@ -11,6 +14,8 @@ import requests
 import pytest
 
 from lib.assessment.label import Label, InvalidResponseError, RequestTooLargeError, OpenaiServerError, BedrockServerError
+from lib.assessment.providers import BedrockAnthropicProvider, BedrockMetaProvider, get_provider
+from lib.assessment.cfe_pool import pooled_extract_features
 
 
 @pytest.fixture
@@ -58,6 +63,75 @@ class TestRemoveJsComments:
     }
     """
 
+    def test_remove_js_comments_preserving_lines(self, label):
+        result = label.remove_js_comments("""var x = 1; // one
+/* two
+   three */ var y = 2;
+""", preserve_lines=True)
+
+        assert result == "var x = 1; \n\n var y = 2;\n"
+
+class TestLlmRubricAndExamples:
+    def test_should_remove_cfe_key_concepts_from_rubric_and_examples(self, label):
+        rubric = 'Key Concept,No Evidence\nSprites,"No sprites, at all"\nText,No text\n'
+        examples = [['var x;', 'Key Concept\tLabel\nSprites\tNo Evidence\nText\tNo Evidence\n']]
+
+        llm_rubric, llm_examples = label.llm_rubric_and_examples(rubric, examples, ['Sprites'])
+
+        assert llm_rubric == 'Key Concept,No Evidence\nText,No text\n'
+        assert llm_examples == [['var x;', 'Key Concept\tLabel\nText\tNo Evidence\n']]
+
+    def test_should_filter_json_examples_by_response_type(self, label):
+        rubric = 'Key Concept,No Evidence\nSprites,No sprites\nText,No text\n'
+        examples = [['var y;', json.dumps([{'Key Concept': 'Sprites', 'Label': 'No Evidence'}, {'Key Concept': 'Text', 'Label': 'No Evidence'}])]]
+
+        llm_rubric, llm_examples = label.llm_rubric_and_examples(rubric, examples, ['Sprites'], response_type='json')
+
+        assert json.loads(llm_examples[0][1]) == [{'Key Concept': 'Text', 'Label': 'No Evidence'}]
+
+    def test_should_return_inputs_unchanged_without_cfe_key_concepts(self, label):
+        rubric = 'Key Concept,No Evidence\nSprites,No sprites\n'
+        examples = [['var x;', 'Key Concept\tLabel\nSprites\tNo Evidence\n']]
+
+        assert label.llm_rubric_and_examples(rubric, examples, ['Text']) == (rubric, examples)
+
+    def test_should_return_no_rubric_when_cfe_covers_everything(self, label):
+        rubric = 'Key Concept,No Evidence\nSprites,No sprites\n'
+
+        assert label.llm_rubric_and_examples(rubric, [], ['Sprites']) == (None, [])
+
+class TestCanonicalizeCode:
+    def test_should_ignore_comments_whitespace_and_line_endings(self, label):
+        original = label.canonicalize_code("var x = 1;\nif (x > 0) {\n  fill('red');\n}\n")
+        edited = label.canonicalize_code("// my program\r\nvar x=1;\r\n\r\nif (x>0) {  /* check */\r\n\tfill( 'red' );\r\n}")
+
+        assert original[0] == edited[0]
+        assert original[1] == [1, 2, 3, 4]
+        assert edited[1] == [2, 4, 5, 6]
+
+    def test_should_keep_changes_that_are_not_formatting(self, label):
+        assert label.canonicalize_code("fill('red');")[0] != label.canonicalize_code("fill('blue');")[0]
+        assert label.canonicalize_code("fill('a  b');")[0] != label.canonicalize_code("fill('a b');")[0]
+        assert label.canonicalize_code("x = a + +b;")[0] != label.canonicalize_code("x = a++b;")[0]
+
+    def test_should_fall_back_when_code_cannot_be_tokenized(self, label):
+        lines, line_numbers = label.canonicalize_code("var x = 'unterminated;\n\n// comment\nvar   y = 2;")
+
+        assert lines == ["var x = 'unterminated;", "var y = 2;"]
+        assert line_numbers == [1, 4]
+
+class TestRemapEvidenceLines:
+    def test_should_map_single_lines_and_ranges(self, label):
+        data = [
+            {'Key Concept': 'a', 'Evidence': 'Line 2: `x` Lines 3-5: `y`'},
+            {'Key Concept': 'b', 'Evidence': 'No lines'},
+        ]
+
+        label.remap_evidence_lines(data, lambda line: line * 10)
+
+        assert data[0]['Evidence'] == 'Line 20: `x` Lines 30-50: `y`'
+        assert data[1]['Evidence'] == 'No lines'
+
 class TestSanitizeCode:
     def test_should_call_remove_js_comments_if_wanted(self, mocker, label, code):
         remove_js_comments_mock = mocker.patch.object(Label, 'remove_js_comments')
@@ -118,6 +192,47 @@ class TestCodeFeatureExtractor:
 
         assert all(x['Label'] == 'No Evidence' for x in result['data'])
 
+    def test_should_reuse_features_of_identical_code(self, mocker, label, code):
+        with open('tests/data/cfe_params.json', 'r') as f:
+            params = json.load(f)
+        with open('tests/data/cfe_rubric.csv', 'r') as f:
+            rubric = f.read()
+        extract_mock = mocker.patch('lib.assessment.label.pooled_extract_features', wraps=pooled_extract_features)
+
+        first = label.cfe_label_student_work(rubric, code, params["code-feature-extractor"], params["lesson"])
+        second = Label().cfe_label_student_work(rubric, code, params["code-feature-extractor"], params["lesson"])
+        third = label.cfe_label_student_work(rubric, code + "\n", params["code-feature-extractor"], params["lesson"])
+
+        assert extract_mock.call_count == 2
+        assert first['metadata']['feature_cache'] == {'hit': False, 'hits': 0, 'misses': 1, 'size': 1}
+        assert second['metadata']['feature_cache'] == {'hit': True, 'hits': 1, 'misses': 1, 'size': 1}
+        assert third['metadata']['feature_cache']['hit'] == False
+        assert second['data'] == first['data']
+
+    def test_should_not_reuse_features_of_another_extractor_version(self, mocker, label, code):
+        with open('tests/data/cfe_rubric.csv', 'r') as f:
+            rubric = f.read()
+        extract_mock = mocker.patch('lib.assessment.label.pooled_extract_features', wraps=pooled_extract_features)
+
+        label.cfe_label_student_work(rubric, code, ["Modularity - Sprites and Sprite Properties"], "csd3-2023-L14")
+        mocker.patch('lib.assessment.label.EXTRACTOR_VERSION', 'fixed')
+        result = label.cfe_label_student_work(rubric, code, ["Modularity - Sprites and Sprite Properties"], "csd3-2023-L14")
+
+        assert extract_mock.call_count == 2
+        assert result['metadata']['feature_cache']['hit'] == False
+
+    def test_should_not_cache_features_when_disabled(self, mocker, label, code):
+        os.environ['FEATURE_CACHE'] = 'none'
+        with open('tests/data/cfe_rubric.csv', 'r') as f:
+            rubric = f.read()
+        extract_mock = mocker.patch('lib.assessment.label.pooled_extract_features', wraps=pooled_extract_features)
+
+        label.cfe_label_student_work(rubric, code, ["Modularity - Sprites and Sprite Properties"], "csd3-2023-L14")
+        result = label.cfe_label_student_work(rubric, code, ["Modularity - Sprites and Sprite Properties"], "csd3-2023-L14")
+
+        assert extract_mock.call_count == 2
+        assert 'feature_cache' not in result['metadata']
+
 
 class TestComputeMessages:
     def test_should_structure_messages_based_on_input(self, label, prompt, rubric, code):
@@ -675,7 +790,7 @@ class TestAiLabelStudentWork:
         assert requests_mock.last_request.json()['messages'] == messages
 
     def test_should_raise_timeout(self, mocker, label, prompt, rubric, code, student_id, examples, num_responses, temperature, llm_model):
-        mocker.patch('lib.assessment.label.requests.post', side_effect = requests.exceptions.ReadTimeout())
+        mocker.patch.object(requests.Session, 'post', side_effect = requests.exceptions.ReadTimeout())
 
         # Mock out compute_messages
         compute_messages = mocker.patch.object(Label, 'compute_messages')
@@ -701,6 +816,143 @@ class TestAiLabelStudentWork:
         assert result is None
 
 
+class TestLabelStudentWorkAsync:
+    def test_should_await_openai(self, mocker, openai_gpt_response, label, prompt, rubric, code, student_id, examples, temperature, llm_model):
+        post_openai = mocker.patch('lib.assessment.providers.post_openai', return_value=(200, 'application/json', json.dumps(openai_gpt_response(rubric=rubric, num_responses=1))))
+
+        result = asyncio.run(label.label_student_work_async(prompt, rubric, code, student_id, examples=examples(rubric), num_responses=1, temperature=temperature, llm_model=llm_model))
+
+        assert result['metadata']['agent'] == 'openai'
+        assert result['metadata']['path'] == 'llm'
+        assert len(result['data']) == len(list(csv.DictReader(rubric.splitlines())))
+        assert post_openai.call_args.args[2]['model'] == llm_model
+
+    def test_should_call_bedrock_on_a_thread(self, mocker, label, prompt, rubric, code, student_id):
+        threads = []
+        def bedrock_anthropic_label_student_work(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return {'metadata': {'agent': 'anthropic'}, 'data': []}
+        mocker.patch.object(BedrockAnthropicProvider, 'label_student_work', side_effect=bedrock_anthropic_label_student_work)
+
+        result = asyncio.run(label.label_student_work_async(prompt, rubric, code, student_id, num_responses=1, llm_model='bedrock.anthropic.claude-v2'))
+
+        assert result['metadata']['agent'] == 'anthropic'
+        assert threads and threads[0] is not threading.main_thread()
+
+    def test_should_wait_on_many_assessments_at_once(self, mocker, openai_gpt_response, prompt, rubric, code, temperature, llm_model):
+        response = (200, 'application/json', json.dumps(openai_gpt_response(rubric=rubric, num_responses=1)))
+        async def post_openai(api_url, headers, data):
+            await asyncio.sleep(0.5)
+            return response
+        mocker.patch('lib.assessment.providers.post_openai', side_effect=post_openai)
+
+        async def label_all():
+            return await asyncio.gather(*[
+                Label().label_student_work_async(prompt, rubric, code, str(i), num_responses=1, temperature=temperature, llm_model=llm_model, response_cache=False)
+                for i in range(100)
+            ])
+
+        start = time.time()
+        results = asyncio.run(label_all())
+
+        assert len(results) == 100
+        assert time.time() - start < 5
+
+class TestFailover:
+    def test_should_fall_back_to_the_next_model_in_the_chain(self, mocker, label, prompt, rubric, code, student_id):
+        os.environ['LLM_FALLBACK_CHAIN'] = 'bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0,gpt-4-turbo-2024-04-09'
+        mocker.patch.object(BedrockAnthropicProvider, 'label_student_work', side_effect=BedrockServerError('500'))
+        openai_label_student_work = mocker.patch.object(Label, 'openai_label_student_work', return_value={'metadata': {'agent': 'openai'}, 'data': []})
+
+        result = label.ai_label_student_work(prompt, rubric, code, student_id, num_responses=1, llm_model='bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0')
+
+        assert openai_label_student_work.call_args.kwargs['llm_model'] == 'gpt-4-turbo-2024-04-09'
+        assert result['metadata']['failover'] == {
+            'model': 'gpt-4-turbo-2024-04-09',
+            'attempts': [{'model': 'bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0', 'error': 'BedrockServerError: 500'}, {'model': 'gpt-4-turbo-2024-04-09'}],
+            'hedged': False,
+        }
+
+    def test_should_not_fall_back_from_models_outside_the_chain(self, mocker, label, prompt, rubric, code, student_id):
+        os.environ['LLM_FALLBACK_CHAIN'] = 'bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0,gpt-4-turbo-2024-04-09'
+        mocker.patch.object(Label, 'openai_label_student_work', side_effect=OpenaiServerError('500'))
+
+        with pytest.raises(OpenaiServerError):
+            label.ai_label_student_work(prompt, rubric, code, student_id, num_responses=1, llm_model='gpt-4-0613')
+
+    def test_should_hedge_once_latencies_are_known(self, mocker, label, prompt, rubric, code, student_id):
+        os.environ['LLM_FALLBACK_CHAIN'] = 'bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0,gpt-4-turbo-2024-04-09'
+        os.environ['LLM_HEDGE_PERCENTILE'] = '95'
+        os.environ['LLM_HEDGE_MIN_SAMPLES'] = '2'
+        for _ in range(2):
+            Label._latencies.record('bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0', 0.05)
+        def bedrock_anthropic_label_student_work(*args, **kwargs):
+            time.sleep(1)
+            return {'metadata': {'agent': 'anthropic'}, 'data': []}
+        mocker.patch.object(BedrockAnthropicProvider, 'label_student_work', side_effect=bedrock_anthropic_label_student_work)
+        mocker.patch.object(Label, 'openai_label_student_work', return_value={'metadata': {'agent': 'openai'}, 'data': []})
+
+        result = label.ai_label_student_work(prompt, rubric, code, student_id, num_responses=1, llm_model='bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0')
+
+        assert result['metadata']['agent'] == 'openai'
+        assert result['metadata']['failover']['hedged'] == True
+
+class TestRateLimits:
+    def test_should_report_queue_time_of_rate_limited_models(self, mocker, label, prompt, rubric, code, student_id):
+        os.environ['LLM_RATE_LIMITS'] = json.dumps({'bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0': {'requests_per_minute': 60, 'tokens_per_minute': 1000000}})
+        bedrock_anthropic_label_student_work = mocker.patch.object(BedrockAnthropicProvider, 'label_student_work', side_effect=lambda *args, **kwargs: {'metadata': {'agent': 'anthropic'}, 'data': []})
+
+        label.ai_label_student_work(prompt, rubric, code, student_id, num_responses=60, llm_model='bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0')
+        result = label.ai_label_student_work(prompt, rubric, code, student_id, num_responses=1, llm_model='bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0')
+
+        assert bedrock_anthropic_label_student_work.call_count == 2
+        # A request refills every second, and the first assessment used the whole minute's budget
+        assert 0.5 < result['metadata']['rate_limit']['queue_time'] < 1.5
+        assert result['metadata']['rate_limit']['estimated_tokens'] > 0
+
+    def test_should_not_report_rate_limits_of_unlimited_models(self, mocker, label, prompt, rubric, code, student_id):
+        mocker.patch.object(Label, 'openai_label_student_work', return_value={'metadata': {'agent': 'openai'}, 'data': []})
+
+        result = label.ai_label_student_work(prompt, rubric, code, student_id, num_responses=1, llm_model='gpt-4-turbo-2024-04-09')
+
+        assert 'rate_limit' not in result['metadata']
+
+    def test_should_count_every_wave_of_adaptive_consensus(self, mocker, label, prompt, rubric, code):
+        os.environ['LLM_RATE_LIMITS'] = json.dumps({'gpt-4-turbo-2024-04-09': {'requests_per_minute': 60}})
+        provider = get_provider('gpt-4-turbo-2024-04-09')
+
+        request_count, tokens = label.rate_limit_cost(provider, 'gpt-4-turbo-2024-04-09', prompt, rubric, code, [], 5)
+        assert request_count == 1
+
+        # Waves of 3, 1 and 1 responses at most
+        mocker.patch.dict(os.environ, {'ADAPTIVE_CONSENSUS': '1'})
+        adaptive_count, adaptive_tokens = label.rate_limit_cost(provider, 'gpt-4-turbo-2024-04-09', prompt, rubric, code, [], 5)
+        assert adaptive_count == 3
+        assert adaptive_tokens == 3 * tokens
+
+class TestOpenaiSession:
+    def test_should_share_one_session(self, label):
+        assert label.get_openai_session() is Label().get_openai_session()
+
+    def test_should_size_the_pool_from_the_environment(self, label):
+        os.environ['OPENAI_POOL_SIZE'] = '3'
+
+        adapter = label.get_openai_session().adapters['https://']
+
+        assert adapter.poolmanager.connection_pool_kw['maxsize'] == 3
+        assert label.get_openai_pool_stats() == {'pool_size': 3, 'connections': 0, 'requests': 0, 'idle': 0}
+
+    def test_should_post_with_connect_and_read_timeouts(self, mocker, requests_mock, openai_gpt_response, label, prompt, rubric, code, student_id, examples, temperature, llm_model):
+        requests_mock.post(
+            'https://api.openai.com/v1/chat/completions',
+            json=openai_gpt_response(rubric=rubric, num_responses=1)
+        )
+        post = mocker.spy(requests.Session, 'post')
+
+        label.ai_label_student_work(prompt, rubric, code, student_id, examples(rubric), 1, temperature, llm_model)
+
+        assert post.call_args.kwargs['timeout'] == (10, 150)
+
 class TestLabelStudentWork:
     @pytest.fixture
     def assessment_return_value(self, randomstring):
@@ -818,6 +1070,25 @@ class TestLabelStudentWork:
 
         mock_file.assert_called_with(filename, 'w+')
 
+    def test_should_not_write_cached_responses_without_an_ai_result(self, mocker, label, prompt, rubric, code, student_id, examples, num_responses, temperature, llm_model):
+        key_concepts = [row["Key Concept"] for row in csv.DictReader(rubric.splitlines())]
+        cfe_rows = [{"Label": "No Evidence", "Key Concept": kc, "Observations": "", "Reason": "", "Evidence": ""} for kc in key_concepts]
+        mocker.patch.object(Label, 'cfe_label_student_work', return_value={"metadata": {"agent": "code feature extractor"}, "data": cfe_rows})
+        mock_file = mocker.patch('builtins.open', mocker.mock_open())
+
+        label.label_student_work(
+            prompt, rubric, code, student_id,
+            examples=examples(rubric),
+            num_responses=num_responses,
+            temperature=temperature,
+            write_cached=True,
+            llm_model=llm_model,
+            code_feature_extractor=key_concepts,
+            response_cache=False
+        )
+
+        mock_file.assert_not_called()
+
     def test_should_call_test_for_blank_code_before_ai_assessment(self, mocker, label, prompt, rubric, code, student_id, examples, num_responses, temperature, llm_model):
         # Determine call order
         call_order = []
@@ -1048,7 +1319,11 @@ class TestLabelStudentWork:
         )
 
         response_type = 'json'
-        expected_examples = examples(rubric)
+        # Examples are in the format of the response type
+        expected_examples = [
+            [example_js, json.dumps(list(csv.DictReader(example_response.splitlines(), delimiter='\t')))]
+            for example_js, example_response in examples(rubric)
+        ]
         result = label.label_student_work(
             prompt, rubric, code, student_id,
             examples=expected_examples,
@@ -1106,6 +1381,262 @@ class TestLabelStudentWork:
 
         ai_label_student_work_mock.assert_called_once()
 
+    def test_should_only_send_key_concepts_not_covered_by_cfe_to_ai(self, mocker, label, assessment_return_value, prompt, rubric, code, student_id, examples, num_responses, temperature, llm_model):
+        parsed_rubric = list(csv.DictReader(rubric.splitlines()))
+        cfe_key_concept = parsed_rubric[0]["Key Concept"]
+        llm_key_concepts = [row["Key Concept"] for row in parsed_rubric[1:]]
+        cfe_row = {"Label": "No Evidence", "Key Concept": cfe_key_concept, "Observations": "", "Reason": "", "Evidence": ""}
+
+        mocker.patch.object(Label, 'cfe_label_student_work', return_value={"metadata": {"agent": "code feature extractor"}, "data": [cfe_row]})
+        ai_result = assessment_return_value(rubric)
+        ai_result['data'] = [row for row in ai_result['data'] if row['Key Concept'] != cfe_key_concept]
+        ai_label_student_work_mock = mocker.patch.object(Label, 'ai_label_student_work', return_value=ai_result)
+
+        result = label.label_student_work(
+            prompt, rubric, code, student_id,
+            examples=examples(rubric),
+            num_responses=num_responses,
+            temperature=temperature,
+            llm_model=llm_model,
+            code_feature_extractor=[cfe_key_concept]
+        )
+
+        llm_rubric = ai_label_student_work_mock.call_args[0][1]
+        assert [row["Key Concept"] for row in csv.DictReader(llm_rubric.splitlines())] == llm_key_concepts
+        for _, example_response in ai_label_student_work_mock.call_args[1]['examples']:
+            assert cfe_key_concept not in example_response
+        assert [row["Key Concept"] for row in result['data']] == [row["Key Concept"] for row in parsed_rubric]
+        assert result['data'][0] == cfe_row
+        assert result['metadata']['path'] == 'llm+cfe'
+
+    def test_should_report_llm_path_when_cfe_covers_no_key_concepts(self, mocker, label, assessment_return_value, prompt, rubric, code, student_id, examples, num_responses, temperature, llm_model):
+        ai_result = assessment_return_value(rubric)
+        ai_result['metadata'] = {'agent': 'openai'}
+        mocker.patch.object(Label, 'cfe_label_student_work', return_value={"metadata": {"agent": "code feature extractor"}, "data": []})
+        mocker.patch.object(Label, 'ai_label_student_work', return_value=ai_result)
+
+        result = label.label_student_work(
+            prompt, rubric, code, student_id,
+            examples=examples(rubric),
+            num_responses=num_responses,
+            temperature=temperature,
+            llm_model=llm_model,
+            code_feature_extractor=['Not In The Rubric']
+        )
+
+        assert result['metadata']['path'] == 'llm'
+        assert result['metadata']['agent'] == 'openai'
+        assert 'cfe' in result['metadata']['timings']
+
+    def test_should_not_call_ai_when_cfe_covers_every_key_concept(self, mocker, label, prompt, rubric, code, student_id, examples, num_responses, temperature, llm_model):
+        parsed_rubric = list(csv.DictReader(rubric.splitlines()))
+        key_concepts = [row["Key Concept"] for row in parsed_rubric]
+        cfe_rows = [{"Label": "No Evidence", "Key Concept": kc, "Observations": "", "Reason": "", "Evidence": ""} for kc in key_concepts]
+
+        mocker.patch.object(Label, 'cfe_label_student_work', return_value={"metadata": {"agent": "code feature extractor"}, "data": cfe_rows})
+        ai_label_student_work_mock = mocker.patch.object(Label, 'ai_label_student_work')
+
+        result = label.label_student_work(
+            prompt, rubric, code, student_id,
+            examples=examples(rubric),
+            num_responses=num_responses,
+            temperature=temperature,
+            llm_model=llm_model,
+            code_feature_extractor=key_concepts
+        )
+
+        ai_label_student_work_mock.assert_not_called()
+        assert result['data'] == cfe_rows
+        assert result['metadata']['agent'] == 'code feature extractor'
+        assert result['metadata']['path'] == 'cfe'
+
+    def test_should_report_feature_cache_in_metadata(self, label, prompt, rubric, code, student_id, examples, num_responses, temperature, llm_model):
+        key_concepts = [row["Key Concept"] for row in csv.DictReader(rubric.splitlines())]
+
+        result = label.label_student_work(
+            prompt, rubric, code, student_id,
+            examples=examples(rubric),
+            num_responses=num_responses,
+            temperature=temperature,
+            llm_model=llm_model,
+            code_feature_extractor=key_concepts,
+            response_cache=False,
+        )
+
+        assert result['metadata']['path'] == 'cfe'
+        assert result['metadata']['feature_cache']['hit'] == False
+        assert result['metadata']['feature_cache']['misses'] == 1
+
+    def test_should_run_cfe_while_waiting_for_ai(self, mocker, label, assessment_return_value, prompt, rubric, code, student_id, llm_model):
+        parsed_rubric = list(csv.DictReader(rubric.splitlines()))
+        cfe_key_concept = parsed_rubric[0]["Key Concept"]
+        cfe_row = {"Label": "No Evidence", "Key Concept": cfe_key_concept, "Observations": "", "Reason": "", "Evidence": ""}
+        # Both calls must be in progress at the same time to get past the barrier
+        barrier = threading.Barrier(2, timeout=5)
+
+        def cfe_label_student_work(*args):
+            barrier.wait()
+            return {"metadata": {"agent": "code feature extractor"}, "data": [cfe_row]}
+
+        def ai_label_student_work(*args, **kwargs):
+            barrier.wait()
+            return assessment_return_value(rubric)
+
+        mocker.patch.object(Label, 'cfe_label_student_work', side_effect=cfe_label_student_work)
+        mocker.patch.object(Label, 'ai_label_student_work', side_effect=ai_label_student_work)
+
+        result = label.label_student_work(prompt, rubric, code, student_id, llm_model=llm_model, code_feature_extractor=[cfe_key_concept])
+
+        assert result['data'][0] == cfe_row
+        assert set(result['metadata']['timings'].keys()) == {'llm', 'cfe'}
+
+    def test_should_raise_cfe_errors(self, mocker, label, assessment_return_value, prompt, rubric, code, student_id, llm_model):
+        cfe_key_concept = list(csv.DictReader(rubric.splitlines()))[0]["Key Concept"]
+        mocker.patch.object(Label, 'cfe_label_student_work', side_effect=KeyError('features'))
+        mocker.patch.object(Label, 'ai_label_student_work', return_value=assessment_return_value(rubric))
+
+        with pytest.raises(KeyError):
+            label.label_student_work(prompt, rubric, code, student_id, llm_model=llm_model, code_feature_extractor=[cfe_key_concept])
+
+    def test_should_report_llm_path_without_cfe(self, mocker, label, assessment_return_value, prompt, rubric, code, student_id, llm_model):
+        mocker.patch.object(Label, 'ai_label_student_work', return_value=assessment_return_value(rubric))
+
+        result = label.label_student_work(prompt, rubric, code, student_id, llm_model=llm_model)
+
+        assert result['metadata']['path'] == 'llm'
+
+    def test_should_return_cached_response_for_identical_request(self, mocker, label, assessment_return_value, prompt, rubric, code, student_id, examples, num_responses, temperature, llm_model):
+        ai_label_student_work_mock = mocker.patch.object(
+            Label, 'ai_label_student_work',
+            return_value=assessment_return_value(rubric)
+        )
+        example_set = examples(rubric)
+
+        first = label.label_student_work(prompt, rubric, code, student_id, examples=example_set, num_responses=num_responses, temperature=temperature, llm_model=llm_model)
+        second = label.label_student_work(prompt, rubric, code, 'another student', examples=example_set, num_responses=num_responses, temperature=temperature, llm_model=llm_model)
+
+        ai_label_student_work_mock.assert_called_once()
+        assert first['metadata']['cache']['hit'] == False
+        assert second['metadata']['cache'] == {'hit': True, 'key': first['metadata']['cache']['key']}
+        assert second['metadata']['student_id'] == 'another student'
+        assert second['data'] == first['data']
+
+    @pytest.mark.parametrize("changed", ['prompt', 'code', 'temperature', 'llm_model', 'num_responses', 'lesson'])
+    def test_should_not_return_cached_response_when_request_differs(self, mocker, label, assessment_return_value, prompt, rubric, code, student_id, num_responses, temperature, llm_model, changed):
+        ai_label_student_work_mock = mocker.patch.object(
+            Label, 'ai_label_student_work',
+            return_value=assessment_return_value(rubric)
+        )
+        params = dict(num_responses=num_responses, temperature=temperature, llm_model=llm_model, lesson='csd3-2023-L11')
+
+        label.label_student_work(prompt, rubric, code, student_id, **params)
+        if changed == 'prompt':
+            prompt += ' changed'
+        elif changed == 'code':
+            code += ' changed'
+        else:
+            params[changed] = params[changed] + 1 if isinstance(params[changed], (int, float)) else params[changed] + ' changed'
+        label.label_student_work(prompt, rubric, code, student_id, **params)
+
+        assert ai_label_student_work_mock.call_count == 2
+
+    def test_should_return_cached_response_for_formatting_only_edits(self, mocker, label, rubric, prompt, student_id, llm_model):
+        key_concepts = list(set(row['Key Concept'] for row in csv.DictReader(rubric.splitlines())))
+        ai_label_student_work_mock = mocker.patch.object(
+            Label, 'ai_label_student_work',
+            return_value={
+                'metadata': {'agent': 'openai', 'request': {}},
+                'data': [{'Key Concept': kc, 'Observations': '', 'Evidence': 'Lines 2-3: `if`', 'Label': 'No Evidence', 'Reason': ''} for kc in key_concepts],
+            }
+        )
+
+        label.label_student_work(prompt, rubric, "var x = 1;\nif (x) {\n}\n", student_id, llm_model=llm_model)
+        result = label.label_student_work(prompt, rubric, "// comment\nvar x=1;\n\nif (x) {\n\n}\n", student_id, llm_model=llm_model)
+
+        ai_label_student_work_mock.assert_called_once()
+        assert result['metadata']['cache']['hit'] == True
+        assert 'request' not in result['metadata']
+        assert all(row['Evidence'] == 'Lines 4-6: `if`' for row in result['data'])
+
+    def test_should_not_normalize_code_when_disabled_by_environment(self, mocker, label, assessment_return_value, prompt, rubric, student_id, llm_model):
+        mocker.patch.dict(os.environ, {'RESPONSE_CACHE_NORMALIZE_CODE': '0'})
+        ai_label_student_work_mock = mocker.patch.object(
+            Label, 'ai_label_student_work',
+            return_value=assessment_return_value(rubric)
+        )
+
+        label.label_student_work(prompt, rubric, "var x = 1;", student_id, llm_model=llm_model)
+        label.label_student_work(prompt, rubric, "var x=1;", student_id, llm_model=llm_model)
+
+        assert ai_label_student_work_mock.call_count == 2
+
+    def test_should_not_cache_when_disabled(self, mocker, label, assessment_return_value, prompt, rubric, code, student_id, llm_model):
+        ai_label_student_work_mock = mocker.patch.object(
+            Label, 'ai_label_student_work',
+            return_value=assessment_return_value(rubric)
+        )
+
+        label.label_student_work(prompt, rubric, code, student_id, llm_model=llm_model, response_cache=False)
+        result = label.label_student_work(prompt, rubric, code, student_id, llm_model=llm_model, response_cache=False)
+
+        assert ai_label_student_work_mock.call_count == 2
+        assert 'cache' not in result['metadata']
+
+    def test_should_not_cache_when_disabled_by_environment(self, mocker, label, assessment_return_value, prompt, rubric, code, student_id, llm_model):
+        mocker.patch.dict(os.environ, {'RESPONSE_CACHE': 'none'})
+        ai_label_student_work_mock = mocker.patch.object(
+            Label, 'ai_label_student_work',
+            return_value=assessment_return_value(rubric)
+        )
+
+        label.label_student_work(prompt, rubric, code, student_id, llm_model=llm_model)
+        label.label_student_work(prompt, rubric, code, student_id, llm_model=llm_model)
+
+        assert Label.get_response_cache() is None
+        assert ai_label_student_work_mock.call_count == 2
+
+    def test_should_not_cache_failed_assessments(self, mocker, label, assessment_return_value, prompt, rubric, code, student_id, llm_model):
+        ai_label_student_work_mock = mocker.patch.object(
+            Label, 'ai_label_student_work',
+            side_effect=[InvalidResponseError('bad'), assessment_return_value(rubric)]
+        )
+
+        with pytest.raises(InvalidResponseError):
+            label.label_student_work(prompt, rubric, code, student_id, llm_model=llm_model)
+        result = label.label_student_work(prompt, rubric, code, student_id, llm_model=llm_model)
+
+        assert ai_label_student_work_mock.call_count == 2
+        assert result['metadata']['cache']['hit'] == False
+
+    def test_should_not_cache_answers_from_fallback_models(self, mocker, label, assessment_return_value, prompt, rubric, code, student_id, llm_model):
+        failover = {'model': 'another-model', 'attempts': [{'model': llm_model, 'error': 'Timeout'}, {'model': 'another-model'}], 'hedged': False}
+        fallback_result = assessment_return_value(rubric, metadata={'failover': failover})
+        ai_label_student_work_mock = mocker.patch.object(
+            Label, 'ai_label_student_work',
+            side_effect=[fallback_result, assessment_return_value(rubric)]
+        )
+
+        label.label_student_work(prompt, rubric, code, student_id, llm_model=llm_model)
+        result = label.label_student_work(prompt, rubric, code, student_id, llm_model=llm_model)
+
+        assert ai_label_student_work_mock.call_count == 2
+        assert result['metadata']['cache']['hit'] == False
+
+    def test_should_not_replay_failover_and_rate_limits_from_the_cache(self, mocker, label, assessment_return_value, prompt, rubric, code, student_id, llm_model):
+        metadata = {
+            'failover': {'model': llm_model, 'attempts': [{'model': llm_model}], 'hedged': False},
+            'rate_limit': {'queue_time': 1.5, 'estimated_tokens': 100},
+        }
+        mocker.patch.object(Label, 'ai_label_student_work', return_value=assessment_return_value(rubric, metadata=metadata))
+
+        first = label.label_student_work(prompt, rubric, code, student_id, llm_model=llm_model)
+        second = label.label_student_work(prompt, rubric, code, student_id, llm_model=llm_model)
+
+        assert first['metadata']['rate_limit']['queue_time'] == 1.5
+        assert second['metadata']['cache']['hit'] == True
+        assert 'failover' not in second['metadata']
+        assert 'rate_limit' not in second['metadata']
+
 class TestAiLabelStudentWork:
 
     @pytest.fixture
@@ -1127,8 +1658,8 @@ class TestAiLabelStudentWork:
         })
 
         bedrock_meta_label_student_work_mock = mocker.patch.object(
-            Label, 
-            'bedrock_meta_label_student_work',
+            BedrockMetaProvider, 
+            'label_student_work',
             return_value={
             'metadata': {
                 'agent': 'meta',
@@ -1137,8 +1668,8 @@ class TestAiLabelStudentWork:
         })
 
         bedrock_anthropic_label_student_work_mock = mocker.patch.object(
-            Label, 
-            'bedrock_anthropic_label_student_work',
+            BedrockAnthropicProvider, 
+            'label_student_work',
             return_value={
             'metadata': {
                 'agent': 'anthropic',
@@ -1182,10 +1713,65 @@ class TestAiLabelStudentWork:
             return_value=response_data
         )
 
-        response = label.bedrock_anthropic_label_student_work(prompt, rubric, code, student_id, examples, num_responses, temperature, llm_model='bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0')
+        response = label.bedrock_anthropic_label_student_work(prompt, rubric, code, student_id, examples, 1, temperature, llm_model='bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0')
         get_bedrock_client_mock.assert_called_once()
         get_response_data_if_valid_mock.assert_called_once()
         assert response['metadata']['agent'] == 'anthropic'
+        assert response['data'] == response_data
+
+    def test_bedrock_anthropic_label_student_work_should_vote_on_concurrent_responses(self, mocker, label, prompt, rubric, code, student_id, examples, temperature, openai_gpt_response):
+        # Each call returns a different response, and the first one is outvoted
+        choices = openai_gpt_response(rubric, num_responses=3, disagreements=1, output_type='tsv')['choices']
+        responses = iter([label.get_response_data_if_valid(choice, rubric, student_id) for choice in choices])
+        barrier = threading.Barrier(3, timeout=5)
+
+        class mock_bedrock_client:
+            def invoke_model(body, modelId, accept, contentType):
+                # Every call must be in flight at the same time to get past the barrier
+                barrier.wait()
+                return {'ResponseMetadata': {'HTTPStatusCode': 200}, 'body': StringIO('{"content": [{"text": "response text"}]}')}
+
+        mocker.patch.object(Label, 'get_bedrock_client', return_value=mock_bedrock_client)
+        mocker.patch.object(Label, 'get_aws_account', return_value='12345')
+        lock = threading.Lock()
+        def next_response(*args, **kwargs):
+            with lock:
+                return next(responses)
+        mocker.patch.object(Label, 'get_response_data_if_valid', side_effect=next_response)
+
+        response = label.bedrock_anthropic_label_student_work(prompt, rubric, code, student_id, examples, 3, temperature, llm_model='bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0')
+
+        assert len(response['metadata']['samples']) == 3
+        assert all(sample['valid'] for sample in response['metadata']['samples'])
+        assert any(row['Reason'].startswith('<b>Votes: ') for row in response['data'])
+
+    def test_bedrock_anthropic_label_student_work_should_ignore_invalid_responses(self, mocker, label, prompt, rubric, code, student_id, examples, temperature):
+        response_data = [{"Key Concept": "Some concept", "Label": "No Evidence"}]
+        class mock_bedrock_client:
+            def invoke_model(body, modelId, accept, contentType):
+                return {'ResponseMetadata': {'HTTPStatusCode': 200}, 'body': StringIO('{"content": [{"text": "response text"}]}')}
+
+        mocker.patch.object(Label, 'get_bedrock_client', return_value=mock_bedrock_client)
+        mocker.patch.object(Label, 'get_aws_account', return_value='12345')
+        mocker.patch.object(Label, 'get_response_data_if_valid', side_effect=[InvalidResponseError('bad'), response_data])
+        mocker.patch.dict(os.environ, {'BEDROCK_MAX_CONCURRENT_SAMPLES': '1'})
+
+        response = label.bedrock_anthropic_label_student_work(prompt, rubric, code, student_id, examples, 2, temperature, llm_model='bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0')
+
+        assert response['data'] == response_data
+        assert [sample['valid'] for sample in response['metadata']['samples']] == [False, True]
+
+    def test_bedrock_anthropic_label_student_work_should_raise_when_every_response_is_invalid(self, mocker, label, prompt, rubric, code, student_id, examples, temperature):
+        class mock_bedrock_client:
+            def invoke_model(body, modelId, accept, contentType):
+                return {'ResponseMetadata': {'HTTPStatusCode': 200}, 'body': StringIO('{"content": [{"text": "response text"}]}')}
+
+        mocker.patch.object(Label, 'get_bedrock_client', return_value=mock_bedrock_client)
+        mocker.patch.object(Label, 'get_aws_account', return_value='12345')
+        mocker.patch.object(Label, 'get_response_data_if_valid', side_effect=InvalidResponseError('bad'))
+
+        with pytest.raises(InvalidResponseError):
+            label.bedrock_anthropic_label_student_work(prompt, rubric, code, student_id, examples, 2, temperature, llm_model='bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0')
 
     def test_bedrock_anthropic_label_student_work_should_raise_error_on_500_response(self, mocker, label, prompt, rubric, code, student_id, examples, num_responses, temperature, caplog):
         
@@ -1264,6 +1850,225 @@ class TestAiLabelStudentWork:
         get_response_data_if_valid_mock.assert_called_once()
         assert response['metadata']['agent'] == 'meta'
 
+class TestBedrockAnthropicStream:
+    @pytest.fixture
+    def stream_rows(self):
+        """ Creates valid response rows for each Key Concept of the rubric.
+        """
+
+        def gen_rows(rubric):
+            key_concepts = sorted(set(row['Key Concept'] for row in csv.DictReader(rubric.splitlines())))
+            return [{'Key Concept': kc, 'Observations': 'obs', 'Evidence': 'Line 1: `x`', 'Label': 'No Evidence', 'Reason': 'reason'} for kc in key_concepts]
+
+        return gen_rows
+
+    @pytest.fixture
+    def stream_bedrock(self, mocker):
+        """ Stubs the bedrock client to stream the given events. Returns the list of
+            events that have been consumed.
+        """
+        consumed = []
+
+        def gen_stub(events, status=200):
+            def body():
+                for event in events:
+                    consumed.append(event)
+                    yield event
+
+            class mock_bedrock_client:
+                def invoke_model_with_response_stream(body=None, modelId=None, accept=None, contentType=None):
+                    return {'ResponseMetadata': {'HTTPStatusCode': status}, 'body': body_events}
+
+            body_events = body()
+            mocker.patch.object(Label, 'get_bedrock_client', return_value=mock_bedrock_client)
+            mocker.patch.object(Label, 'get_aws_account', return_value='12345')
+            return consumed
+
+        return gen_stub
+
+    def test_should_yield_each_row_as_it_arrives(self, label, stream_bedrock, claude_stream_events, stream_rows, prompt, rubric, code, student_id):
+        rows = stream_rows(rubric)
+        events = claude_stream_events("Here you go:\n" + json.dumps(rows))
+        consumed = stream_bedrock(events)
+
+        stream = label.bedrock_anthropic_stream_label_student_work(prompt, rubric, code, student_id, llm_model='bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0')
+
+        assert next(stream) == rows[0]
+        assert len(consumed) < len(events)
+        assert list(stream) == rows[1:]
+
+    def test_should_fail_fast_on_unexpected_key_concept(self, label, stream_bedrock, claude_stream_events, stream_rows, prompt, rubric, code, student_id):
+        rows = stream_rows(rubric)
+        rows[0]['Key Concept'] = 'Bogus Key Concept'
+        events = claude_stream_events(json.dumps(rows))
+        consumed = stream_bedrock(events)
+
+        with pytest.raises(InvalidResponseError):
+            list(label.bedrock_anthropic_stream_label_student_work(prompt, rubric, code, student_id, llm_model='bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0'))
+        assert len(consumed) < len(events)
+
+    def test_should_fail_on_invalid_label(self, label, stream_bedrock, claude_stream_events, stream_rows, prompt, rubric, code, student_id):
+        rows = stream_rows(rubric)
+        rows[1]['Label'] = 'Great Evidence'
+        stream_bedrock(claude_stream_events(json.dumps(rows)))
+
+        with pytest.raises(InvalidResponseError):
+            list(label.bedrock_anthropic_stream_label_student_work(prompt, rubric, code, student_id, llm_model='bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0'))
+
+    def test_should_fail_on_missing_key_concept(self, label, stream_bedrock, claude_stream_events, stream_rows, prompt, rubric, code, student_id):
+        stream_bedrock(claude_stream_events(json.dumps(stream_rows(rubric)[1:])))
+
+        with pytest.raises(InvalidResponseError):
+            list(label.bedrock_anthropic_stream_label_student_work(prompt, rubric, code, student_id, llm_model='bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0'))
+
+    def test_should_raise_request_too_large_when_truncated_by_max_tokens(self, label, stream_bedrock, claude_stream_events, stream_rows, prompt, rubric, code, student_id):
+        text = json.dumps(stream_rows(rubric))
+        stream_bedrock(claude_stream_events(text[:len(text) // 2], stop_reason='max_tokens'))
+
+        with pytest.raises(RequestTooLargeError):
+            list(label.bedrock_anthropic_stream_label_student_work(prompt, rubric, code, student_id, llm_model='bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0'))
+
+    def test_should_raise_on_server_error(self, label, stream_bedrock, claude_stream_events, prompt, rubric, code, student_id):
+        stream_bedrock([], status=500)
+
+        with pytest.raises(BedrockServerError):
+            list(label.bedrock_anthropic_stream_label_student_work(prompt, rubric, code, student_id, llm_model='bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0'))
+
+    def test_label_student_work_stream_should_emit_labels_then_metadata(self, label, stream_bedrock, claude_stream_events, stream_rows, prompt, rubric, code, student_id):
+        rows = stream_rows(rubric)
+        stream_bedrock(claude_stream_events(json.dumps(rows)))
+
+        events = list(label.label_student_work_stream(prompt, rubric, code, student_id, num_responses=1, llm_model='bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0'))
+
+        assert events[:-1] == [('label', row) for row in rows]
+        assert events[-1][0] == 'metadata'
+        assert events[-1][1]['agent'] == 'anthropic'
+        assert events[-1][1]['first_label_time'] <= events[-1][1]['time']
+
+    def test_label_student_work_stream_should_label_blank_code_statically(self, mocker, label, prompt, rubric, student_id):
+        stream_mock = mocker.patch.object(BedrockAnthropicProvider, 'stream_label_student_work')
+
+        events = list(label.label_student_work_stream(prompt, rubric, "  \n", student_id, num_responses=1, llm_model='bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0'))
+
+        stream_mock.assert_not_called()
+        assert all(event == 'label' and data['Label'] == 'No Evidence' for event, data in events[:-1])
+        assert events[-1][0] == 'metadata'
+        assert events[-1][1]['agent'] == 'static'
+
+    def test_label_student_work_stream_should_send_code_feature_extractor_labels_first(self, mocker, label, stream_rows, prompt, rubric, code, student_id):
+        rows = stream_rows(rubric)
+        cfe_row = dict(rows[1], Label='Extensive Evidence', Evidence='cfe evidence')
+        mocker.patch.object(Label, 'cfe_label_student_work', return_value={'metadata': {'agent': 'code feature extractor'}, 'data': [cfe_row]})
+
+        def llm_rows(prompt, llm_rubric, *args, **kwargs):
+            # The code feature extractor's labels must already have been sent, and are not in the LLM's rubric
+            assert [data for _, data in sent] == [cfe_row]
+            assert rows[1]['Key Concept'] not in llm_rubric
+            yield rows[0]
+            yield from rows[2:]
+        mocker.patch.object(BedrockAnthropicProvider, 'stream_label_student_work', side_effect=llm_rows)
+
+        sent = []
+        for event, data in label.label_student_work_stream(prompt, rubric, code, student_id, num_responses=1, llm_model='bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0', code_feature_extractor=[rows[1]['Key Concept']], lesson='csd3-2023-L11'):
+            sent.append((event, data))
+
+        assert [data for _, data in sent[:-1]] == [cfe_row, rows[0]] + rows[2:]
+        assert sent[-1][1]['agent'] == 'anthropic, code feature extractor'
+
+    def test_label_student_work_stream_should_assess_whole_response_for_other_models(self, mocker, label, stream_rows, prompt, rubric, code, student_id, llm_model):
+        response = {'metadata': {'agent': 'openai'}, 'data': stream_rows(rubric)}
+        label_student_work_mock = mocker.patch.object(Label, 'label_student_work', return_value=response)
+
+        events = list(label.label_student_work_stream(prompt, rubric, code, student_id, num_responses=1, llm_model=llm_model))
+
+        label_student_work_mock.assert_called_once()
+        assert events == [('label', row) for row in response['data']] + [('metadata', response['metadata'])]
+
+class TestAdaptiveConsensus:
+    def test_should_stop_once_first_responses_agree(self, mocker, requests_mock, openai_gpt_response, label, prompt, rubric, code, student_id, temperature, llm_model):
+        mocker.patch.dict(os.environ, {'ADAPTIVE_CONSENSUS': '1'})
+        requests_mock.post(
+            'https://api.openai.com/v1/chat/completions',
+            json=openai_gpt_response(rubric, num_responses=2)
+        )
+
+        result = label.ai_label_student_work(prompt, rubric, code, student_id, [], 3, temperature, llm_model)
+
+        assert requests_mock.call_count == 1
+        assert requests_mock.last_request.json()['n'] == 2
+        assert result['metadata']['consensus'] == {'requested': 2, 'valid': 2}
+        assert result['metadata']['usage']['total_tokens'] == 2869
+
+    def test_should_request_more_responses_on_disagreement(self, mocker, requests_mock, openai_gpt_response, label, prompt, rubric, code, student_id, temperature, llm_model):
+        mocker.patch.dict(os.environ, {'ADAPTIVE_CONSENSUS': '1'})
+        requests_mock.post(
+            'https://api.openai.com/v1/chat/completions',
+            [
+                {'json': openai_gpt_response(rubric, num_responses=2, disagreements=1)},
+                {'json': openai_gpt_response(rubric, num_responses=1)},
+            ]
+        )
+
+        result = label.ai_label_student_work(prompt, rubric, code, student_id, [], 3, temperature, llm_model)
+
+        assert requests_mock.call_count == 2
+        assert [request.json()['n'] for request in requests_mock.request_history] == [2, 1]
+        assert result['metadata']['consensus'] == {'requested': 3, 'valid': 3}
+        assert result['metadata']['usage']['total_tokens'] == 2 * 2869
+
+    def test_should_request_all_responses_when_disabled(self, requests_mock, openai_gpt_response, label, prompt, rubric, code, student_id, temperature, llm_model):
+        requests_mock.post(
+            'https://api.openai.com/v1/chat/completions',
+            json=openai_gpt_response(rubric, num_responses=3)
+        )
+
+        result = label.ai_label_student_work(prompt, rubric, code, student_id, [], 3, temperature, llm_model)
+
+        assert requests_mock.call_count == 1
+        assert requests_mock.last_request.json()['n'] == 3
+        assert 'consensus' not in result['metadata']
+
+    def test_should_raise_request_too_large_when_every_response_is_truncated(self, mocker, requests_mock, openai_gpt_response, label, prompt, rubric, code, student_id, temperature, llm_model):
+        mocker.patch.dict(os.environ, {'ADAPTIVE_CONSENSUS': '1'})
+        response = openai_gpt_response(rubric, num_responses=2)
+        for choice in response['choices']:
+            choice['message']['content'] = '[{"Key Concept": '
+            choice['finish_reason'] = 'length'
+        requests_mock.post('https://api.openai.com/v1/chat/completions', json=response)
+
+        with pytest.raises(RequestTooLargeError):
+            label.ai_label_student_work(prompt, rubric, code, student_id, [], 3, temperature, llm_model, response_type='json')
+
+    def test_should_stop_bedrock_calls_once_consensus_is_locked(self, mocker, label, prompt, rubric, code, student_id, temperature):
+        mocker.patch.dict(os.environ, {'ADAPTIVE_CONSENSUS': '1'})
+        response_data = [{"Key Concept": "Some concept", "Label": "No Evidence", "Observations": "", "Reason": ""}]
+        class mock_bedrock_client:
+            def invoke_model(body, modelId, accept, contentType):
+                return {'ResponseMetadata': {'HTTPStatusCode': 200}, 'body': StringIO('{"content": [{"text": "response text"}]}')}
+
+        mocker.patch.object(Label, 'get_bedrock_client', return_value=mock_bedrock_client)
+        mocker.patch.object(Label, 'get_aws_account', return_value='12345')
+        get_response_data_if_valid_mock = mocker.patch.object(Label, 'get_response_data_if_valid', return_value=response_data)
+
+        response = label.bedrock_anthropic_label_student_work(prompt, rubric, code, student_id, [], 5, temperature, llm_model='bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0')
+
+        assert get_response_data_if_valid_mock.call_count == 3
+        assert len(response['metadata']['samples']) == 3
+
+    @pytest.mark.parametrize("labels,remaining,locked,next_wave", [
+        ([], 3, False, 2),
+        (['a', 'a'], 1, True, 0),
+        (['a', 'b'], 1, False, 1),
+        (['a', 'a', 'b'], 2, False, 1),
+        (['a', 'a', 'a'], 2, True, 0),
+        (['a', 'b', 'c'], 4, False, 3),
+    ])
+    def test_should_lock_majority_only_when_remaining_votes_cannot_change_it(self, label, labels, remaining, locked, next_wave):
+        choices = [[{'Key Concept': 'kc', 'Label': label_value}] for label_value in labels]
+
+        assert label._consensus_locked(choices, remaining) == locked
+        assert label._next_wave_size(choices, remaining) == next_wave
+
 class TestGetConsensusResponse:
     @pytest.fixture
     def response_data_choices(self, label, openai_gpt_response):
@@ -0,0 +1,136 @@
+import csv
+import json
+
+import pytest
+
+from lib.assessment import providers
+from lib.assessment.label import Label, BedrockServerError
+from lib.assessment.providers import Provider, OpenaiProvider, BedrockAnthropicProvider, BedrockMetaProvider, LocalProvider, UnknownModelError, get_provider, register_provider
+
+
+@pytest.fixture
+def label():
+    """ Creates a Label() instance for any test that has a 'label' parameter.
+    """
+    yield Label()
+
+@pytest.fixture
+def registered_providers():
+    """ Restores the registered providers after a test registers its own.
+    """
+
+    saved = list(providers._providers)
+    yield
+    providers._providers[:] = saved
+    get_provider.cache_clear()
+
+@pytest.fixture
+def local_provider(registered_providers):
+    """ Registers the local stand-in, which is only registered on request.
+    """
+
+    register_provider(LocalProvider())
+    yield
+
+class TestGetProvider:
+    @pytest.mark.parametrize("llm_model,provider_class", [
+        ('gpt-4-turbo-2024-04-09', OpenaiProvider),
+        ('bedrock.anthropic.claude-3-5-sonnet-20240620-v1:0', BedrockAnthropicProvider),
+        ('bedrock.us.anthropic.claude-sonnet-4-5-20250929-v1:0', BedrockAnthropicProvider),
+        ('bedrock.meta.llama2-70b-chat-v1', BedrockMetaProvider),
+    ])
+    def test_should_find_the_provider_of_each_model(self, llm_model, provider_class):
+        assert isinstance(get_provider(llm_model), provider_class)
+
+    def test_should_not_serve_local_models_unless_registered(self):
+        with pytest.raises(UnknownModelError):
+            get_provider('local.stand-in')
+
+    def test_should_serve_local_models_once_registered(self, local_provider):
+        assert isinstance(get_provider('local.stand-in'), LocalProvider)
+
+    def test_should_cache_the_provider_of_a_model(self):
+        get_provider.cache_clear()
+
+        provider = get_provider('gpt-4-0613')
+
+        assert get_provider('gpt-4-0613') is provider
+        assert get_provider.cache_info().hits == 1
+
+    def test_should_raise_for_unknown_models(self):
+        with pytest.raises(UnknownModelError):
+            get_provider('unknown-model')
+
+    def test_should_prefer_the_longest_matching_prefix(self, registered_providers):
+        class TurboProvider(Provider):
+            prefixes = ('gpt-4-turbo',)
+        turbo = TurboProvider()
+
+        register_provider(turbo)
+
+        assert get_provider('gpt-4-turbo-2024-04-09') is turbo
+        assert isinstance(get_provider('gpt-4-0613'), OpenaiProvider)
+
+class TestLocalProvider:
+    def test_should_label_every_key_concept_without_a_network_call(self, local_provider, label, prompt, rubric, code, student_id):
+        result = label.label_student_work(prompt, rubric, code, student_id, num_responses=1, llm_model='local.stand-in')
+
+        assert result['metadata']['agent'] == 'local'
+        assert [row['Key Concept'] for row in result['data']] == [row['Key Concept'] for row in csv.DictReader(rubric.splitlines())]
+        assert all(row['Label'] == 'No Evidence' for row in result['data'])
+
+class TestBedrockProviders:
+    @pytest.mark.parametrize("provider", providers._providers + [LocalProvider()])
+    def test_should_implement_build_invoke_and_parse(self, provider):
+        for method in ['build_request', 'invoke', 'parse']:
+            assert getattr(type(provider), method) is not getattr(Provider, method)
+
+    def test_should_build_the_meta_request(self, mocker, label, prompt, rubric, code):
+        bedrock_model, body = BedrockMetaProvider().build_request(label, prompt, rubric, code, temperature=0.5, llm_model='bedrock.meta.llama2-13b-chat-v1')
+
+        assert bedrock_model == 'meta.llama2-13b-chat-v1'
+        assert json.loads(body)['prompt'] == label.compute_meta_prompt(prompt, rubric, code)
+        assert json.loads(body)['temperature'] == 0.5
+
+    def test_should_call_claude_4_through_an_inference_profile(self, mocker, label, prompt, rubric, code):
+        mocker.patch.object(Label, 'get_aws_account', return_value='12345\n')
+
+        bedrock_model, body = BedrockAnthropicProvider().build_request(label, prompt, rubric, code, llm_model='bedrock.us.anthropic.claude-sonnet-4-5-20250929-v1:0')
+
+        assert bedrock_model == 'arn:aws:bedrock:us-east-1:12345:inference-profile/us.anthropic.claude-sonnet-4-5-20250929-v1:0'
+        assert json.loads(body)['messages'][0]['content'][0]['text'] == label.compute_anthropic_prompt(prompt, rubric, code)
+
+    @pytest.mark.parametrize("status,raises", [(500, True), (400, False)])
+    def test_should_handle_failed_calls_alike(self, mocker, label, student_id, status, raises):
+        bedrock = mocker.Mock()
+        bedrock.invoke_model.return_value = {'ResponseMetadata': {'HTTPStatusCode': status}, 'body': None}
+        mocker.patch.object(Label, 'get_bedrock_client', return_value=bedrock)
+
+        for provider in [BedrockAnthropicProvider(), BedrockMetaProvider()]:
+            if raises:
+                with pytest.raises(BedrockServerError):
+                    provider.invoke(label, ('model', '{}'), student_id)
+            else:
+                assert provider.invoke(label, ('model', '{}'), student_id) is None
+
+class TestCustomProvider:
+    def test_should_label_through_build_invoke_and_parse(self, registered_providers, label, prompt, rubric, code, student_id):
+        class EchoProvider(Provider):
+            agent = 'echo'
+            prefixes = ('echo.',)
+
+            def build_request(self, label, prompt, rubric, student_code, examples=[], num_responses=0, temperature=0.0, llm_model=""):
+                return {'code': student_code}
+
+            def invoke(self, label, request, student_id):
+                return {'echo': request['code']}
+
+            def parse(self, label, request, response, rubric, student_id, response_type='tsv'):
+                return {'metadata': {'agent': self.agent, 'usage': {'total_tokens': 7}}, 'data': [response]}
+
+        register_provider(EchoProvider())
+
+        result = label.ai_label_student_work(prompt, rubric, code, student_id, llm_model='echo.model')
+
+        assert result == {'metadata': {'agent': 'echo', 'usage': {'total_tokens': 7}}, 'data': [{'echo': code}]}
+        assert get_provider('echo.model').usage(result) == {'total_tokens': 7}
@@ -0,0 +1,163 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+from lib.assessment.rate_limiter import TokenBucket, ModelLimit, RateLimiter, estimate_tokens
+
+
+class TestEstimateTokens:
+    def test_should_count_about_four_characters_per_token(self):
+        assert estimate_tokens('a' * 400, 'b' * 400) == 201
+
+class TestTokenBucket:
+    def test_should_start_full_and_refill_over_a_minute(self):
+        bucket = TokenBucket(60)
+        now = bucket.updated
+
+        assert bucket.wait_time(60, now) == 0
+        bucket.take(60)
+        assert bucket.wait_time(1, now) == pytest.approx(1)
+        assert bucket.wait_time(1, now + 1) == 0
+
+    def test_should_only_wait_for_a_full_bucket_for_large_amounts(self):
+        bucket = TokenBucket(60)
+        now = bucket.updated
+        bucket.take(30)
+
+        assert bucket.wait_time(1000, now) == pytest.approx(30)
+
+class TestModelLimit:
+    def test_should_not_wait_within_budget(self):
+        limit = ModelLimit(requests_per_minute=10, tokens_per_minute=1000)
+
+        for _ in range(10):
+            assert limit.acquire(1, 100) < 0.05
+            limit.release()
+
+        assert limit.stats() == {'requests_per_minute': 10, 'tokens_per_minute': 1000, 'max_concurrent': None, 'active': 0, 'queued': 0}
+
+    def test_should_queue_over_the_token_budget(self):
+        limit = ModelLimit(tokens_per_minute=600)
+        limit.acquire(1, 600)
+        limit.release()
+
+        # 10 tokens refill every second
+        queue_time = limit.acquire(1, 2)
+        limit.release()
+
+        assert 0.1 < queue_time < 1
+
+    def test_should_let_callers_through_in_order(self):
+        limit = ModelLimit(max_concurrent=1)
+        limit.acquire()
+        order = []
+
+        def caller(name):
+            limit.acquire()
+            order.append(name)
+            limit.release()
+
+        threads = []
+        for name in ['a', 'b', 'c']:
+            thread = threading.Thread(target=caller, args=(name,))
+            thread.start()
+            threads.append(thread)
+            # Ensures the callers queue in order
+            while limit.stats()['queued'] < len(threads):
+                time.sleep(0.001)
+
+        limit.release()
+        for thread in threads:
+            thread.join()
+
+        assert order == ['a', 'b', 'c']
+
+    def test_should_queue_asynchronous_callers_with_blocking_ones(self):
+        limit = ModelLimit(max_concurrent=1)
+        limit.acquire()
+
+        async def run():
+            waiter = asyncio.ensure_future(limit.acquire_async())
+            await asyncio.sleep(0.05)
+            assert not waiter.done()
+            assert limit.stats()['queued'] == 1
+
+            limit.release()
+            queue_time = await waiter
+            limit.release()
+            return queue_time
+
+        assert asyncio.run(run()) >= 0.05
+        assert limit.stats()['active'] == 0
+
+    def test_should_wake_asynchronous_callers_released_from_another_thread(self):
+        limit = ModelLimit(max_concurrent=1)
+        limit.acquire()
+
+        async def run():
+            threading.Timer(0.05, limit.release).start()
+            queue_time = await limit.acquire_async()
+            limit.release()
+            return queue_time
+
+        assert 0.05 <= asyncio.run(run()) < 0.5
+
+    def test_should_sleep_until_the_budget_allows(self, mocker):
+        limit = ModelLimit(requests_per_minute=600)
+        limit.acquire(600)
+        limit.release()
+        try_acquire = mocker.spy(limit, '_try_acquire')
+
+        # A request refills every 0.1 seconds
+        queue_time = asyncio.run(limit.acquire_async())
+        limit.release()
+
+        assert 0.05 < queue_time < 0.5
+        assert try_acquire.call_count <= 3
+
+    def test_should_leave_the_queue_when_cancelled(self):
+        limit = ModelLimit(max_concurrent=1)
+        limit.acquire()
+
+        async def run():
+            waiter = asyncio.ensure_future(limit.acquire_async())
+            await asyncio.sleep(0.02)
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+
+        asyncio.run(run())
+
+        assert limit.stats()['queued'] == 0
+        assert limit.stats()['active'] == 1
+
+class TestRateLimiter:
+    def test_should_not_limit_models_without_limits(self):
+        limiter = RateLimiter({'limited': {'max_concurrent': 1}})
+
+        with limiter.limit('unlimited') as queue_time:
+            assert queue_time is None
+        with limiter.limit('limited') as queue_time:
+            assert queue_time < 0.05
+            assert limiter.stats()['limited']['active'] == 1
+
+        assert limiter.stats()['limited']['active'] == 0
+
+    def test_should_release_when_the_request_fails(self):
+        limiter = RateLimiter({'limited': {'max_concurrent': 1}})
+
+        async def run():
+            with pytest.raises(ValueError):
+                async with limiter.limit_async('limited'):
+                    raise ValueError()
+
+        asyncio.run(run())
+
+        assert limiter.stats()['limited']['active'] == 0
+
+    @pytest.mark.parametrize("limits", [[], {'limited': 10}, {'limited': {'max_concurent': 1}}])
+    def test_should_reject_malformed_limits(self, limits):
+        with pytest.raises(ValueError):
+            RateLimiter(limits)
@@ -16,6 +16,7 @@ from lib.assessment.rubric_tester import (
     init,
     main,
     get_examples,
+    batch_label_student_files,
 )
 
 from lib.assessment.label import Label, InvalidResponseError
@@ -313,3 +314,16 @@ class TestInit:
         init()
 
         main_mock.assert_called_once()
+
+
+class TestBatchLabelStudentFiles:
+    def test_should_label_students_with_the_code_feature_extractor(self, mocker):
+        batch_mock = mocker.patch('lib.assessment.rubric_tester.batch_cfe_label_student_work', return_value=[('u3l13_01', {'data': []})])
+        params = {'code-feature-extractor': ['Position and Movement'], 'lesson': 'csd3-2023-L14'}
+
+        result = batch_label_student_files('rubric', ['tests/data/u3l13_01.js'], params)
+
+        with open('tests/data/u3l13_01.js', 'r') as f:
+            code = f.read()
+        batch_mock.assert_called_once_with([('u3l13_01', code)], 'rubric', ['Position and Movement'], 'csd3-2023-L14')
+        assert result == [('u3l13_01', {'data': []})]